@@ -2,12 +2,19 @@ import argparse
 import configparser
 import os
 import re
-from collections import defaultdict
+import json
+import html
+import concurrent.futures
+import warnings
+import time
+from collections import defaultdict, namedtuple, OrderedDict
 import stwcs
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
-from astropy.wcs import WCS
+from matplotlib.animation import FuncAnimation, PillowWriter
+from astropy.wcs import WCS, Sip
+from astropy.wcs.utils import proj_plane_pixel_scales
 from astropy.io import fits
 from astropy import units as u
 from astropy.visualization import astropy_mpl_style, ZScaleInterval, AsinhStretch
@@ -17,53 +24,134 @@ from astropy.coordinates import Angle
 from astroquery.simbad import Simbad
 from astropy.visualization.wcsaxes import WCSAxes
 from matplotlib.patches import Circle
+from matplotlib.path import Path
 from matplotlib.ticker import FuncFormatter
 from scipy import stats
+from scipy import ndimage
+from scipy import fft as scipy_fft
 from scipy.stats import gaussian_kde
+from scipy.spatial import cKDTree
+from scipy.interpolate import RegularGridInterpolator
+import sys
 from sys import exit
 from os import system
 import subprocess
 import glob
+import shlex
+import itertools
+import fnmatch
+import hashlib
+import contextlib
+import io
+import shutil
+import tempfile
+import socket
+import socketserver
+import threading
+import http.server
+import functools
 
 # Plotting the raw sky image from the fits file, currently coded up for ACS HRC imager
+# With quicklook=True (--quicklook), the image is memory mapped and block-averaged down to roughly screen resolution before
+# scaling and plotting, which keeps big drizzled mosaics fast and light on memory
 class RawSkyPlotter:
-    def __init__(self, fits_file):
+    def __init__(self, fits_file, quicklook=False, max_pixels=2048, sample_size=100000):
         self.fits_file = fits_file
+        self.quicklook = quicklook
+        self.max_pixels = max_pixels
+        self.sample_size = sample_size
+
+    @staticmethod
+    def find_science_extension(hdul):
+        # Try to find the science data extension
+        for i, hdu in enumerate(hdul):
+            if 'SCIEXT' in hdu.header:
+                return hdu.header['SCIEXT']
+            elif hdu.header.get('EXTNAME') in ['SCI', 'IMAGE']:
+                return i
+
+        # If no science extension found, use primary or first extension with data
+        for i, hdu in enumerate(hdul):
+            if hdu.data is not None:
+                return i
+
+        raise ValueError("No valid data extension found in FITS file")
+
+    @staticmethod
+    def block_reduce(data, factor, rows_per_chunk=2048):
+        # Average factor x factor pixel blocks, reading the (memory mapped) image a strip of rows at a time so the full-resolution
+        # image is never held in memory. Rows/columns that do not fill a whole block at the far edges are dropped
+        if factor <= 1:
+            return np.asarray(data, dtype=np.float32)
+        ny, nx = data.shape[0] // factor, data.shape[1] // factor
+        reduced = np.empty((ny, nx), dtype=np.float32)
+        blocks_per_chunk = max(1, rows_per_chunk // factor)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)  # all-NaN blocks stay NaN
+            for j0 in range(0, ny, blocks_per_chunk):
+                j1 = min(ny, j0 + blocks_per_chunk)
+                strip = np.asarray(data[j0 * factor:j1 * factor, :nx * factor], dtype=np.float32)
+                reduced[j0:j1] = np.nanmean(strip.reshape(j1 - j0, factor, nx, factor), axis=(1, 3))
+        return reduced
+
+    @staticmethod
+    def downsample_wcs(wcs, factor):
+        # WCS of the block-averaged image: pixel (i, j) of the reduced image covers pixels [i*factor, (i+1)*factor) of the original
+        if factor <= 1:
+            return wcs
+        try:
+            return wcs.slice((slice(None, None, factor), slice(None, None, factor)))
+        except Exception:
+            # Distortion tables cannot always be resampled; the linear WCS is plenty for a quick look
+            reduced = WCS(wcs.to_header())
+            reduced.wcs.crpix = (reduced.wcs.crpix - 0.5) / factor + 0.5
+            if reduced.wcs.has_cd():
+                reduced.wcs.cd = reduced.wcs.cd * factor
+            else:
+                reduced.wcs.cdelt = reduced.wcs.cdelt * factor
+            return reduced
+
+    def sampled_zscale_limits(self, image_data, seed=0):
+        # ZScale on a random sample of finite pixels rather than the whole image
+        finite = image_data[np.isfinite(image_data)]
+        if finite.size > self.sample_size:
+            finite = np.random.default_rng(seed).choice(finite, self.sample_size, replace=False)
+        return ZScaleInterval().get_limits(finite)
+
+    def load_quicklook(self):
+        with fits.open(self.fits_file, memmap=True) as hdul:
+            hdu = hdul[self.find_science_extension(hdul)]
+            data = hdu.data
+            if data.ndim > 2:
+                data = data.reshape(-1, *data.shape[-2:])[0]
+            factor = int(np.ceil(max(data.shape) / self.max_pixels))
+            image_data = self.block_reduce(data, factor)
+            wcs = self.downsample_wcs(WCS(hdu.header).celestial, factor)
+            del data
+        print(f"Quick-look: {self.fits_file} block-reduced by {factor}x to {image_data.shape[1]}x{image_data.shape[0]} pixels")
+        return image_data, wcs
 
     def plot_raw_sky(self):
         # Set up the plot style
         plt.style.use(astropy_mpl_style)
 
         try:
-            # Open the FITS file and try different extensions
-            with fits.open(self.fits_file) as hdul:
-                # Try to find the science data extension
-                sci_ext = None
-                for i, hdu in enumerate(hdul):
-                    if 'SCIEXT' in hdu.header:
-                        sci_ext = hdu.header['SCIEXT']
-                        break
-                    elif hdu.header.get('EXTNAME') in ['SCI', 'IMAGE']:
-                        sci_ext = i
-                        break
-                
-                if sci_ext is None:
-                    # If no science extension found, use primary or first extension with data
-                    for i, hdu in enumerate(hdul):
-                        if hdu.data is not None:
-                            sci_ext = i
-                            break
-                
-                if sci_ext is None:
-                    raise ValueError("No valid data extension found in FITS file")
-
-                hdu = hdul[sci_ext]
-                image_data = hdu.data
-                wcs = WCS(hdu.header)
+            if self.quicklook:
+                image_data, wcs = self.load_quicklook()
+                vmin, vmax = self.sampled_zscale_limits(image_data)
+                norm = ImageNormalize(vmin=vmin, vmax=vmax, stretch=AsinhStretch())
+                dpi = 100
+            else:
+                # Open the FITS file and try different extensions
+                with fits.open(self.fits_file) as hdul:
+                    hdu = hdul[self.find_science_extension(hdul)]
+                    image_data = hdu.data
+                    wcs = WCS(hdu.header)
 
-            # Set up scaling
-            zscale = ZScaleInterval()
-            norm = ImageNormalize(image_data, interval=zscale, stretch=AsinhStretch())
+                # Set up scaling
+                zscale = ZScaleInterval()
+                norm = ImageNormalize(image_data, interval=zscale, stretch=AsinhStretch())
+                dpi = 300
 
             # Create the plot with two subplots
             fig = plt.figure(figsize=(24, 10))
@@ -124,7 +212,7 @@ class RawSkyPlotter:
 
             # Save the plot
             output_file = 'hst_image_comparison.png'
-            plt.savefig(output_file, dpi=300, bbox_inches='tight', 
+            plt.savefig(output_file, dpi=dpi, bbox_inches='tight', 
                        facecolor='black', edgecolor='none')
             plt.close()
 
@@ -134,11 +222,246 @@ class RawSkyPlotter:
             print(f"Error processing FITS file: {e}")
             raise
 
+# Directory-wide quick look before running dolphot: renders downsampled thumbnails of every science (flt/flc/drz/drc, chip),
+# calcsky .sky and residual .res image in parallel, and collects them in a single HTML contact sheet. Thumbnails are cached in
+# '.thumbnails/' keyed by file modification time and size, so re-running only renders new or changed files. Called with --gallery
+class ThumbnailGallery:
+    SCIENCE_PATTERN = re.compile(r'_(flt|flc|drz|drc)(\.chip\d)?\.fits$')
+    KIND_ORDER = ['science', 'sky', 'residual']
+
+    def __init__(self, directory=None, thumb_pixels=256, workers=None):
+        self.directory = os.path.abspath(directory if directory else os.getcwd())
+        self.thumb_dir = os.path.join(self.directory, '.thumbnails')
+        self.cache_file = os.path.join(self.thumb_dir, 'cache.json')
+        self.thumb_pixels = thumb_pixels
+        self.workers = workers
+
+    @classmethod
+    def classify(cls, file_name):
+        # Returns 'science', 'sky', 'residual' or None for files that do not belong in the gallery (e.g. .psf.fits)
+        if file_name.endswith('.sky.fits'):
+            return 'sky'
+        if file_name.endswith('.res.fits'):
+            return 'residual'
+        if cls.SCIENCE_PATTERN.search(file_name):
+            return 'science'
+        return None
+
+    def find_images(self):
+        images = {}
+        for file_name in sorted(os.listdir(self.directory)):
+            kind = self.classify(file_name)
+            if kind:
+                images[file_name] = kind
+        return images
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    @staticmethod
+    def render_thumbnail(task):
+        # Runs in a worker process: memory map the image, block-reduce it to thumbnail size and save it as a PNG
+        fits_path, thumb_path, thumb_pixels = task
+        try:
+            with fits.open(fits_path, memmap=True) as hdul:
+                header = hdul[0].header
+                hdu = hdul[RawSkyPlotter.find_science_extension(hdul)]
+                data = hdu.data
+                if data.ndim > 2:
+                    data = data.reshape(-1, *data.shape[-2:])[0]
+                shape = data.shape
+                factor = int(np.ceil(max(shape) / thumb_pixels))
+                thumb = RawSkyPlotter.block_reduce(data, factor)
+                filter_name = header.get('FILTER') or ', '.join(str(header[key]) for key in ('FILTER1', 'FILTER2') if key in header) or 'N/A'
+                exptime = header.get('EXPTIME', 'N/A')
+                del data
+            vmin, vmax = RawSkyPlotter(fits_path).sampled_zscale_limits(thumb)
+            norm = ImageNormalize(vmin=vmin, vmax=vmax, stretch=AsinhStretch())
+            plt.imsave(thumb_path, norm(np.nan_to_num(thumb, nan=vmin)), cmap='viridis', origin='lower', vmin=0, vmax=1)
+            return {'thumb': os.path.basename(thumb_path), 'shape': list(shape), 'filter': str(filter_name), 'exptime': str(exptime), 'error': None}
+        except Exception as e:
+            return {'thumb': None, 'shape': None, 'filter': None, 'exptime': None, 'error': str(e)}
+
+    def build(self, output_file='contact_sheet.html'):
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        images = self.find_images()
+        if not images:
+            print(f"No science, sky or residual .fits files found in {self.directory}")
+            return None
+
+        # Only render files that are new, or whose modification time or size changed since the cached thumbnail was made
+        cache = self.load_cache()
+        cache = {name: entry for name, entry in cache.items() if name in images}
+        tasks = {}
+        for file_name in images:
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entry = cache.get(file_name)
+            if (entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size and not entry.get('error')
+                    and os.path.exists(os.path.join(self.thumb_dir, entry['thumb']))):
+                continue
+            cache[file_name] = {'mtime': stat.st_mtime, 'size': stat.st_size}
+            thumb_path = os.path.join(self.thumb_dir, file_name.replace('.fits', '.png'))
+            tasks[file_name] = (os.path.join(self.directory, file_name), thumb_path, self.thumb_pixels)
+
+        print(f"Found {len(images)} images, rendering {len(tasks)} new or changed thumbnails ({len(images) - len(tasks)} cached)")
+        if tasks:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for file_name, result in zip(tasks, pool.map(self.render_thumbnail, tasks.values())):
+                    cache[file_name].update(result)
+                    if result['error']:
+                        print(f"Warning: Could not render {file_name}: {result['error']}")
+
+        with open(self.cache_file, 'w') as f:
+            json.dump(cache, f, indent=2)
+
+        output_path = os.path.join(self.directory, output_file)
+        self.write_contact_sheet(output_path, images, cache)
+        print(f"Contact sheet saved as '{output_path}'")
+        return output_path
+
+    def write_contact_sheet(self, output_path, images, cache):
+        thumb_rel = os.path.relpath(self.thumb_dir, os.path.dirname(output_path))
+        lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8">',
+                 f'<title>Quick look: {html.escape(self.directory)}</title>',
+                 '<style>body{background:#111;color:#ddd;font-family:sans-serif} .grid{display:flex;flex-wrap:wrap;gap:12px}'
+                 ' figure{margin:0;width:260px} img{width:256px;border:1px solid #444} figcaption{font-size:11px;word-break:break-all}</style>',
+                 '</head><body>', f'<h1>{html.escape(self.directory)}</h1>']
+        for kind in self.KIND_ORDER:
+            names = [name for name, image_kind in images.items() if image_kind == kind]
+            if not names:
+                continue
+            lines.append(f'<h2>{kind.capitalize()} images ({len(names)})</h2><div class="grid">')
+            for name in names:
+                entry = cache[name]
+                if entry.get('thumb'):
+                    image = f'<img src="{html.escape(os.path.join(thumb_rel, entry["thumb"]))}" alt="{html.escape(name)}">'
+                    caption = f'{html.escape(name)}<br>{html.escape(entry["filter"])} | {entry["exptime"]} s | {entry["shape"][1]}x{entry["shape"][0]}'
+                else:
+                    image = '<div>(no thumbnail)</div>'
+                    caption = f'{html.escape(name)}<br>{html.escape(entry.get("error") or "")}'
+                lines.append(f'<figure>{image}<figcaption>{caption}</figcaption></figure>')
+            lines.append('</div>')
+        lines.append('</body></html>')
+        with open(output_path, 'w') as f:
+            f.write('\n'.join(lines))
+
+# A cutout: the image section (NaN outside the image), its WCS offset to the section, and the image it came from
+Cutout = namedtuple('Cutout', ['data', 'wcs', 'fits_file'])
+
+# Cutouts of a few hundred pixels around a position, without loading whole images: only the requested section is read from disk
+# (HDU.section, which also works for compressed images), and the WCS is offset to the section. SIP distortions are kept. Lookup-table
+# distortions (NPOL/D2IM), which are sub-pixel corrections, are dropped. Requests are batched so every image is opened once.
+# Cutouts are cached in memory (least recently used, memory_items) and on disk in cache_dir, keyed by the image path, size and
+# modification time, so they are rebuilt when the image changes
+class CutoutService:
+    DISTORTION_KEYWORDS = ['CPDIS1', 'CPDIS2', 'DP1', 'DP2', 'NPOLEXT', 'D2IMDIS1', 'D2IMDIS2', 'D2IM1', 'D2IM2', 'D2IMEXT', 'D2IMERR1', 'D2IMERR2']
+
+    def __init__(self, cache_dir='.cutouts', memory_items=128):
+        self.cache_dir = cache_dir
+        self.memory = OrderedDict()
+        self.memory_items = memory_items
+
+    @staticmethod
+    def cache_key(fits_file, ra, dec, size):
+        stat = os.stat(fits_file)
+        return hashlib.sha1(f"{os.path.abspath(fits_file)}|{stat.st_mtime_ns}|{stat.st_size}|{ra:.7f}|{dec:.7f}|{size}".encode()).hexdigest()
+
+    @classmethod
+    def science_wcs(cls, header):
+        header = header.copy()
+        for key in cls.DISTORTION_KEYWORDS:
+            header.remove(key, ignore_missing=True, remove_all=True)
+        return WCS(header).celestial
+
+    @staticmethod
+    def offset_wcs(wcs, x0, y0):
+        # WCS of the section starting at pixel (x0, y0) of the full image; x0/y0 may be negative for cutouts hanging over the edge
+        offset = wcs.deepcopy()
+        offset.wcs.crpix = offset.wcs.crpix - np.array([x0, y0])
+        if offset.sip is not None:
+            offset.sip = Sip(offset.sip.a, offset.sip.b, offset.sip.ap, offset.sip.bp, offset.wcs.crpix)
+        return offset
+
+    @classmethod
+    def read_section(cls, hdu, wcs, ra, dec, size):
+        # size: pixels, or an angle (e.g. 10 * u.arcsec). The position falls on the central pixel
+        if isinstance(size, u.Quantity):
+            size = int(np.ceil((size / (proj_plane_pixel_scales(wcs)[0] * u.deg)).decompose().value))
+        cx, cy = wcs.all_world2pix(ra, dec, 0, quiet=True)
+        x0, y0 = int(round(float(cx))) - size // 2, int(round(float(cy))) - size // 2
+        ny, nx = hdu.shape[-2:]
+        data = np.full((size, size), np.nan, dtype=np.float32)
+        sx0, sy0, sx1, sy1 = max(0, x0), max(0, y0), min(nx, x0 + size), min(ny, y0 + size)
+        if sx1 > sx0 and sy1 > sy0:
+            data[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = hdu.section[sy0:sy1, sx0:sx1]
+        return data, cls.offset_wcs(wcs, x0, y0)
+
+    def remember(self, key, cutout):
+        self.memory[key] = cutout
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def cutouts(self, requests):
+        # requests: list of (fits_file, ra, dec, size). Returns one Cutout per request, in order
+        results = [None] * len(requests)
+        pending = defaultdict(list)
+        for index, (fits_file, ra, dec, size) in enumerate(requests):
+            key = self.cache_key(fits_file, ra, dec, size)
+            cache_file = os.path.join(self.cache_dir, f"{key}.fits")
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                results[index] = self.memory[key]
+            elif os.path.isfile(cache_file):
+                with fits.open(cache_file) as hdul:
+                    results[index] = Cutout(hdul[0].data, WCS(hdul[0].header), fits_file)
+                self.remember(key, results[index])
+            else:
+                pending[fits_file].append((index, key, ra, dec, size))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for fits_file, items in pending.items():
+            with fits.open(fits_file, memmap=True) as hdul:
+                hdu = hdul[RawSkyPlotter.find_science_extension(hdul)]
+                wcs = self.science_wcs(hdu.header)
+                for index, key, ra, dec, size in items:
+                    data, cutout_wcs = self.read_section(hdu, wcs, ra, dec, size)
+                    header = cutout_wcs.to_header(relax=True)
+                    header['ORIGFILE'] = (os.path.basename(fits_file), 'Image the cutout was taken from')
+                    fits.PrimaryHDU(data, header=header).writeto(os.path.join(self.cache_dir, f"{key}.fits"), overwrite=True)
+                    results[index] = Cutout(data, cutout_wcs, fits_file)
+                    self.remember(key, results[index])
+        return results
+
+    def cutout(self, fits_file, ra, dec, size=200):
+        return self.cutouts([(fits_file, ra, dec, size)])[0]
+
+    def save_panel(self, cutouts, ra, dec, output_file, labels=None):
+        # All cutouts of one position side by side, with the position marked
+        fig = plt.figure(figsize=(4 * len(cutouts), 4.5))
+        for index, cutout in enumerate(cutouts):
+            ax = fig.add_subplot(1, len(cutouts), index + 1, projection=cutout.wcs)
+            finite = cutout.data[np.isfinite(cutout.data)]
+            vmin, vmax = ZScaleInterval().get_limits(finite) if finite.size else (0, 1)
+            ax.imshow(cutout.data, origin='lower', cmap='gray', vmin=vmin, vmax=vmax)
+            ax.scatter(ra, dec, transform=ax.get_transform('world'), s=200, facecolors='none', edgecolors='red')
+            ax.set_title(labels[index] if labels else os.path.basename(cutout.fits_file), fontsize=9)
+            ax.set_xlabel('RA')
+            ax.set_ylabel('Dec')
+        fig.tight_layout()
+        fig.savefig(output_file, dpi=150)
+        plt.close(fig)
+        print(f"Cutouts saved to {output_file}")
+
 # Coding up the automation of the dolphot processing: Written by Joseph Guzman @josephguzman1994@gmail.com
 class TerminalCommandExecutor:
 
-    def plot_raw_sky(self, fits_file):
-        plotter = RawSkyPlotter(fits_file)
+    def plot_raw_sky(self, fits_file, quicklook=False):
+        plotter = RawSkyPlotter(fits_file, quicklook=quicklook)
         plotter.plot_raw_sky()
     
     # Step 0: if you used a different photometric system on your last use of dolphot, you need to run 'make clean' and 'make' in 'makefile' directory
@@ -169,7 +492,10 @@ class TerminalCommandExecutor:
         
         if choice == 'yes' or choice == 'y':
             # Execute 'make clean' in makefile directory
-            subprocess.run(['make', 'clean'], cwd=make_path)
+            result = subprocess.run(['make', 'clean'], cwd=make_path)
+            if result.returncode != 0:
+                print("Error occurred during make clean.")
+                return
             print("make clean executed successfully!")
 
             # Preparing to run 'make'. First, scrub config.ini for 'system_name' in DOLPHOT config, to find desired photometric system to run make
@@ -191,66 +517,84 @@ class TerminalCommandExecutor:
                     print("Invalid choice. Please pick from the listed systems.")
                     exit(1)
             
-            # Print statements for user to verify path and option
-            print(f"Reading Makefile from: {os.path.join(make_path, 'Makefile')}")
-
-            print(f"Editing the Makefile to use {system_choice}...")
-
-            # Read in the 'Makefile'
-            makefile_path = os.path.join(make_path, 'Makefile')
-            with open(makefile_path, 'r') as file:
-                lines = file.readlines()
-
-            # Define the photometric system options found in Makefile
-            system_options = [
-                    'export USEWFPC2', 'export USEACS', 'export USEWFC3', 
-                    'export USEROMAN', 'export USENIRCAM', 'export USENIRISS', 'export USEMIRI'
-            ]
-
-            # Generate list of all systems ASIDE from the user's chosen system, used to find lines to edit later
-            other_systems = [option for option in system_options if option != f'export USE{system_choice}']
-                
-            # Prepare to edit 'Makefile'
-            edited_lines = []
-            for line in lines:
-                    
-                # Check if the line is already commented
-                is_commented = line.strip().startswith('#')
-
-                # Check if the line starts with any of the 'other_systems' and is not already commented, then comment it out
-                if any(line.strip().startswith(option) and not is_commented for option in other_systems):
-                    print(f"Editing line for other systems: {line.strip()}")
-                    edited_line = '#' + line.strip()
-                    edited_lines.append(edited_line)
-                    print(f"Edited line: {edited_line}")  # Print the edited line
-
-                # Match lines with or without comments that start with "export USE", followed by the user's system choice and "=1"
-                elif re.match(r'^\s*#?\s*export USE{0}=1$'.format(system_choice), line.strip()):
-                    print(f"Editing line for {system_choice}: {line.strip()}")
-                    edited_line = line.replace('#', '') if is_commented else line  # Remove comment for the user's chosen system
-                    edited_lines.append(edited_line)
-                    print(f"Edited line: {edited_line}")  # Print the edited line
-
-                else:
-                    edited_lines.append(line)
-
-            # Write the modified lines back to the Makefile
-            with open(makefile_path, 'w') as file:
-                file.writelines(edited_lines)
+            # Edit the Makefile for the chosen system, then execute 'make' in the makefile directory to prep the dolphot process
+            TerminalCommandExecutor.edit_makefile(make_path, system_choice)
+            TerminalCommandExecutor.build_dolphot(make_path)
+        else:
+            print("make clean not executed.")
 
-            print("Makefile editing complete.")
+    # Comment out every 'export USE<system>' line except the one for system_choice, which is uncommented
+    @staticmethod
+    def edit_makefile(make_path, system_choice):
+        # Print statements for user to verify path and option
+        print(f"Reading Makefile from: {os.path.join(make_path, 'Makefile')}")
+
+        print(f"Editing the Makefile to use {system_choice}...")
+
+        # Read in the 'Makefile'
+        makefile_path = os.path.join(make_path, 'Makefile')
+        with open(makefile_path, 'r') as file:
+            lines = file.readlines()
+
+        # Define the photometric system options found in Makefile
+        system_options = [
+                'export USEWFPC2', 'export USEACS', 'export USEWFC3', 
+                'export USEROMAN', 'export USENIRCAM', 'export USENIRISS', 'export USEMIRI'
+        ]
+
+        # Generate list of all systems ASIDE from the user's chosen system, used to find lines to edit later
+        other_systems = [option for option in system_options if option != f'export USE{system_choice}']
+
+        # Prepare to edit 'Makefile'
+        edited_lines = []
+        for line in lines:
+
+            # Check if the line is already commented
+            is_commented = line.strip().startswith('#')
+
+            # Check if the line starts with any of the 'other_systems' and is not already commented, then comment it out
+            if any(line.strip().startswith(option) and not is_commented for option in other_systems):
+                print(f"Editing line for other systems: {line.strip()}")
+                edited_line = '#' + line.strip() + '\n'
+                edited_lines.append(edited_line)
+                print(f"Edited line: {edited_line}")  # Print the edited line
+
+            # Match lines with or without comments that start with "export USE", followed by the user's system choice and "=1"
+            elif re.match(r'^\s*#?\s*export USE{0}=1$'.format(system_choice), line.strip()):
+                print(f"Editing line for {system_choice}: {line.strip()}")
+                edited_line = line.replace('#', '') if is_commented else line  # Remove comment for the user's chosen system
+                edited_lines.append(edited_line)
+                print(f"Edited line: {edited_line}")  # Print the edited line
 
-            # Now that the Makefile has been edited, we can finally execute 'make' in the makefile directory to prep the dolphot process
-            # Run 'make' command
-            print("Running 'make'...")
-            result = subprocess.run(['make'], cwd=make_path)
-            if result.returncode == 0:
-                print("make executed successfully!")
             else:
-                print("Error occurred during make.")
-                # Handle error if needed
+                edited_lines.append(line)
+
+        # Write the modified lines back to the Makefile
+        with open(makefile_path, 'w') as file:
+            file.writelines(edited_lines)
+
+        print("Makefile editing complete.")
+
+    # Run 'make' (optionally preceded by 'make clean') in the makefile directory. Returns True if the build succeeded
+    @staticmethod
+    def build_dolphot(make_path, clean=False, jobs=1):
+        if clean:
+            result = subprocess.run(['make', 'clean'], cwd=make_path)
+            if result.returncode != 0:
+                print("Error occurred during make clean.")
+                return False
+            print("make clean executed successfully!")
+
+        # Now that the Makefile has been edited, we can finally execute 'make' in the makefile directory to prep the dolphot process
+        # Run 'make' command
+        print("Running 'make'...")
+        result = subprocess.run(['make', f'-j{jobs}'] if jobs > 1 else ['make'], cwd=make_path)
+        if result.returncode == 0:
+            print("make executed successfully!")
         else:
-            print("make clean not executed.")
+            print("Error occurred during make.")
+            # Handle error if needed
+        return result.returncode == 0
 
     # Executing the whole dolphot block is long, and there are many potential breaking points.
     # Defining function to log and print error details, and suggest recovery actions.
@@ -411,7 +755,14 @@ class TerminalCommandExecutor:
 
     # Extra Option: Each image in dolphot photometry allows you to specify imgshift and imgform, in case you want to play with that
     # Call --customize-img, then you can specify which image and values you want to alter
-    def customize_image_parameters(self, selected_files):
+    # customizations: {image index: (shift, xform)} given in advance (headless API) are checked against the images instead of prompting
+    def customize_image_parameters(self, selected_files, customizations=None):
+        if customizations is not None:
+            invalid = [index for index in customizations if not 0 <= int(index) < len(selected_files)]
+            if invalid:
+                raise ValueError(f"Invalid image index {invalid}, {len(selected_files)} images were selected")
+            return {int(index): (shift or "0 0", xform or "1 0 0") for index, (shift, xform) in customizations.items()}
+
         print("Available images for customization:")
         for index, file in enumerate(selected_files):
             print(f"{index}: {file}")
@@ -438,22 +789,25 @@ class TerminalCommandExecutor:
         return customizations
 
     # Step 4b: Create and edit dolphot parameter file
-    def write_parameter_file(self, selected_files, customizations, config_file):
+    # param_file: name of the parameter file, default {obj_name}_{system_name}_phot.param
+    def write_parameter_file(self, selected_files, customizations, config_file, overwrite=None, param_file=None):
         config = configparser.ConfigParser()
         config.optionxform = str  # Preserve case sensitivity of keys
         config.read(config_file)
 
         obj_name = config['DOLPHOT_CONFIG']['obj_name']
         system_name = config['DOLPHOT_CONFIG']['system_name']
-        param_file = f"{obj_name}_{system_name}_phot.param"
+        param_file = param_file or f"{obj_name}_{system_name}_phot.param"
 
         # Check if parameter file already exists
         file_exists = os.path.isfile(param_file)
         
         try:
             if file_exists:
-                user_input = input(f"Found '{param_file}' already exists. Do you want to make a new one? (y/n): ")
-                if user_input.lower() not in ('y', 'yes'):
+                # overwrite=True/False answers the prompt in advance, e.g. for batch runs with --yes
+                if overwrite is None:
+                    overwrite = input(f"Found '{param_file}' already exists. Do you want to make a new one? (y/n): ").lower() in ('y', 'yes')
+                if not overwrite:
                     print("Skipping parameter file creation")
                     return False, file_exists
 
@@ -487,6 +841,20 @@ class TerminalCommandExecutor:
             self.log_error_and_suggest("Failed to create/update the parameter file.", e,
                                        "Check the selected image files. Verify the existence of drc/drz files. Verify system_name and corresponding [section], key-value pairs exists for system in config.ini.")
 
+    # Set dolphot parameters in an existing parameter file, e.g. for forced photometry or parameter sweeps. Lines defining them are
+    # dropped and the new values appended, so each is defined once
+    @staticmethod
+    def set_param_values(param_file, values):
+        keys = {key.lower() for key in values}
+        with open(param_file) as f:
+            lines = [line for line in f if line.split('=')[0].strip().lower() not in keys]
+        with open(param_file, 'w') as f:
+            f.writelines(lines)
+            if lines and not lines[-1].endswith('\n'):
+                f.write('\n')
+            for key, value in values.items():
+                f.write(f"{key} = {value}\n")
+
     # Step 4c: Find the parameters associated with specific sections. Define system_name = (e.g.: ACS_HRC) under [DOLPHOT_CONFIG] in config.ini
     # Refer to various dolphot manuals for how to define everything
     def get_section_data(self, config_file, section_name):
@@ -506,26 +874,37 @@ class TerminalCommandExecutor:
         return section_data
 
     # Step 5: With the parameter file created, we can finally execute dolphot
-    def execute_dolphot(self, obj_name, param_file, working_directory, config):
+    # system_name overrides the one in config.ini in the output, log and status file names, e.g. to keep a forced photometry run apart
+    def execute_dolphot(self, obj_name, param_file, working_directory, config, prompt=True, system_name=None):
         # Fetch system name from the configuration
-        system_name = config['DOLPHOT_CONFIG'].get('system_name', 'default_system')
+        system_name = system_name or config['DOLPHOT_CONFIG'].get('system_name', 'default_system')
 
-        # Prompt the user to confirm execution of dolphot
-        user_input = input("Would you like to execute dolphot? This will take awhile and should not be interrupted. (y/n): ")
-        if user_input.lower() not in ('y', 'yes'):
-            print("Dolphot execution cancelled.")
-            return False
+        # Prompt the user to confirm execution of dolphot, unless the caller already confirmed (e.g. the benchmark harness)
+        if prompt:
+            user_input = input("Would you like to execute dolphot? This will take awhile and should not be interrupted. (y/n): ")
+            if user_input.lower() not in ('y', 'yes'):
+                print("Dolphot execution cancelled.")
+                return False
 
         # Construct the dolphot terminal command 
         output_phot_file = f"{obj_name}_{system_name}.phot"
         log_file = f"dolphot_{obj_name}_{system_name}.log"
-        command = f"time dolphot {output_phot_file} -p{param_file} >> {log_file}"
+        command = f"dolphot {output_phot_file} -p{param_file} >> {log_file}"
 
-        # Execute the command in the working directory
+        # Execute the command in the working directory. Dolphot can run for days, so tail its log while it runs
+        # and publish progress/ETA to a small .status.json file that schedulers can poll
         print(f"Executing dolphot command: {command}")
+        monitor = DolphotProgressMonitor(os.path.join(working_directory, log_file), obj_name, system_name, working_directory,
+                                         history_file=config['DOLPHOT_CONFIG'].get('stage_history'),
+                                         poll_interval=float(config['DOLPHOT_CONFIG'].get('monitor_interval', 30)))
         try:
-            subprocess.run(command, shell=True, cwd=working_directory, check=True)
-            print(f"Dolphot executed successfully! Output logged in {log_file}.\n")
+            # Timed here rather than with the shell's 'time' keyword, which /bin/sh does not have
+            start_time = time.time()
+            process = subprocess.Popen(command, shell=True, cwd=working_directory)
+            returncode = monitor.watch(process)
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command)
+            print(f"Dolphot executed successfully in {(time.time() - start_time) / 3600:.2f} h! Output logged in {log_file}.\n")
             print(f"Output photometry file: {output_phot_file}")
             return True
         except subprocess.CalledProcessError as e:
@@ -582,6 +961,535 @@ class TerminalCommandExecutor:
             print("DOLPHOT_CONFIG section is missing in the config.")
 
 
+# Instead of editing the Makefile and running 'make clean' + 'make' in the dolphot2.0 directory on every camera switch, keep one prebuilt
+# copy of the DOLPHOT tree per system configuration. Each tree is keyed by the active Makefile flags and a hash of the DOLPHOT sources, so it is
+# only rebuilt (with parallel make) when either changes, and each run selects its tree through PATH. This also lets fields with different
+# systems run at the same time. Trees live in '~/.karlach/dolphot_builds' (override with 'build_cache =' under [DOLPHOT_CONFIG]);
+# set 'use_build_cache = no' to keep the old in-place 'make' behavior
+class DolphotBuildCache:
+    SOURCE_EXTENSIONS = ('.c', '.h')
+    STAMP_FILE = '.karlach_build.json'
+
+    def __init__(self, make_path, cache_dir=None, jobs=None):
+        self.make_path = os.path.abspath(os.path.expanduser(make_path))
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else os.path.expanduser('~/.karlach/dolphot_builds')
+        self.jobs = jobs if jobs else os.cpu_count()
+
+    @classmethod
+    def from_config(cls, config):
+        # Returns None when the cache is disabled or DOLPHOT's make_path is unknown, in which case dolphot is used from PATH as before
+        dolphot_config = config['DOLPHOT_CONFIG'] if 'DOLPHOT_CONFIG' in config else {}
+        make_path = dolphot_config.get('make_path')
+        if str(dolphot_config.get('use_build_cache', 'yes')).lower() in ('no', 'n', 'false', '0'):
+            return None
+        if not make_path or not os.path.exists(os.path.expanduser(make_path)):
+            return None
+        jobs = dolphot_config.get('make_jobs')
+        return cls(make_path, dolphot_config.get('build_cache'), int(jobs) if jobs else None)
+
+    @staticmethod
+    def system_choice(system_name):
+        base_system_name = (system_name or '').split('_')[0].upper()
+        return base_system_name if base_system_name in BatchRunner.VALID_SYSTEMS else None
+
+    def source_hash(self):
+        # Hash of every C source/header and Makefile in the DOLPHOT tree. The 'export USE<system>' lines are left out,
+        # as they are part of the flags in the build key
+        digest = hashlib.sha1()
+        for root, dirs, files in os.walk(self.make_path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not (file_name.endswith(self.SOURCE_EXTENSIONS) or file_name.startswith('Makefile')):
+                    continue
+                path = os.path.join(root, file_name)
+                digest.update(os.path.relpath(path, self.make_path).encode())
+                with open(path, 'rb') as f:
+                    content = f.read()
+                if file_name.startswith('Makefile'):
+                    content = b''.join(line for line in content.splitlines(True) if not re.match(rb'^\s*#?\s*export USE', line))
+                digest.update(content)
+        return digest.hexdigest()
+
+    @staticmethod
+    def makefile_flags(makefile_path):
+        # Active (uncommented) variable definitions of an edited Makefile, e.g. 'export USEACS=1', 'CFLAGS=...'
+        with open(makefile_path, 'r') as f:
+            return sorted(line.strip() for line in f if '=' in line and re.match(r'^\s*(export\s+)?\w+\s*[:+?]?=', line))
+
+    def build_key(self, system_choice):
+        # Flags of the Makefile as it would be edited for system_choice, without touching the original
+        scratch_dir = tempfile.mkdtemp(prefix='karlach_makefile_')
+        try:
+            shutil.copy2(os.path.join(self.make_path, 'Makefile'), scratch_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                TerminalCommandExecutor.edit_makefile(scratch_dir, system_choice)
+            flags = self.makefile_flags(os.path.join(scratch_dir, 'Makefile'))
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        source_hash = self.source_hash()
+        key = hashlib.sha1(('\n'.join(flags) + '\n' + source_hash).encode()).hexdigest()[:12]
+        return key, flags, source_hash
+
+    @staticmethod
+    def link_or_copy(src, dst):
+        # Hard links make the copy of the (multi-GB, with PSFs) DOLPHOT tree nearly free. Files that are edited or rebuilt get replaced, never written in place
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+        return dst
+
+    def ensure(self, system_name):
+        # Return the install tree for system_name, building it if it does not exist yet
+        system_choice = self.system_choice(system_name)
+        if not system_choice:
+            raise ValueError(f"System name '{system_name}' is not recognized. Valid options are: {BatchRunner.VALID_SYSTEMS}")
+        key, flags, source_hash = self.build_key(system_choice)
+        tree = os.path.join(self.cache_dir, f"{system_choice}_{key}")
+        if os.path.exists(os.path.join(tree, self.STAMP_FILE)):
+            return tree
+
+        print(f"Building DOLPHOT for {system_choice} in {tree} (make -j{self.jobs})...")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix=f"{system_choice}_{key}.", dir=self.cache_dir)
+        try:
+            os.rmdir(build_dir)
+            shutil.copytree(self.make_path, build_dir, symlinks=True, copy_function=self.link_or_copy,
+                            ignore=shutil.ignore_patterns('*.o', '*.a', 'bin'))
+            os.makedirs(os.path.join(build_dir, 'bin'), exist_ok=True)
+            # Replace the hard-linked Makefile by a real copy before editing it, so the original tree is left alone
+            makefile_path = os.path.join(build_dir, 'Makefile')
+            os.remove(makefile_path)
+            shutil.copy2(os.path.join(self.make_path, 'Makefile'), makefile_path)
+            TerminalCommandExecutor.edit_makefile(build_dir, system_choice)
+            if not TerminalCommandExecutor.build_dolphot(build_dir, jobs=self.jobs):
+                raise RuntimeError(f"make failed for {system_choice} in {build_dir}")
+            with open(os.path.join(build_dir, self.STAMP_FILE), 'w') as f:
+                json.dump({'system': system_choice, 'flags': flags, 'source_hash': source_hash,
+                           'built': time.strftime('%Y-%m-%dT%H:%M:%S')}, f, indent=2)
+            try:
+                os.rename(build_dir, tree)
+            except OSError:
+                # Another run finished the same build first, use that one
+                shutil.rmtree(build_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        return tree
+
+    def activate(self, system_name):
+        # Put the tree for system_name first on PATH for this process and everything it starts (mask, splitgroups, calcsky, dolphot)
+        tree = self.ensure(system_name)
+        os.environ['PATH'] = os.path.join(tree, 'bin') + os.pathsep + os.environ.get('PATH', '')
+        print(f"Using DOLPHOT build: {tree}")
+        return tree
+
+
+# Dolphot only reports progress through its log, which is of little use when a run takes days. This monitor tails the log while
+# dolphot runs, recognizes the stage markers, and estimates progress / ETA from the stage timings of previous runs.
+# Status is published to the terminal and to 'dolphot_{obj_name}_{system_name}.status.json' so a scheduler can decide whether to start another job
+class DolphotProgressMonitor:
+    # Stages in the order dolphot runs them, with the log lines that announce them (anchored at the start of the line, so progress
+    # messages that merely mention e.g. 'output' do not move the stage)
+    STAGES = [
+        ('setup', re.compile(r'^\s*reading (image|fits)', re.IGNORECASE)),
+        ('alignment', re.compile(r'^\s*(alignment|aligning)', re.IGNORECASE)),
+        ('star_finding', re.compile(r'^\s*finding stars', re.IGNORECASE)),
+        ('photometry', re.compile(r'^\s*(iterating psf photometry|psf photometry|photometry pass|iteration\s+\d+)', re.IGNORECASE)),
+        ('second_pass', re.compile(r'^\s*second pass', re.IGNORECASE)),
+        ('aperture_correction', re.compile(r'^\s*(computing )?aperture correction', re.IGNORECASE)),
+        ('output', re.compile(r'^\s*writing (output )?photometry', re.IGNORECASE)),
+    ]
+    # Patterns are tried most specific first, e.g. 'Second pass ... iteration 2' is second_pass, not photometry
+    MATCH_ORDER = ['second_pass', 'aperture_correction', 'output', 'star_finding', 'alignment', 'setup', 'photometry']
+    # Numbered pass markers inside the photometry stage. Entering the stage counts as the first pass
+    PASS_MARKER = re.compile(r'^\s*(photometry pass|iteration)\s+(\d+)', re.IGNORECASE)
+    # Rough fraction of the total runtime spent in each stage, used until there is a history for the photometric system
+    DEFAULT_WEIGHTS = {'setup': 0.02, 'alignment': 0.08, 'star_finding': 0.15, 'photometry': 0.45,
+                       'second_pass': 0.25, 'aperture_correction': 0.03, 'output': 0.02}
+    MAX_HISTORY = 10
+
+    def __init__(self, log_file, obj_name, system_name, working_directory=None, history_file=None, poll_interval=30):
+        self.log_file = log_file
+        self.obj_name = obj_name
+        self.system_name = system_name
+        working_directory = working_directory if working_directory else os.getcwd()
+        self.status_file = os.path.join(working_directory, f"dolphot_{obj_name}_{system_name}.status.json")
+        self.history_file = os.path.expanduser(history_file) if history_file else os.path.expanduser('~/.karlach/dolphot_stage_history.json')
+        self.poll_interval = poll_interval
+
+        # The log is opened in append mode by the dolphot command, so only read what is written after this run starts
+        self.log_offset = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+        self.stage_names = [name for name, _ in self.STAGES]
+        self.patterns = dict(self.STAGES)
+        self.current_stage = None
+        self.photometry_passes = 0
+        self.stage_started = {}
+        self.stage_durations = defaultdict(float)
+        self.expected = self.load_expected_durations()
+
+    def load_expected_durations(self):
+        # Average the per-stage durations of previous runs for this photometric system, None if there is no history yet
+        try:
+            with open(self.history_file, 'r') as f:
+                runs = json.load(f).get(self.system_name, [])
+        except (IOError, ValueError):
+            return None
+        if not runs:
+            return None
+        return {stage: float(np.mean([run.get(stage, 0.0) for run in runs])) for stage in self.stage_names}
+
+    def save_stage_history(self):
+        # A log without any recognized stage says nothing about the stage durations, and would pull every average to 0
+        if not self.stage_durations:
+            return
+        try:
+            with open(self.history_file, 'r') as f:
+                history = json.load(f)
+        except (IOError, ValueError):
+            history = {}
+        runs = history.get(self.system_name, []) + [dict(self.stage_durations)]
+        history[self.system_name] = runs[-self.MAX_HISTORY:]
+        os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
+        with open(self.history_file, 'w') as f:
+            json.dump(history, f, indent=2)
+
+    def read_new_lines(self):
+        if not os.path.exists(self.log_file):
+            return []
+        with open(self.log_file, 'r', errors='replace') as f:
+            f.seek(self.log_offset)
+            lines = f.readlines()
+            self.log_offset = f.tell()
+        return lines
+
+    def enter_stage(self, stage, now):
+        # Close the running stage and start the new one. Stages only move forward
+        if stage == self.current_stage:
+            return
+        if self.current_stage is not None:
+            if self.stage_names.index(stage) < self.stage_names.index(self.current_stage):
+                return
+            self.stage_durations[self.current_stage] += now - self.stage_started[self.current_stage]
+        if stage == 'photometry':
+            self.photometry_passes += 1
+        self.current_stage = stage
+        self.stage_started[stage] = now
+
+    def parse_lines(self, lines, now):
+        for line in lines:
+            if self.current_stage == 'photometry':
+                marker = self.PASS_MARKER.search(line)
+                if marker and int(marker.group(2)) > 1:
+                    self.photometry_passes += 1
+                    continue
+            for stage in self.MATCH_ORDER:
+                if self.patterns[stage].search(line):
+                    self.enter_stage(stage, now)
+                    break
+
+    def estimate_progress(self, now, start_time):
+        # Returns (fraction complete, seconds remaining). Remaining time is None until it can be estimated
+        elapsed = now - start_time
+        if self.current_stage is None:
+            return 0.0, None
+        index = self.stage_names.index(self.current_stage)
+        in_stage = now - self.stage_started[self.current_stage]
+
+        if self.expected:
+            total = sum(self.expected.values())
+            done = sum(self.expected[stage] for stage in self.stage_names[:index])
+            # Never claim a stage is finished while it is still running
+            done += min(in_stage, 0.95 * self.expected[self.current_stage])
+            fraction = done / total if total > 0 else 0.0
+            return fraction, max(total - done, 0.0)
+
+        weights = self.DEFAULT_WEIGHTS
+        fraction = sum(weights[stage] for stage in self.stage_names[:index])
+        if fraction <= 0:
+            return 0.0, None
+        # Without a history, extrapolate the total runtime from the time taken by the completed stages
+        total = (elapsed - in_stage) / fraction
+        if total <= 0:
+            return fraction, None
+        fraction = min(fraction + weights[self.current_stage] * min(in_stage / (weights[self.current_stage] * total), 0.95), 1.0)
+        return fraction, max(total * (1 - fraction), 0.0)
+
+    def publish(self, state, now, start_time, pid=None):
+        # A failed run has no remaining time to report
+        if state == 'running':
+            fraction, remaining = self.estimate_progress(now, start_time)
+        else:
+            fraction, remaining = (1.0, 0.0) if state == 'finished' else (None, None)
+        status = {
+            'obj_name': self.obj_name,
+            'system_name': self.system_name,
+            'pid': pid,
+            'state': state,
+            'stage': self.current_stage,
+            'photometry_passes': self.photometry_passes,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start_time)),
+            'updated': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now)),
+            'elapsed_s': round(now - start_time, 1),
+            'progress': round(fraction, 4) if fraction is not None else None,
+            'eta_s': round(remaining, 1) if remaining is not None else None,
+            'eta': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now + remaining)) if remaining is not None else None,
+            'log_file': self.log_file,
+        }
+        # Write to a temporary file and rename, so readers never see a partially written status
+        tmp_file = self.status_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_file, self.status_file)
+
+        progress = f"{100 * status['progress']:.1f}%" if status['progress'] is not None else "?"
+        eta = f"{status['eta_s'] / 3600:.1f} h remaining" if status['eta_s'] is not None else "ETA unknown"
+        print(f"\r[dolphot] {state} | stage: {self.current_stage or 'starting'} | passes: {self.photometry_passes} | {progress} | {eta}   ",
+              end='' if state == 'running' else '\n', flush=True)
+        return status
+
+    def watch(self, process):
+        # Poll the running dolphot process until it exits, then store the stage timings for future ETA estimates
+        start_time = time.time()
+        while process.poll() is None:
+            now = time.time()
+            self.parse_lines(self.read_new_lines(), now)
+            self.publish('running', now, start_time, pid=process.pid)
+            try:
+                process.wait(timeout=self.poll_interval)
+            except subprocess.TimeoutExpired:
+                pass
+
+        now = time.time()
+        self.parse_lines(self.read_new_lines(), now)
+        if self.current_stage is not None:
+            self.stage_durations[self.current_stage] += now - self.stage_started[self.current_stage]
+        if process.returncode == 0:
+            self.publish('finished', now, start_time, pid=process.pid)
+            self.save_stage_history()
+        else:
+            self.publish('failed', now, start_time, pid=process.pid)
+        return process.returncode
+
+    @staticmethod
+    def read_status(status_file):
+        with open(status_file, 'r') as f:
+            return json.load(f)
+
+
+# Forced photometry: rerun dolphot on a field using the stars of an existing catalog as a fixed input list (xytfile), so adding an epoch
+# or filter skips star finding and only measures the known positions. Positions are in the frame of the reference image (img0), which
+# must be the one the existing catalog was made with. Optional [FORCED_PHOT] keys in config.ini: phot_file (existing catalog), object_types
+# (DOLPHOT types to keep, default 1, 2), images (comma separated globs of the images to measure besides the reference, default all).
+# Any other key is written into the forced param file as a dolphot parameter, overriding the [system_name] value
+class ForcedPhotometry:
+    RESERVED_KEYS = ('phot_file', 'object_types', 'images')
+
+    def __init__(self, phot_file, object_types=(1, 2), images=None, overrides=None):
+        self.phot_file = phot_file
+        self.object_types = tuple(object_types)
+        self.images = images
+        self.overrides = overrides or {}
+
+    @classmethod
+    def from_config(cls, config, phot_file=None):
+        settings = config['FORCED_PHOT'] if 'FORCED_PHOT' in config else {}
+        phot_file = phot_file or settings.get('phot_file') or config['DOLPHOT_CONFIG'].get('phot_file')
+        if not phot_file or not os.path.isfile(phot_file):
+            raise ValueError(f"Existing catalog '{phot_file}' not found. Pass it to --forced_phot or set phot_file under [FORCED_PHOT]")
+        object_types = [int(t) for t in settings.get('object_types', '1, 2').split(',')]
+        images = [pattern.strip() for pattern in settings['images'].split(',')] if settings.get('images') else None
+        overrides = {key: value for key, value in settings.items() if key not in cls.RESERVED_KEYS and key not in config.defaults()}
+        return cls(phot_file, object_types, images, overrides)
+
+    def write_positions(self, xyt_file, region=None):
+        # ext, chip, X, Y and object type of every kept star (.phot columns 1-4 and 11). region: (x_min, y_min, x_max, y_max) to keep
+        count = 0
+        with open(self.phot_file) as source, open(xyt_file, 'w') as out:
+            for line in source:
+                columns = line.split()
+                if len(columns) < 11 or int(float(columns[10])) not in self.object_types:
+                    continue
+                if region and not (region[0] <= float(columns[2]) <= region[2] and region[1] <= float(columns[3]) <= region[3]):
+                    continue
+                out.write(f"{columns[0]} {columns[1]} {columns[2]} {columns[3]} {columns[10]}\n")
+                count += 1
+        return count
+
+    def select_images(self, selected_files):
+        # The reference image always stays img0
+        if not self.images:
+            return selected_files
+        new_images = [f for f in selected_files[1:] if any(fnmatch.fnmatch(f, pattern) for pattern in self.images)]
+        return selected_files[:1] + new_images
+
+    def run(self, field_dir, config, prompt=True):
+        # config should be read with optionxform = str, as dolphot parameter names are case sensitive
+        executor = TerminalCommandExecutor()
+        obj_name, system_name = config['DOLPHOT_CONFIG']['obj_name'], config['DOLPHOT_CONFIG']['system_name']
+        forced_name = f"{system_name}_forced"
+
+        selected_files = self.select_images(executor.find_chip_files(field_dir, system_name))
+        if len(selected_files) < 2:
+            raise ValueError("No images to measure besides the reference image")
+        ref_file = config['DOLPHOT_CONFIG'].get('ref_file')
+        if ref_file and os.path.splitext(os.path.basename(ref_file))[0] != os.path.splitext(selected_files[0])[0]:
+            print(f"Warning: the reference image {selected_files[0]} differs from ref_file {ref_file}. The positions of {self.phot_file} are in the frame of the image it was made with")
+
+        xyt_file = f"{obj_name}_{forced_name}.xyt"
+        count = self.write_positions(os.path.join(field_dir, xyt_file))
+        if count == 0:
+            raise ValueError(f"No stars of types {self.object_types} in {self.phot_file}")
+        print(f"Forced photometry of {count} stars from {self.phot_file} on {len(selected_files) - 1} images")
+
+        param_file = f"{obj_name}_{forced_name}_phot.param"
+        with working_directory(field_dir) as cwd:
+            # write_parameter_file returns (created, existed), or None if writing failed
+            result = executor.write_parameter_file(selected_files, {}, 'config.ini', overwrite=True, param_file=param_file)
+            if not result or not result[0]:
+                raise ValueError(f"Could not write {param_file}")
+            executor.set_param_values(param_file, dict(self.overrides, xytfile=xyt_file))
+            build_cache = DolphotBuildCache.from_config(config)
+            if build_cache:
+                build_cache.activate(system_name)
+            return executor.execute_dolphot(obj_name, param_file, cwd, config, prompt=prompt, system_name=forced_name)
+
+
+# Parameter sweeps: one dolphot run per combination of the parameter values listed under [SWEEP] (e.g. FitSky = 1, 2, 3 and RAper = 3, 4
+# give six variants), each with its own parameter file written by write_parameter_file with the values set on top of the [system_name]
+# section. Variants run concurrently, at most `cpus` at a time (dolphot is single threaded), and are compared in one table: star counts,
+# stars passing the quality cuts, depth (median magnitude at S/N ~ 5) and the magnitude where the median uncertainty reaches 0.1 in each
+# filter. With subregion = x_min, y_min, x_max, y_max, only the stars of an existing catalog (positions_from, default phot_file) inside
+# that box are measured, as in --forced_phot, which makes sweeps fast but leaves star finding parameters (e.g. SigFind) without effect
+class ParameterSweep:
+    RESERVED_KEYS = ('cpus', 'subregion', 'positions_from')
+    UNCERTAINTY_LEVEL = 0.1
+
+    def __init__(self, grid, cpus=None, subregion=None, positions_from=None, poll_interval=10):
+        # grid: {dolphot parameter: [values]}
+        self.grid = grid
+        self.cpus = cpus if cpus else os.cpu_count()
+        self.subregion = subregion
+        self.positions_from = positions_from
+        self.poll_interval = poll_interval
+
+    @classmethod
+    def from_config(cls, config):
+        # config should be read with optionxform = str, as dolphot parameter names are case sensitive
+        settings = config['SWEEP'] if 'SWEEP' in config else {}
+        grid = {key: [value.strip() for value in values.split(',')] for key, values in settings.items()
+                if key not in cls.RESERVED_KEYS and key not in config.defaults()}
+        if not grid:
+            raise ValueError("Define the parameter values to sweep under [SWEEP] in config.ini, e.g. FitSky = 1, 2, 3")
+        subregion = tuple(float(v) for v in settings['subregion'].split(',')) if settings.get('subregion') else None
+        if subregion and len(subregion) != 4:
+            raise ValueError("subregion under [SWEEP] must be x_min, y_min, x_max, y_max")
+        positions_from = settings.get('positions_from') or config['DOLPHOT_CONFIG'].get('phot_file')
+        if subregion and (not positions_from or not os.path.isfile(positions_from)):
+            raise ValueError(f"A subregion sweep needs an existing catalog, '{positions_from}' not found. Set positions_from under [SWEEP]")
+        return cls(grid, int(settings['cpus']) if settings.get('cpus') else None, subregion, positions_from)
+
+    def variants(self):
+        return [dict(zip(self.grid, values)) for values in itertools.product(*self.grid.values())]
+
+    @classmethod
+    def summarize(cls, phot_file):
+        # Star counts, depth and uncertainty curves of a finished variant
+        data = np.loadtxt(phot_file, usecols=(9, 15, 17, 19, 20, 28, 30, 32, 33), ndmin=2)
+        if data.size == 0:
+            return {'stars': 0, 'quality': 0}
+        crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp = data.T
+        quality = PlotManager.quality_mask((data, None, None, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp))
+        summary = {'stars': len(data), 'quality': int(quality.sum())}
+        mag_edges = np.arange(16.0, 32.01, 0.5)
+        for band, mag, unc, sn in (('blue', blue, blue_unc, blue_sn), ('red', red, red_unc, red_sn)):
+            # DOLPHOT writes 99.999 for undetected stars
+            measured = mag < 90
+            near_limit = measured & (sn >= 4) & (sn <= 6)
+            summary[f"{band}_depth"] = float(np.median(mag[near_limit])) if near_limit.any() else None
+            # Median uncertainty per magnitude bin of the measured stars, and the first bin where it reaches UNCERTAINTY_LEVEL
+            bins = np.digitize(mag[measured], mag_edges) - 1
+            curve = [float(np.median(unc[measured][bins == index])) if np.any(bins == index) else None for index in range(len(mag_edges) - 1)]
+            summary[f"{band}_unc_curve"] = curve
+            reaching = [mag_edges[index] + 0.25 for index, value in enumerate(curve) if value is not None and value >= cls.UNCERTAINTY_LEVEL]
+            summary[f"{band}_mag_at_unc"] = float(reaching[0]) if reaching else None
+        summary['mag_edges'] = mag_edges.tolist()
+        return summary
+
+    def print_table(self, results):
+        fmt = lambda value: f"{value:.2f}" if isinstance(value, float) else ('' if value is None else str(value))
+        level = self.UNCERTAINTY_LEVEL
+        print(f"\n{'variant':<10}{'parameters':<40}{'state':<9}{'stars':>9}{'quality':>9}{'depth B':>9}{'depth R':>9}{f'B@{level}':>9}{f'R@{level}':>9}{'min':>7}")
+        for name, result in results.items():
+            summary = result.get('summary', {})
+            parameters = ' '.join(f"{key}={value}" for key, value in result['parameters'].items())
+            print(f"{name:<10}{parameters[:39]:<40}{result['state']:<9}{fmt(summary.get('stars')):>9}{fmt(summary.get('quality')):>9}"
+                  f"{fmt(summary.get('blue_depth')):>9}{fmt(summary.get('red_depth')):>9}{fmt(summary.get('blue_mag_at_unc')):>9}"
+                  f"{fmt(summary.get('red_mag_at_unc')):>9}{fmt(result.get('minutes')):>7}")
+
+    def run(self, field_dir, config, prompt=True):
+        executor = TerminalCommandExecutor()
+        obj_name, system_name = config['DOLPHOT_CONFIG']['obj_name'], config['DOLPHOT_CONFIG']['system_name']
+        variants = self.variants()
+        if prompt and input(f"Run {len(variants)} dolphot variants, {min(self.cpus, len(variants))} at a time? (y/n): ").lower() not in ('y', 'yes'):
+            print("Parameter sweep cancelled.")
+            return None
+
+        with working_directory(field_dir) as cwd:
+            selected_files = executor.find_chip_files(cwd, system_name)
+            common = {}
+            if self.subregion:
+                xyt_file = f"{obj_name}_{system_name}_sweep.xyt"
+                count = ForcedPhotometry(self.positions_from).write_positions(xyt_file, self.subregion)
+                print(f"Sweeping on {count} stars of {self.positions_from} inside {self.subregion}")
+                common['xytfile'] = xyt_file
+
+            results = {}
+            for index, parameters in enumerate(variants, start=1):
+                name = f"sweep{index:02d}"
+                base = f"{obj_name}_{system_name}_{name}"
+                result = executor.write_parameter_file(selected_files, {}, 'config.ini', overwrite=True, param_file=f"{base}.param")
+                if not result or not result[0]:
+                    raise ValueError(f"Could not write {base}.param")
+                executor.set_param_values(f"{base}.param", dict(common, **parameters))
+                results[name] = {'parameters': parameters, 'param_file': f"{base}.param", 'phot_file': f"{base}.phot",
+                                 'log_file': f"dolphot_{base}.log", 'state': 'pending'}
+
+            build_cache = DolphotBuildCache.from_config(config)
+            if build_cache:
+                build_cache.activate(system_name)
+
+            # Same polling scheme as BatchRunner: start variants while CPUs are free, collect finished ones
+            pending, running = list(results), {}
+            while pending or running:
+                while pending and len(running) < self.cpus:
+                    name = pending.pop(0)
+                    result = results[name]
+                    command = f"dolphot {result['phot_file']} -p{result['param_file']} >> {result['log_file']} 2>&1"
+                    running[name] = (subprocess.Popen(command, shell=True, cwd=cwd, stdin=subprocess.DEVNULL), time.time())
+                    result['state'] = 'running'
+                    print(f"Started {name}: {' '.join(f'{key}={value}' for key, value in result['parameters'].items())}")
+                for name, (process, started) in list(running.items()):
+                    returncode = process.poll()
+                    if returncode is None:
+                        continue
+                    del running[name]
+                    result = results[name]
+                    result.update(state='done' if returncode == 0 else 'failed', returncode=returncode, minutes=(time.time() - started) / 60)
+                    if returncode == 0 and os.path.isfile(result['phot_file']):
+                        result['summary'] = self.summarize(result['phot_file'])
+                    print(f"Finished {name} ({result['state']}) after {result['minutes']:.1f} min")
+                if running:
+                    time.sleep(self.poll_interval)
+
+            summary_file = f"{obj_name}_{system_name}_sweep.json"
+            with open(summary_file, 'w') as f:
+                json.dump(results, f, indent=2)
+        self.print_table(results)
+        print(f"\nSweep results, including the uncertainty curves, saved to {os.path.join(cwd, summary_file)}")
+        return results
+
+
 # After finishing pre-processing, handle image files, or photometry file outputs of dolphot
 class DataFilterOrganizer:
     def __init__(self, output_file = None, directory=None):
@@ -641,8 +1549,41 @@ class DataFilterOrganizer:
                         output.write(f"\t\tExposure Time = {hdulist[0].header.get('EXPTIME', 'N/A')}\n")
                     output.write("\t--------------------------------------------------\n")
 
+# Compact _full.npy read back by PlotManager.read_saved_data. Columns keep their saved dtypes (float64 positions and RA/DEC, float32
+# photometry) and are indexed like the plain 2D layout of full mode: data[:, 4] is the red magnitude column
+class SavedColumns:
+    def __init__(self, data):
+        self.data = data
+        self.names = data.dtype.names
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        rows, column = key
+        return self.data[self.names[column]][rows]
+
+# Output of PlotManager.prepare_data. Still a tuple, so the positional unpacking and indexing used throughout keep working
+PreparedCatalog = namedtuple('PreparedCatalog', ['data', 'x', 'y', 'crowd', 'blue', 'blue_unc', 'blue_sn', 'blue_sharp', 'red', 'red_unc', 'red_sn', 'red_sharp',
+                                                 'cmd_label', 'red_label', 'blue_label', 'red_abs_label', 'blue_abs_label', 'red_unc_label', 'blue_unc_label',
+                                                 'wcs', 'sn_ra', 'sn_dec'])
+
 class PlotManager:
-    def __init__(self, config, obj_name, distance, proximity_thresholds, pdf=False, data_dir=None, use_brightest_star=False):
+    # Dolphot .phot columns used by Karlach: (name, 0-indexed column, dtype in compact mode). Full mode loads them all as float64.
+    # Compact mode (--compact, or 'catalog_dtype = compact' under [DOLPHOT_CONFIG]) keeps pixel positions in float64, since they feed the
+    # WCS transformation and the separation from the SN, and stores the photometry in float32, which has a relative precision of 6e-8:
+    # below 2e-6 mag for magnitudes up to 30, far below the 0.0001 mag written to the .txt outputs and any photometric uncertainty.
+    # Object type and the quality flags, which dolphot writes as small integers, are kept exactly as int8/uint8 where they are needed
+    # (EpochCrossMatcher); PlotManager loads the same columns in both modes
+    CATALOG_COLUMNS = [('x', 2, 'f8'), ('y', 3, 'f8'), ('crowd', 9, 'f4'),
+                       ('blue', 15, 'f4'), ('blue_unc', 17, 'f4'), ('blue_sn', 19, 'f4'), ('blue_sharp', 20, 'f4'),
+                       ('red', 28, 'f4'), ('red_unc', 30, 'f4'), ('red_sn', 32, 'f4'), ('red_sharp', 33, 'f4')]
+    COMPACT_EXTRA_COLUMNS = [('obj_type', 10, 'i1'), ('blue_flag', 23, 'u1'), ('red_flag', 36, 'u1')]
+    # Saved _full.npy columns in compact mode. Positions and RA/DEC stay float64
+    FULL_OUTPUT_DTYPE = [('x', 'f8'), ('y', 'f8'), ('blue', 'f4'), ('blue_unc', 'f4'), ('red', 'f4'), ('red_unc', 'f4'), ('color', 'f4'),
+                         ('ra', 'f8'), ('dec', 'f8'), ('blue_abs', 'f4'), ('red_abs', 'f4')]
+
+    def __init__(self, config, obj_name, distance, proximity_thresholds, pdf=False, data_dir=None, use_brightest_star=False, compact=False, cutout_background=False):
         
         if not isinstance(config, configparser.ConfigParser):
             raise ValueError("Config must be an instance of configparser.ConfigParser")
@@ -656,6 +1597,12 @@ class PlotManager:
         self.use_brightest_star = use_brightest_star
         self.blue_cut = None
         self.red_cut = None
+        self.compact = compact or self.config['DOLPHOT_CONFIG'].get('catalog_dtype', 'full').lower() == 'compact'
+        # Reference image behind the sky-coordinate plots, read as cached cutouts (--cutout_background)
+        self.cutout_background = cutout_background or self.config['DOLPHOT_CONFIG'].get('cutout_background', 'no').lower() in ('yes', 'true', '1')
+        self.cutouts = CutoutService() if self.cutout_background else None
+        # Extension of the --quality_maps FITS file drawn over the sky-coordinate plots, e.g. DEPTH_RED
+        self.quality_overlay = self.config['DOLPHOT_CONFIG'].get('quality_map_overlay')
 
         # Assuming you ran --dolphot, the code will automatically write phot_file and ref_file to config.ini for you,
         # if you immediately run --phot. Alternatively, you can choose to define phot_file and ref_file in config.ini manually
@@ -667,62 +1614,110 @@ class PlotManager:
         self.phot_file = self.config['DOLPHOT_CONFIG'].get('phot_file')
         self.ref_file = self.config['DOLPHOT_CONFIG'].get('ref_file')
 
-    def prepare_data(self):
-        # Load in the data. Verify phot_file, ref_file, SN object exist and can be used
-        print(f"\nPreparing data within {self.proximity_thresholds} pc of {self.obj_name} using {self.phot_file} and {self.ref_file} at distance {self.distance} pc")
+    # The four setup steps of prepare_data are independent of each other, so they run concurrently in a thread pool
+    def load_phot_data(self):
         try:
-            data = np.genfromtxt(self.phot_file, usecols=(2, 3, 9, 15, 17, 19, 20, 28, 30, 32, 33))
+            if self.compact:
+                # Structured array with one field per column, each in its compact dtype
+                return np.genfromtxt(self.phot_file, usecols=[column for _, column, _ in self.CATALOG_COLUMNS],
+                                     dtype=[(name, dtype) for name, _, dtype in self.CATALOG_COLUMNS])
+            return np.genfromtxt(self.phot_file, usecols=[column for _, column, _ in self.CATALOG_COLUMNS])
         except IOError:
             print(f"Error: The file {self.phot_file} could not be found.")
             return None
 
+    def load_columns(self):
         try:
             with open(self.phot_file + '.columns', 'r') as f:
-                columns_data = f.readlines()
+                return f.readlines()
         except IOError:
             print(f"Error: The columns file for {self.phot_file} could not be found.")
             return None
 
+    @staticmethod
+    def read_reference_wcs(ref_file, system_name):
+        with fits.open(ref_file) as ref:
+            # ACS_HRC has relevant wcs information stored in SCI1 header. Often the distortion information breaks the wcs transformation, and is not necessary
+            if system_name == 'ACS_HRC':
+                ref_header = ref['SCI', 1].header
+                # Remove distortion-related keywords to simplify WCS initialization
+                distortion_keywords = ['CPDIS1', 'CPDIS2', 'DP1', 'DP2', 'NPOLEXT']
+                for key in distortion_keywords:
+                    if key in ref_header:
+                        del ref_header[key]
+            else:
+                ref_header = ref[0].header
+            return WCS(ref_header)
+
+    def load_reference_wcs(self):
         try:
-            with fits.open(self.ref_file) as ref:
-                # Get system_name from config.ini, if failed to find system_name, use 'default' as system name and move to else
-                system_name = self.config['DOLPHOT_CONFIG'].get('system_name', 'default')
-                # ACS_HRC has relevant wcs information stored in SCI1 header. Often the distortion information breaks the wcs transformation, and is not necessary
-                if system_name == 'ACS_HRC':
-                    ref_header = ref['SCI', 1].header
-                    # Remove distortion-related keywords to simplify WCS initialization
-                    distortion_keywords = ['CPDIS1', 'CPDIS2', 'DP1', 'DP2', 'NPOLEXT']
-                    for key in distortion_keywords:
-                        if key in ref_header:
-                            del ref_header[key]
-                else:
-                    ref_header = ref[0].header
-                wcs = WCS(ref_header)
+            # Get system_name from config.ini, if failed to find system_name, use 'default' as system name and move to else
+            return self.read_reference_wcs(self.ref_file, self.config['DOLPHOT_CONFIG'].get('system_name', 'default'))
         except IOError:
             print(f"Error: The reference file {self.ref_file} could not be opened.")
             return None
 
-        # Prompt user for choice between SIMBAD query or manual input
-        choice = input("Enter index 1 if you'd like SIMBAD to automatically fetch the RA and DEC, Enter index 2 if you'd like to manually input the RA and DEC: ")
+    def query_simbad(self):
+        # Returns (RA, DEC) in degrees, or None if SIMBAD does not know the object or cannot be reached
+        try:
+            return resolve_coordinates(self.obj_name)
+        except ValueError as e:
+            print(f"Warning: {e}")
+            return None
+
+    # prompt=False never falls back to manual input (headless API), e.g. when SIMBAD does not know the object
+    def prepare_data(self, sn_coords=None, prompt=True):
+        # Load in the data. Verify phot_file, ref_file, SN object exist and can be used
+        print(f"\nPreparing data within {self.proximity_thresholds} pc of {self.obj_name} using {self.phot_file} and {self.ref_file} at distance {self.distance} pc")
+
+        # Check the files before asking for (or querying SIMBAD for) the SN coordinates
+        for name, path in (('phot_file', self.phot_file), ('ref_file', self.ref_file), ('columns file', self.phot_file and self.phot_file + '.columns')):
+            if not path or not os.path.isfile(path):
+                print(f"Error: The {name} {path} could not be found. Check phot_file and ref_file under [DOLPHOT_CONFIG] in config.ini.")
+                return None
+
+        # Prompt user for choice between SIMBAD query or manual input, unless the (RA, DEC) in degrees or 'simbad' were passed in
+        # Headless runs (--watch, --batch, scripts) cannot answer the prompt, so they query SIMBAD
+        if sn_coords == 'simbad' or (not sn_coords and prompt and not sys.stdin.isatty()):
+            choice, sn_coords = '1', None
+        else:
+            choice = None if sn_coords or not prompt else input("Enter index 1 if you'd like SIMBAD to automatically fetch the RA and DEC, Enter index 2 if you'd like to manually input the RA and DEC: ")
+        if not sn_coords and choice not in ('1', '2'):
+            print("Invalid choice. Please enter 1 or 2.")
+            return None
+
+        # Parse the catalog, read the columns file, build the WCS and query SIMBAD at the same time, so the setup takes as long as the slowest step
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            data_future = pool.submit(self.load_phot_data)
+            columns_future = pool.submit(self.load_columns)
+            wcs_future = pool.submit(self.load_reference_wcs)
+            simbad_future = pool.submit(self.query_simbad) if choice == '1' else None
+
+            if sn_coords:
+                self.sn_ra, self.sn_dec = float(sn_coords[0]), float(sn_coords[1])
+            elif choice == '2':
+                # Manual input for RA and DEC, while the files load in the background
+                self.sn_ra = float(input("Enter RA (deg): "))
+                self.sn_dec = float(input("Enter DEC (deg): "))
+
+            data, columns_data, wcs = data_future.result(), columns_future.result(), wcs_future.result()
+            simbad_coords = simbad_future.result() if simbad_future else None
+
+        if data is None or columns_data is None or wcs is None:
+            return None
 
         if choice == '1':
             # Query SIMBAD to automatically define SN RA and SN Dec
-            result_table = Simbad.query_object(self.obj_name)
-            if result_table is not None:
-                ra_str, dec_str = result_table['RA'].data[0], result_table['DEC'].data[0]
-                sky_coord = SkyCoord(ra=ra_str, dec=dec_str, unit=("hourangle", "deg"), frame='icrs')
-                self.sn_ra, self.sn_dec = sky_coord.ra.deg, sky_coord.dec.deg
+            if simbad_coords is not None:
+                self.sn_ra, self.sn_dec = simbad_coords
+            elif not prompt or not sys.stdin.isatty():
+                # Headless runs (scripts, schedulers) cannot fall back to manual input
+                print(f"Error: Object {self.obj_name} not found in SIMBAD. Pass the coordinates explicitly, e.g. --sn_coords RA,DEC.")
+                return None
             else:
                 print(f"Warning: Object {self.obj_name} not found in SIMBAD. Defaulting to manual input.")
                 self.sn_ra = float(input("Enter RA (deg): "))
                 self.sn_dec = float(input("Enter DEC (deg): "))
-        elif choice == '2':
-            # Manual input for RA and DEC
-            self.sn_ra = float(input("Enter RA (deg): "))
-            self.sn_dec = float(input("Enter DEC (deg): "))
-        else:
-            print("Invalid choice. Please enter 1 or 2.")
-            return None
 
         # Columns defined in 2004dj_kochanek.phot.columns (indexing from 1): Currently hardcoded, verify this is generally true.
         # Held true for ACS_HRC data, ACS_WFC data, and WFC3 data.
@@ -740,9 +1735,15 @@ class PlotManager:
 
         # Extract data                                                              
         # Note 'usecols' remapped data. Proper indexes given ----------------------^^^^^
-        x, y, crowd = data[:, 0], data[:, 1], data[:, 2]
-        blue, blue_unc, blue_sn, blue_sharp = data[:, 3], data[:, 4], data[:, 5], data[:, 6]
-        red, red_unc, red_sn, red_sharp = data[:, 7], data[:, 8], data[:, 9], data[:, 10]
+        if data.dtype.names:
+            # Compact mode: the same columns, by name
+            x, y, crowd = data['x'], data['y'], data['crowd']
+            blue, blue_unc, blue_sn, blue_sharp = data['blue'], data['blue_unc'], data['blue_sn'], data['blue_sharp']
+            red, red_unc, red_sn, red_sharp = data['red'], data['red_unc'], data['red_sn'], data['red_sharp']
+        else:
+            x, y, crowd = data[:, 0], data[:, 1], data[:, 2]
+            blue, blue_unc, blue_sn, blue_sharp = data[:, 3], data[:, 4], data[:, 5], data[:, 6]
+            red, red_unc, red_sn, red_sharp = data[:, 7], data[:, 8], data[:, 9], data[:, 10]
 
         # Prepare dynamic labels
         self.cmd_label = (columns_data[15].split(', ')[1] + '-' + columns_data[28].split(', ')[1]).strip()
@@ -750,30 +1751,48 @@ class PlotManager:
         self.blue_abs_cut_label, self.red_abs_cut_label = (columns_data[15].split(', ')[1].strip()+'[Abs]'), (columns_data[28].split(', ')[1].strip()+'[Abs]')
         self.blue_unc_label, self.red_unc_label = (columns_data[17].split(', ')[1] + ' Uncertainty').strip(), (columns_data[30].split(', ')[1] + ' Uncertainty').strip()
         
-        return (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp,
-                self.cmd_label, self.red_label, self.blue_label, self.red_abs_cut_label, self.blue_abs_cut_label, self.red_unc_label, self.blue_unc_label, wcs, self.sn_ra, self.sn_dec)
+        return PreparedCatalog(data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp,
+                               self.cmd_label, self.red_label, self.blue_label, self.red_abs_cut_label, self.blue_abs_cut_label, self.red_unc_label, self.blue_unc_label, wcs, self.sn_ra, self.sn_dec)
 
-    def process_data(self, prepared_data):
-        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp,
-        self.cmd_label, self.red_label, self.blue_label, self.red_abs_cut_label, self.blue_abs_cut_label, self.red_unc_label, self.blue_unc_label, wcs, sn_ra, sn_dec) = prepared_data
+    @staticmethod
+    def quality_mask(prepared_data, sn_min=4.0, sharp_max=0.15, crowd_max=1.3):
+        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp) = prepared_data[:12]
 
         # Define the quality cut conditions: Refer to Murphy 2018, NGC6946-BH1
-        red_sn_above4 = red_sn >= 4.0
-        blue_sn_above4 = blue_sn >= 4.0
-        sharp_cond = (blue_sharp**2 + red_sharp**2) <= 0.15
-        crowd_cond = crowd <= 1.3
-        quality_mask = red_sn_above4 & blue_sn_above4 & sharp_cond & crowd_cond
+        red_sn_above4 = red_sn >= sn_min
+        blue_sn_above4 = blue_sn >= sn_min
+        sharp_cond = (blue_sharp**2 + red_sharp**2) <= sharp_max
+        crowd_cond = crowd <= crowd_max
+        return red_sn_above4 & blue_sn_above4 & sharp_cond & crowd_cond
+
+    def compute_separation(self, prepared_data):
+        # Projected distance from the SN in pc, and RA/Dec for every star of the prepared catalog
+        x, y = prepared_data[1], prepared_data[2]
+        wcs, sn_ra, sn_dec = prepared_data[19:22]
 
         # Convert pixel coordinates to world coordinates for all data
         ra_all, dec_all = wcs.all_pix2world(x, y, 1)
         star_coords = SkyCoord(ra=ra_all, dec=dec_all, unit=(u.deg, u.deg), frame='icrs')
         sn_skycoord = SkyCoord(ra=sn_ra, dec=sn_dec, unit=(u.deg, u.deg), frame='icrs')
         sep = sn_skycoord.separation(star_coords)
+        return sep.radian * self.distance, ra_all, dec_all
+
+    def compute_quality_and_separation(self, prepared_data, cuts=None):
+        # Quality mask (default cuts unless overridden with sn_min, sharp_max, crowd_max), separation from the SN in pc, and RA/Dec
+        sep_pc, ra_all, dec_all = self.compute_separation(prepared_data)
+        return self.quality_mask(prepared_data, **(cuts or {})), sep_pc, ra_all, dec_all
+
+    def process_data(self, prepared_data, quality=None, thresholds=None):
+        # quality: precomputed output of compute_quality_and_separation, e.g. kept in memory by the daemon
+        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp,
+        self.cmd_label, self.red_label, self.blue_label, self.red_abs_cut_label, self.blue_abs_cut_label, self.red_unc_label, self.blue_unc_label, wcs, sn_ra, sn_dec) = prepared_data
+
+        quality_mask, sep_pc, ra_all, dec_all = quality if quality is not None else self.compute_quality_and_separation(prepared_data)
         
         results = []
-        for threshold in self.proximity_thresholds:
+        for threshold in (thresholds if thresholds is not None else self.proximity_thresholds):
             proximity_threshold = float(threshold)
-            proximity_mask = (sep.radian * self.distance) <= proximity_threshold
+            proximity_mask = sep_pc <= proximity_threshold
             combined_mask = quality_mask & proximity_mask
 
             # Perform both quality and distance masks
@@ -798,6 +1817,163 @@ class PlotManager:
 
         return results
 
+    def make_hess(self, prepared_data, include_titles=True):
+        # Binned CMD (Hess diagram) of the quality-filtered stars inside every proximity threshold, saved to the data directory and plotted from file
+        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp) = prepared_data[:12]
+        quality_mask, sep_pc, _, _ = self.compute_quality_and_separation(prepared_data)
+        hess_engine = HessDiagram.from_config(self.config)
+        color_err = np.sqrt(blue_unc**2 + red_unc**2)
+        hess, counts = hess_engine.build((blue - red)[quality_mask], red[quality_mask], color_err[quality_mask], red_unc[quality_mask],
+                                         sep_pc[quality_mask], [float(threshold) for threshold in self.proximity_thresholds])
+
+        file_name = os.path.join(self.data_dir, f"{self.obj_name}_hess_{self.blue_label}_{self.red_label}.npz")
+        hess_engine.save(file_name, hess, counts, [float(threshold) for threshold in self.proximity_thresholds], self.cmd_label, self.red_label)
+        hess_data = HessDiagram.load(file_name)
+
+        if self.pdf:
+            pdf_filename = os.path.join(self.data_dir, f"{self.obj_name}_hess_plots{'_notitles' if not include_titles else ''}.pdf")
+            with PdfPages(pdf_filename) as pdf_pages:
+                for index, threshold in enumerate(hess_data['thresholds']):
+                    fig = HessDiagram.plot(hess_data, index, f"{self.phot_file}: Hess diagram {threshold:g}pc", include_title=include_titles)
+                    pdf_pages.savefig(fig)
+                    plt.close(fig)
+            print(f"Successfully generated the PDF file: {pdf_filename}!")
+        else:
+            for index, threshold in enumerate(hess_data['thresholds']):
+                HessDiagram.plot(hess_data, index, f"{self.phot_file}: Hess diagram {threshold:g}pc").show()
+        return hess_data
+
+    def make_completeness(self):
+        # Completeness and bias of every star of the saved catalogs (--save_data), from the artificial star grid (CompletenessGrid). Saved
+        # next to each _full.npy as _completeness.npy (completeness, red magnitude bias, color bias per row), with corrected star counts
+        grid = CompletenessGrid.from_config(self.config, os.path.join(self.data_dir, f"{self.obj_name}_completeness_{self.blue_label}_{self.red_label}.npz"))
+        min_completeness = float(self.config['COMPLETENESS'].get('min_completeness', 0.1)) if 'COMPLETENESS' in self.config else 0.1
+        print(f"{'Threshold':>10} {'Stars':>10} {'Corrected':>12} {'Below ' + str(min_completeness):>12}")
+        for threshold in self.proximity_thresholds:
+            file_prefix = os.path.join(self.data_dir, f"{self.obj_name}_{threshold}pc_{self.blue_label}_{self.red_label}")
+            data = self.read_saved_data(f"{file_prefix}_full.npy")
+            if data is None:
+                continue
+            completeness, red_bias, color_bias = grid.apply(data[:, 4], data[:, 6], data[:, 0], data[:, 1])
+            np.save(f"{file_prefix}_completeness.npy", np.column_stack((completeness, red_bias, color_bias)).astype(np.float32))
+            # Stars where the completeness is too low to correct are counted once
+            usable = completeness >= min_completeness
+            print(f"{threshold:>8}pc {len(data):>10} {np.sum(1 / completeness[usable]) + np.sum(~usable):>12.1f} {np.sum(~usable):>12}")
+
+    def quality_maps_file(self):
+        return os.path.join(self.data_dir or os.getcwd(), f"{self.obj_name}_quality_maps.fits")
+
+    def make_quality_maps(self):
+        # Binned crowding, S/N, sharpness and depth maps of the whole catalog (QualityMaps), read straight from the .phot file
+        wcs = self.load_reference_wcs()
+        if wcs is None:
+            return None
+        return QualityMaps.from_config(self.config).run(self.phot_file, self.ref_file, wcs, self.quality_maps_file())
+
+    def make_cmd_regions(self, prepared_data):
+        # Region bitmask of every star of the catalog, and of the quality and distance filtered stars of every threshold, in the row order
+        # of the matching _full.npy (--save_data). Region definitions and counts per threshold go to a JSON file next to them
+        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp) = prepared_data[:12]
+        regions = CMDRegions.from_config(self.config)
+        distance_modulus = 5 * np.log10(self.distance) - 5
+        magnitudes = {'red_abs': red - distance_modulus, 'blue_abs': blue - distance_modulus, 'red': red, 'blue': blue}
+        bits = regions.membership(np.asarray(blue - red, dtype=np.float64), np.asarray(magnitudes[regions.magnitude], dtype=np.float64))
+        quality_mask, sep_pc, _, _ = self.compute_quality_and_separation(prepared_data)
+
+        file_prefix = f"{self.obj_name}_{self.blue_label}_{self.red_label}"
+        np.save(os.path.join(self.data_dir, f"{file_prefix}_regions.npy"), bits)
+        summary = dict(regions.to_dict(), filters=[self.blue_label, self.red_label], all_stars=regions.counts(bits),
+                       quality=regions.counts(bits[quality_mask]), thresholds={})
+        for threshold in self.proximity_thresholds:
+            threshold_bits = bits[quality_mask & (sep_pc <= float(threshold))]
+            np.save(os.path.join(self.data_dir, f"{self.obj_name}_{threshold}pc_{self.blue_label}_{self.red_label}_regions.npy"), threshold_bits)
+            summary['thresholds'][f"{threshold}"] = regions.counts(threshold_bits)
+        with open(os.path.join(self.data_dir, f"{file_prefix}_regions.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        # cmd_label can span two lines (blue filter, red filter), the table header needs one
+        cmd_label = self.cmd_label.replace('\n', ' ')
+        print(f"CMD region counts ({regions.magnitude} vs {cmd_label}), saved to {os.path.join(self.data_dir, file_prefix + '_regions.json')}:")
+        print(f"{'Region':<16}" + ''.join(f"{threshold:>10}pc" for threshold in self.proximity_thresholds))
+        for name in regions.regions:
+            print(f"{name:<16}" + ''.join(f"{summary['thresholds'][f'{threshold}'][name]:>12}" for threshold in self.proximity_thresholds))
+        return bits, summary
+
+    def make_dereddening(self, prepared_data):
+        # Differential reddening correction (DifferentialReddening) of every star of the catalog, and of the quality and distance filtered
+        # stars of every threshold in the row order of the matching _full.npy (--save_data). Each row holds dA_V, its error and the
+        # corrected blue and red magnitudes
+        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp) = prepared_data[:12]
+        reddening = DifferentialReddening.from_config(self.config, self.blue_label, self.red_label)
+        quality_mask, sep_pc, _, _ = self.compute_quality_and_separation(prepared_data)
+        reference = quality_mask.copy()
+        region = self.config['REDDENING'].get('reference_region') if 'REDDENING' in self.config else None
+        if region:
+            regions = CMDRegions.from_config(self.config)
+            if region not in regions.regions:
+                raise ValueError(f"reference_region '{region}' is not defined under [CMD_REGIONS]")
+            distance_modulus = 5 * np.log10(self.distance) - 5
+            magnitudes = {'red_abs': red - distance_modulus, 'blue_abs': blue - distance_modulus, 'red': red, 'blue': blue}
+            bits = regions.membership(np.asarray(blue - red, dtype=np.float64), np.asarray(magnitudes[regions.magnitude], dtype=np.float64))
+            reference &= (bits & (1 << list(regions.regions).index(region))) > 0
+        print(f"Differential reddening from {reference.sum()} reference stars, k = {reddening.k}, "
+              f"A_{self.blue_label}/A_V = {reddening.blue_coefficient:.3f}, A_{self.red_label}/A_V = {reddening.red_coefficient:.3f}")
+        corrected = np.column_stack(reddening.correct(x, y, blue, red, reference)).astype(np.float32)
+
+        file_prefix = f"{self.obj_name}_{self.blue_label}_{self.red_label}"
+        np.save(os.path.join(self.data_dir, f"{file_prefix}_dereddened.npy"), corrected)
+        for threshold in self.proximity_thresholds:
+            threshold_rows = corrected[quality_mask & (sep_pc <= float(threshold))]
+            np.save(os.path.join(self.data_dir, f"{self.obj_name}_{threshold}pc_{self.blue_label}_{self.red_label}_dereddened.npy"), threshold_rows)
+            print(f"{threshold}pc: median dA_V {np.median(threshold_rows[:, 0]) if len(threshold_rows) else float('nan'):.3f}")
+        print(f"Dereddened catalogs (dA_V, error, {self.blue_label}, {self.red_label}) saved to {self.data_dir}")
+        return corrected
+
+    def make_decontamination(self, prepared_data, include_titles=True):
+        # Field-star membership probabilities (FieldDecontamination) of the quality filtered stars inside every threshold, in the row order
+        # of the matching _full.npy (--save_data), with the CMDs colored by probability
+        (data, x, y, crowd, blue, blue_unc, blue_sn, blue_sharp, red, red_unc, red_sn, red_sharp) = prepared_data[:12]
+        wcs, sn_ra, sn_dec = prepared_data[19:22]
+        decontamination = FieldDecontamination.from_config(self.config)
+        quality_mask, sep_pc, _, _ = self.compute_quality_and_separation(prepared_data)
+        color = np.asarray(blue - red, dtype=np.float64)
+        red = np.asarray(red, dtype=np.float64)
+
+        figures = []
+        print(f"{'Threshold':>10} {'Stars':>8} {'Control':>8} {'Members':>10} {'Field':>10}")
+        for threshold in self.proximity_thresholds:
+            radius = float(threshold)
+            inner, outer = decontamination.annulus(radius)
+            members = quality_mask & (sep_pc <= radius)
+            control = quality_mask & (sep_pc >= inner) & (sep_pc <= outer)
+            area_ratio = (decontamination.coverage(x, y, wcs, sn_ra, sn_dec, self.distance, inner, outer) /
+                          max(decontamination.coverage(x, y, wcs, sn_ra, sn_dec, self.distance, 0.0, radius), 1e-6))
+            if area_ratio < 0.25:
+                print(f"Warning: only {100 * area_ratio:.0f}% of the {threshold}pc control annulus is covered by the catalog")
+            probability = decontamination.membership(color[members], red[members], color[control], red[control], max(area_ratio, 1e-6)).astype(np.float32)
+            np.save(os.path.join(self.data_dir, f"{self.obj_name}_{threshold}pc_{self.blue_label}_{self.red_label}_membership.npy"), probability)
+            print(f"{threshold:>8}pc {members.sum():>8} {control.sum():>8} {probability.sum():>10.1f} {len(probability) - probability.sum():>10.1f}")
+
+            fig, ax = plt.subplots(figsize=(8, 8))
+            image = ax.scatter(color[members], red[members], c=probability, cmap='coolwarm_r', vmin=0, vmax=1, s=12)
+            fig.colorbar(image, ax=ax, label='Membership probability')
+            ax.invert_yaxis()
+            ax.set_xlabel(self.cmd_label, fontsize=12)
+            ax.set_ylabel(self.red_label, fontsize=12)
+            if include_titles:
+                ax.set_title(f"{self.phot_file}: Membership {threshold}pc (control {inner:g}-{outer:.0f}pc)")
+            figures.append(fig)
+
+        if self.pdf:
+            pdf_filename = os.path.join(self.data_dir, f"{self.obj_name}_membership_plots{'_notitles' if not include_titles else ''}.pdf")
+            with PdfPages(pdf_filename) as pdf_pages:
+                for fig in figures:
+                    pdf_pages.savefig(fig)
+                    plt.close(fig)
+            print(f"Successfully generated the PDF file: {pdf_filename}!")
+        else:
+            plt.show()
+
     def save_processed_data(self, data, obj_name, threshold, blue_label, red_label):
         #print(f"Received data type: {type(data)}, length of data: {len(data)}")
         try:
@@ -824,6 +2000,11 @@ class PlotManager:
         # Saving the Data to ASCII file for human readability
         np.savetxt(file_name_txt, data_array, fmt='%0.4f', header=header, comments='')
         np.savetxt(full_file_name_txt, full_data_array, fmt='%0.4f', header=full_header, comments='')
+        if self.compact:
+            # Named columns with positions in float64 and photometry in float32, read back by read_saved_data
+            full_data_array = np.rec.fromarrays([x_cut, y_cut, blue_cut, blue_unc_cut, red_cut, red_unc_cut, color_filtered, ra_cut, dec_cut,
+                                                 blue_abs_cut, red_abs_cut], dtype=self.FULL_OUTPUT_DTYPE).view(np.ndarray)
+            data_array = data_array.astype(np.float32)
         np.save(full_file_name_npy, full_data_array)
 
         # Save the data to a NumPy binary file for programmatic access
@@ -849,259 +2030,271 @@ class PlotManager:
         
         return lower_bound, upper_bound
 
+    @staticmethod
+    def pad_limits(values, margin=0.05):
+        # Limits matplotlib's autoscaling would pick for a scatter of these values
+        low, high = np.min(values), np.max(values)
+        span = (high - low) or abs(low) * 1e-6 or 1.0
+        return low - margin * span, high + margin * span
+
+    @staticmethod
+    def point_density(first, second):
+        xy = np.vstack([first, second])
+        return gaussian_kde(xy)(xy) if len(first) > 2 else np.ones(len(first))
+
+    @staticmethod
+    def setup_scatter(figsize, xlabel, ylabel, xlim=None, ylim=None, density=False, ticksize=12, **scatter_kwargs):
+        fig, ax = plt.subplots(figsize=figsize)
+        if density:
+            scatter = ax.scatter(np.array([]), np.array([]), c=np.array([]), cmap='viridis', s=50, alpha=0.7)
+            plt.colorbar(scatter, ax=ax, label='Density')
+        else:
+            scatter = ax.scatter([], [], **scatter_kwargs)
+        if xlim:
+            ax.set_xlim(*xlim)
+        if ylim:
+            ax.set_ylim(*ylim)
+        ax.set_xlabel(xlabel, fontsize=12, ha='center')
+        ax.set_ylabel(ylabel, fontsize=12)
+        ax.tick_params(axis='both', which='major', labelsize=ticksize)
+        return fig, ax, scatter
+
+    def plot_title(self, plot_type, threshold):
+        return {'cmd': f"{self.phot_file}: Cut CMD {threshold}pc", 'cmd_density': f"{self.phot_file}: Density CMD {threshold}pc",
+                'color_abs_mag': f"{self.phot_file}: Color vs Absolute Magnitude {threshold}pc", 'mag_mag': f"{self.phot_file}: Cut Mag-Mag {threshold}pc",
+                'mag_mag_density': f"{self.phot_file}: Density Mag-Mag {threshold}pc", 'blue_unc': f"{self.phot_file}: Cut Blue-Unc {threshold}pc",
+                'red_unc': f"{self.phot_file}: Cut Red-Unc {threshold}pc", 'skycoord': f"{self.phot_file} {threshold}pc",
+                'skycoord_sizing': f"{self.phot_file} {threshold}pc Mag-Sizing"}[plot_type]
+
+    # Figure of one plot type with its axes, labels, ticks, colorbar and legend set up, and update(columns, title), which fills in the
+    # data-dependent artists (scatter offsets, sizes and colors, threshold lines, limits, title). columns are named as in
+    # FigureReuseRenderer.columns. The plot_* methods call it once per figure, FigureReuseRenderer once per plot type for all thresholds.
+    # labels override the catalog labels (cmd, blue, red, red_abs, blue_unc, red_unc, obj_name). background: RA/Dec that the cutout
+    # background and quality map overlay of the sky plots must cover
+    def setup_plot(self, plot_type, include_title=True, labels=None, background=None, global_min_mag=None, global_max_mag=None):
+        labels = dict({'cmd': self.cmd_label, 'blue': self.blue_label, 'red': self.red_label, 'red_abs': self.red_abs_cut_label,
+                       'blue_unc': self.blue_unc_label, 'red_unc': self.red_unc_label, 'obj_name': self.obj_name}, **(labels or {}))
+
+        def set_title(ax, title):
+            ax.set_title(title if include_title else '')
+
+        if plot_type == 'cmd':
+            fig, ax, scatter = self.setup_scatter((9, 8), labels['cmd'].replace('\n', ' '), labels['red'], alpha=0.7)
+
+            def update(c, title):
+                scatter.set_offsets(np.column_stack((c['color'], c['red'])))
+                if len(c['color']):
+                    # Automatically set axes limits
+                    ax.set_xlim(*self.set_axes_limits(c['color']))
+                    y_lower, y_upper = self.set_axes_limits(c['red'])
+                    ax.set_ylim(y_upper, y_lower)  # Invert y-axis for magnitudes
+                set_title(ax, title)
+        elif plot_type in ('cmd_density', 'mag_mag_density'):
+            cmd = plot_type == 'cmd_density'
+            fig, ax, scatter = self.setup_scatter((8, 8), labels['cmd'] if cmd else labels['blue'], labels['red'],
+                                                  (-1, 4) if cmd else (26, 20), (25.5, 19.5), density=True)
+            first_key = 'color' if cmd else 'blue'
+
+            def update(c, title):
+                # Color the points by their density
+                scatter.set_offsets(np.column_stack((c[first_key], c['red'])))
+                density = self.point_density(c[first_key], c['red'])
+                scatter.set_array(density)
+                if len(density):
+                    scatter.set_clim(density.min(), density.max())
+                set_title(ax, title)
+        elif plot_type == 'color_abs_mag':
+            fig, ax, scatter = self.setup_scatter((9, 8), labels['cmd'], labels['red_abs'], xlim=(-2, 4), alpha=0.7)
+            fig.tight_layout()
+
+            def update(c, title):
+                scatter.set_offsets(np.column_stack((c['color'], c['red_abs'])))
+                if len(c['red_abs']):
+                    ax.set_ylim(np.max(c['red_abs']) + 0.5, np.min(c['red_abs']) - 0.5)  # Inverted for magnitudes
+                set_title(ax, title)
+        elif plot_type == 'mag_mag':
+            #limits currently hardcoded by eye
+            fig, ax, scatter = self.setup_scatter((8, 8), labels['blue'], labels['red'], (26, 20), (25.5, 19.5), alpha=0.7)
+
+            def update(c, title):
+                scatter.set_offsets(np.column_stack((c['blue'], c['red'])))
+                set_title(ax, title)
+        elif plot_type in ('blue_unc', 'red_unc'):
+            band = plot_type.split('_')[0]
+            fig, ax, scatter = self.setup_scatter((8, 8), labels[band], labels[f"{band}_unc"], xlim=(16, 28), ticksize=14)
+            markers = []
+            for level, color, text_y in ((0.10, 'r', 0.90), (0.15, 'g', 0.85)):
+                horizontal, = ax.plot([], [], color=color, linestyle='--')
+                vertical, = ax.plot([], [], color=color, linestyle='--')
+                text = ax.text(0.95, text_y, '', ha='right', va='top', color=color, transform=ax.transAxes)
+                markers.append((level, horizontal, vertical, text))
+            fig.tight_layout()
+
+            def update(c, title):
+                mag, unc = c[band], c[f"{band}_unc"]
+                scatter.set_offsets(np.column_stack((mag, unc)))
+                top = np.max(unc) if len(unc) else 0.2
+                # Find the lowest magnitude point reaching each uncertainty level
+                for level, horizontal, vertical, text in markers:
+                    reaching = mag[unc >= level]
+                    shown = len(reaching) > 0
+                    for artist in (horizontal, vertical, text):
+                        artist.set_visible(shown)
+                    horizontal.set_label(f'{level:.2f} Uncertainty Threshold' if shown else '_nolegend_')
+                    if shown:
+                        min_mag = np.min(reaching)
+                        horizontal.set_data([16, min_mag], [level, level])
+                        vertical.set_data([min_mag, min_mag], [-0.01, level])
+                        text.set_text(f'Mag @ {level:.2f} Unc: {min_mag:.2f}')
+                        top = max(top, level)
+                ax.set_ylim(-0.01, top + 0.05 * (top + 0.01))  # Ensure the y-axis starts slightly below 0
+                if any(horizontal.get_visible() for _, horizontal, _, _ in markers):
+                    ax.legend()
+                elif ax.get_legend():
+                    ax.get_legend().remove()
+                set_title(ax, title)
+        elif plot_type in ('skycoord', 'skycoord_sizing'):
+            sizing = plot_type == 'skycoord_sizing'
+            fig = plt.figure(figsize=(8, 8))
+            ax = fig.gca()
+            if background is not None:
+                self.draw_cutout_background(ax, *background)
+                self.draw_quality_overlay(ax, *background)
+            # A background covers all the stars and fixes the limits, otherwise they follow the stars
+            autoscale = not ax.collections
+            stars = ax.scatter([], [], alpha=0.6)
+            special_label = labels['obj_name'] if self.use_brightest_star else f"{labels['obj_name']} (Simbad)"
+            max_size = 150
+            special = ax.scatter([], [], color='red', marker='*', s=max_size if sizing else 200, label=special_label)
+            if sizing:
+                # Add legend for magnitude sizes using global min and max magnitudes
+                data_color = stars.get_facecolor()[0]
+                for mag in np.linspace(global_min_mag, global_max_mag, num=4):
+                    ax.scatter([], [], s=max_size * (1 / (mag - global_min_mag + 1)), color=data_color, label=f'Mag: {mag:.1f}', alpha=0.6)
+            ax.set_xlabel('RA (deg)', fontsize=12)
+            ax.set_ylabel('Dec (deg)', fontsize=12)
+            ax.tick_params(axis='both', which='major', labelsize=11 if sizing else 12)
+            # This plot can output an offset for the x-axis and/or y-axis leading to more confusing tick labels, so the tick labels are
+            # offset by the smallest RA/Dec of the stars
+            offsets = {'ra': 0.0, 'dec': 0.0}
+            digits = 4 if sizing else 3
+            ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: f'{x + offsets["ra"]:.{digits}f}'))
+            ax.yaxis.set_major_formatter(FuncFormatter(lambda y, pos: f'{y + offsets["dec"]:.{digits}f}'))
+            ax.legend(loc='upper right' if sizing else 'best')
+            if sizing:
+                fig.tight_layout()
+
+            def update(c, title):
+                ra, dec = c['ra'], c['dec']
+                set_title(ax, title)
+                if len(ra) == 0:
+                    stars.set_offsets(np.empty((0, 2)))
+                    special.set_offsets(np.empty((0, 2)))
+                    return
+                keep = np.ones(len(ra), dtype=bool)
+                if self.use_brightest_star and c.get('blue') is not None and c.get('red') is not None:
+                    # Special marker on the brightest star, which is removed from the other stars
+                    brightest_index = np.argmin((c['blue'] + c['red']) / 2)
+                    special_ra, special_dec = ra[brightest_index], dec[brightest_index]
+                    keep[brightest_index] = False
+                else:
+                    # Special marker at the Simbad catalog position
+                    special_ra, special_dec = self.sn_ra, self.sn_dec
+                stars.set_offsets(np.column_stack((ra[keep], dec[keep])))
+                if sizing:
+                    # Size of each point relative to the average of blue and red magnitudes, using global min and max magnitudes
+                    stars.set_sizes(max_size * (1 / ((c['blue'][keep] + c['red'][keep]) / 2 - global_min_mag + 1)))
+                special.set_offsets([[special_ra, special_dec]])
+                offsets['ra'], offsets['dec'] = np.min(ra), np.min(dec)
+                if autoscale:
+                    ax.set_xlim(*self.pad_limits(np.append(ra[keep], special_ra)))
+                    ax.set_ylim(*self.pad_limits(np.append(dec[keep], special_dec)))
+        else:
+            raise ValueError(f"Unknown plot type '{plot_type}'")
+        return fig, update
+
+    def plot_figure(self, plot_type, columns, title, include_title=True, **setup_kwargs):
+        fig, update = self.setup_plot(plot_type, include_title, **setup_kwargs)
+        update(columns, title)
+        return fig
+
     def plot_cmd(self, color, magnitude, cmd_label, mag_label, title, include_title=True):
-        cmd_label = cmd_label.replace('\n', ' ')
         #print(f"Debug: Length of color array: {len(color)}, Length of magnitude array: {len(magnitude)}")
         if len(color) != len(magnitude):
             raise ValueError("Color and magnitude arrays do not match in length.")
-        fig = plt.figure(figsize=(9, 8))
-        plt.scatter(color, magnitude, alpha=0.7)
-
-        # Automatically set axes limits
-        x_lower, x_upper = self.set_axes_limits(color)
-        y_lower, y_upper = self.set_axes_limits(magnitude)
-        plt.xlim(x_lower, x_upper)
-        plt.ylim(y_upper, y_lower)  # Invert y-axis for magnitudes
-
-        #plt.xlim(-1, 4) #limits currently hardcoded by eye
-        #plt.ylim(19.5, 25.5)
-        #plt.gca().invert_yaxis()
-        plt.xlabel(cmd_label, fontsize=12, ha='center')
-        plt.ylabel(mag_label, fontsize=12)
-        
-        if include_title:
-            plt.title(title)
-        return fig
+        return self.plot_figure('cmd', {'color': color, 'red': magnitude}, title, include_title, labels={'cmd': cmd_label, 'red': mag_label})
 
     def plot_cmd_density(self, color, magnitude, cmd_label, mag_label, title, include_title=True):
-        # Calculate the point density
-        xy = np.vstack([color, magnitude])
-        kde = gaussian_kde(xy)
-        density = kde(xy)
-
-        fig, ax = plt.subplots(figsize=(8, 8))
-        scatter = ax.scatter(color, magnitude, c=density, cmap='viridis', s=50, alpha=0.7)
-        plt.colorbar(scatter, ax=ax, label='Density')
-        ax.set_xlim(-1, 4)
-        ax.set_ylim(19.5, 25.5)
-        ax.invert_yaxis()
-        ax.set_xlabel(cmd_label, fontsize=12)
-        ax.set_ylabel(mag_label, fontsize=12)
-        # Adjust tick label font size
-        ax.tick_params(axis='both', which='major', labelsize=12)  # Change 14 to your desired font size
-        
-        if include_title:
-            ax.set_title(title)
-        return fig
+        return self.plot_figure('cmd_density', {'color': color, 'red': magnitude}, title, include_title, labels={'cmd': cmd_label, 'red': mag_label})
 
     def plot_color_vs_abs_mag(self, color, abs_magnitude, cmd_label, mag_label, title, include_title=True):
-        fig = plt.figure(figsize=(9, 8))
-        plt.scatter(color, abs_magnitude, alpha=0.7)
-        plt.xlim(-2, 4)  # Adjust these limits based on your data
-        plt.ylim(min(abs_magnitude) - 0.5, max(abs_magnitude) + 0.5)  
-        plt.gca().invert_yaxis() # Invert y-axis for magnitudes
-        plt.xticks(fontsize=12)
-        plt.yticks(fontsize=12)
-        plt.xlabel(cmd_label, fontsize=12, ha='center')
-        plt.ylabel(mag_label, fontsize=12)
-        
-        if include_title:
-            plt.title(title)
-        plt.tight_layout()
-        return fig
+        return self.plot_figure('color_abs_mag', {'color': color, 'red_abs': abs_magnitude}, title, include_title, labels={'cmd': cmd_label, 'red_abs': mag_label})
 
     def plot_mag_mag(self, blue_mag, red_mag, blue_label, red_label, title, include_title=True):
-        fig = plt.figure(figsize=(8, 8))
-        plt.scatter(blue_mag, red_mag, alpha=0.7)
-        plt.xlim(20, 26) #limits currently hardcoded by eye
-        plt.ylim(19.5, 25.5)
-        plt.gca().invert_xaxis()
-        plt.gca().invert_yaxis()
-        plt.xticks(fontsize=12)
-        plt.yticks(fontsize=12)
-        plt.xlabel(self.blue_label, fontsize=12, ha='center')
-        plt.ylabel(self.red_label, fontsize=12)
-        
-        if include_title:
-            plt.title(title)
-        return fig
+        return self.plot_figure('mag_mag', {'blue': blue_mag, 'red': red_mag}, title, include_title, labels={'blue': blue_label, 'red': red_label})
 
     def plot_mag_mag_density(self, blue_mag, red_mag, blue_label, red_label, title, include_title=True):
-        # Calculate the point density
-        xy = np.vstack([blue_mag, red_mag])
-        kde = gaussian_kde(xy)
-        density = kde(xy)
-
-        fig, ax = plt.subplots(figsize=(8, 8))
-        scatter = ax.scatter(blue_mag, red_mag, c=density, cmap='viridis', s=50, alpha=0.7)
-        plt.colorbar(scatter, ax=ax, label='Density')
-        ax.set_xlim(20, 26)  # Adjust these limits based on your data
-        ax.set_ylim(19.5, 25.5)  # Adjust these limits based on your data
-        ax.invert_xaxis()
-        ax.invert_yaxis()
-        ax.set_xlabel(self.blue_label, fontsize=12, ha='center')
-        ax.set_ylabel(self.red_label, fontsize=12)
-        # Adjust tick label font size
-        ax.tick_params(axis='both', which='major', labelsize=12)  # Change 14 to your desired font size
-        
-        if include_title:
-            ax.set_title(title)
-        return fig
+        return self.plot_figure('mag_mag_density', {'blue': blue_mag, 'red': red_mag}, title, include_title, labels={'blue': blue_label, 'red': red_label})
 
     def plot_uncertainty(self, mag, unc, mag_label, unc_label, title, include_title=True):
-        fig, ax = plt.subplots(figsize=(8, 8))
-        ax.scatter(mag, unc)
-        
-        # Find the lowest magnitude point with uncertainty >= 0.10
-        mag_0_10 = mag[unc >= 0.10]
-        if len(mag_0_10) > 0:
-            min_mag_0_10 = min(mag_0_10)
-            ax.plot([16, min_mag_0_10], [0.10, 0.10], color='r', linestyle='--', label='0.10 Uncertainty Threshold')
-            ax.plot([min_mag_0_10, min_mag_0_10], [-0.01, 0.10], color='r', linestyle='--')
-            ax.text(0.95, 0.90, f'Mag @ 0.10 Unc: {min_mag_0_10:.2f}', ha='right', va='top', color='r', transform=ax.transAxes)
-
-        # Find the lowest magnitude point with uncertainty >= 0.15
-        mag_0_15 = mag[unc >= 0.15]
-        if len(mag_0_15) > 0:
-            min_mag_0_15 = min(mag_0_15)
-            ax.plot([16, min_mag_0_15], [0.15, 0.15], color='g', linestyle='--', label='0.15 Uncertainty Threshold')
-            ax.plot([min_mag_0_15, min_mag_0_15], [-0.01, 0.15], color='g', linestyle='--')
-            ax.text(0.95, 0.85, f'Mag @ 0.15 Unc: {min_mag_0_15:.2f}', ha='right', va='top', color='g', transform=ax.transAxes)
-
-        ax.set_xlim(16, 28)  # Adjust these limits based on your data
-        ax.set_ylim(bottom=-0.01)  # Ensure the y-axis starts slightly below 0
-        ax.set_xlabel(mag_label, fontsize=12, ha='center')
-        ax.set_ylabel(unc_label, fontsize=12)
-        # Adjust tick label font size
-        ax.tick_params(axis='both', which='major', labelsize=14)  # Change 14 to your desired font size
-        
-        if include_title:
-            ax.set_title(title)
-        ax.legend()
-        plt.tight_layout()
-        return fig
-
-    def plot_skycoord(self, ra, dec, obj_name, title, include_title=True):
-        # This plot can output an offset for the x-axis and/or y-axis leading to more confusing tick labels
-        base_ra = min(ra)
-        base_offset = base_ra #Currently hardcoding offset by eye
-
-        base_dec = min(dec)
-        base_dec_offset = base_dec #Currently hardcoding offset for clean tick labels
-
-        brightest_index = np.argmin(self.blue_cut)
-        brightest_ra, brightest_dec = ra[brightest_index], dec[brightest_index]
-
-
-        fig = plt.figure(figsize=(8, 8))
-        if self.use_brightest_star and self.blue_cut is not None and self.red_cut is not None:
-            print("Using brightest star for special marker")
-            avg_mag = (self.blue_cut + self.red_cut) / 2
-            brightest_index = np.argmin(avg_mag)
-            special_ra, special_dec = ra[brightest_index], dec[brightest_index]
-            special_label = f"{obj_name}"
-            
-            # Remove the brightest star from the data
-            mask = np.ones(len(ra), dtype=bool)
-            mask[brightest_index] = False
-            ra_filtered = ra[mask]
-            dec_filtered = dec[mask]
-            
-            # Plot all stars except the brightest
-            plt.scatter(ra_filtered, dec_filtered, alpha=0.6)
-        else:
-            print("Using Simbad catalog position for special marker")
-            special_ra, special_dec = self.sn_ra, self.sn_dec
-            special_label = f"{obj_name} (Simbad)"
-            
-            # Plot all stars
-            plt.scatter(ra, dec, alpha=0.6)
+        # The same plot for either filter, drawn as the red one
+        return self.plot_figure('red_unc', {'red': mag, 'red_unc': unc}, title, include_title, labels={'red': mag_label, 'red_unc': unc_label})
 
-        plt.scatter(special_ra, special_dec, color='red', marker='*', s=200, label=special_label)
+    def draw_cutout_background(self, ax, ra, dec, max_cells=600):
+        # Reference image section covering the plotted stars around the SN, drawn in RA/Dec (pixel corners through the WCS, so rotated
+        # images are placed correctly). Larger sections are subsampled to max_cells per side
+        if not self.cutout_background or len(ra) == 0:
+            return
+        half_width = max(np.max(np.abs(ra - self.sn_ra)) * np.cos(np.radians(self.sn_dec)), np.max(np.abs(dec - self.sn_dec)))
+        try:
+            cutout = self.cutouts.cutout(self.ref_file, self.sn_ra, self.sn_dec, 2.2 * half_width * 3600 * u.arcsec)
+        except Exception as e:
+            print(f"Warning: Could not read the reference image cutout: {e}")
+            return
+        step = int(np.ceil(cutout.data.shape[0] / max_cells))
+        data = cutout.data[::step, ::step]
+        corner_y, corner_x = np.meshgrid(np.arange(data.shape[0] + 1) * step - 0.5, np.arange(data.shape[1] + 1) * step - 0.5, indexing='ij')
+        corner_ra, corner_dec = cutout.wcs.all_pix2world(corner_x, corner_y, 0)
+        finite = data[np.isfinite(data)]
+        vmin, vmax = ZScaleInterval().get_limits(finite) if finite.size else (0, 1)
+        ax.pcolormesh(corner_ra, corner_dec, data, cmap='gray_r', vmin=vmin, vmax=vmax, shading='flat', zorder=0, rasterized=True)
+
+    def draw_quality_overlay(self, ax, ra, dec):
+        # Bins of the quality_map_overlay map covering the plotted stars, drawn translucent in RA/Dec with a colorbar
+        if not self.quality_overlay or len(ra) == 0:
+            return
+        try:
+            with fits.open(self.quality_maps_file()) as hdul:
+                hdu = hdul[self.quality_overlay.upper()]
+                data, wcs = hdu.data, WCS(hdu.header)
+        except (IOError, KeyError) as e:
+            print(f"Warning: Could not read quality map {self.quality_overlay} from {self.quality_maps_file()} (run --quality_maps): {e}")
+            return
+        px, py = wcs.all_world2pix(ra, dec, 0)
+        x0, x1 = np.clip([np.round(np.min(px)), np.round(np.max(px)) + 1], 0, data.shape[1]).astype(int)
+        y0, y1 = np.clip([np.round(np.min(py)), np.round(np.max(py)) + 1], 0, data.shape[0]).astype(int)
+        if x1 <= x0 or y1 <= y0:
+            return
+        corner_y, corner_x = np.meshgrid(np.arange(y0, y1 + 1) - 0.5, np.arange(x0, x1 + 1) - 0.5, indexing='ij')
+        corner_ra, corner_dec = wcs.all_pix2world(corner_x, corner_y, 0)
+        mesh = ax.pcolormesh(corner_ra, corner_dec, data[y0:y1, x0:x1], cmap='viridis', alpha=0.35, shading='flat', zorder=0.5, rasterized=True)
+        ax.figure.colorbar(mesh, ax=ax, label=self.quality_overlay.upper())
 
-        #plt.scatter(brightest_ra, brightest_dec, color='red', marker='*', s=200, label=f"{obj_name}")lt.scatter(brightest_ra, brightest_dec, color='red', marker='*', s=200, label=f"{obj_name}")
-        #plt.scatter(sn_ra, sn_dec, color='red', marker='*', label=f"{obj_name}")
-        plt.xlabel('RA (deg)', fontsize=12)
-        plt.ylabel('Dec (deg)', fontsize=12)
-        plt.xticks(fontsize=12)
-        plt.yticks(fontsize=12)
-        if include_title:
-            plt.title(title)
-        plt.gca().xaxis.set_major_formatter(FuncFormatter(lambda x, pos: f'{x + base_offset:.3f}'))
-        plt.gca().yaxis.set_major_formatter(FuncFormatter(lambda y, pos: f'{y + base_dec_offset:.3f}'))
-        plt.legend()
-        return fig
+    def plot_skycoord(self, ra, dec, obj_name, title, include_title=True):
+        # Special marker on the brightest star of the last plotted catalog (blue_cut, red_cut) with use_brightest_star
+        return self.plot_figure('skycoord', {'ra': ra, 'dec': dec, 'blue': self.blue_cut, 'red': self.red_cut}, title, include_title,
+                                labels={'obj_name': obj_name}, background=(ra, dec))
 
     def plot_skycoord_sizing(self, ra, dec, obj_name, title, blue_mag, red_mag, global_min_mag, global_max_mag, include_title=True):
-        # Calculate the size of each point relative to the average of blue and red magnitudes
-        avg_mag = (blue_mag + red_mag) / 2
-        max_size = 150
-
-        # This plot can output an offset for the x-axis and/or y-axis leading to more confusing tick labels
-        base_ra = min(ra)
-        base_offset = base_ra  # Currently hardcoding offset by eye
-
-        base_dec = min(dec)
-        base_dec_offset = base_dec  # Currently hardcoding offset for clean tick labels
-
-        fig = plt.figure(figsize=(8, 8))
-
-        if self.use_brightest_star:
-            print("Using brightest star for special marker (sizing plot)")
-            brightest_index = np.argmin(avg_mag)
-            special_ra, special_dec = ra[brightest_index], dec[brightest_index]
-            special_label = f"{obj_name}"
-            special_size = max_size  # Use maximum size for the special marker
-
-            # Remove the brightest star from the data
-            mask = np.ones(len(ra), dtype=bool)
-            mask[brightest_index] = False
-            ra_filtered = ra[mask]
-            dec_filtered = dec[mask]
-            avg_mag_filtered = avg_mag[mask]
-        else:
-            print("Using Simbad catalog position for special marker (sizing plot)")
-            special_ra, special_dec = self.sn_ra, self.sn_dec
-            special_label = f"{obj_name} (Simbad)"
-            special_size = max_size  # Use maximum size for Simbad position
-
-            # Use all stars for plotting
-            ra_filtered = ra
-            dec_filtered = dec
-            avg_mag_filtered = avg_mag
-
-        # Calculate sizes using global min and max magnitudes
-        sizes_filtered = max_size * (1 / (avg_mag_filtered - global_min_mag + 1))
-
-        # Plot all stars
-        scatter = plt.scatter(ra_filtered, dec_filtered, s=sizes_filtered, alpha=0.6)
-        plt.scatter(special_ra, special_dec, color='red', marker='*', s=special_size, label=special_label)
-
-        # Retrieve the color used by the scatter plot
-        data_color = scatter.get_facecolor()[0]
-
-        # Add legend for magnitude sizes using global min and max magnitudes
-        legend_mags = np.linspace(global_min_mag, global_max_mag, num=4)  # Choose 4 representative magnitudes
-        legend_sizes = max_size * (1 / (legend_mags - global_min_mag + 1))
-        for mag, size in zip(legend_mags, legend_sizes):
-            plt.scatter([], [], s=size, color=data_color, label=f'Mag: {mag:.1f}', alpha=0.6)
-
-        plt.xlabel('RA (deg)', fontsize=12)
-        plt.ylabel('Dec (deg)', fontsize=12)
-        plt.xticks(fontsize=11)
-        plt.yticks(fontsize=11)
-        
-        if include_title:
-            plt.title(title)
-        plt.gca().xaxis.set_major_formatter(FuncFormatter(lambda x, pos: f'{x + base_offset:.4f}'))
-        plt.gca().yaxis.set_major_formatter(FuncFormatter(lambda y, pos: f'{y + base_dec_offset:.4f}'))
-        plt.legend(loc='upper right')
-        plt.tight_layout()
-        return fig
+        return self.plot_figure('skycoord_sizing', {'ra': ra, 'dec': dec, 'blue': blue_mag, 'red': red_mag}, title, include_title,
+                                labels={'obj_name': obj_name}, background=(ra, dec), global_min_mag=global_min_mag, global_max_mag=global_max_mag)
     
     def read_saved_data(self, file_path):
         try:
             data = np.load(file_path, allow_pickle=True)
+            if data.dtype.names:
+                # Compact _full.npy files have named columns, indexed by position without converting them to float64
+                return SavedColumns(data)
             return data
         except Exception as e:
             print(f"Error reading data from {file_path}: {e}")
@@ -1170,6 +2363,30 @@ class PlotManager:
             # Call the plotting function with these arrays and labels
             self.show_plots(pdf_pages, x_cut, y_cut, blue_cut, blue_unc_cut, red_cut, red_unc_cut, color_filtered, ra_cut, dec_cut, blue_abs_cut, red_abs_cut, cmd_label, blue_label, red_label, blue_abs_cut_label, red_abs_cut_label, blue_unc_label, red_unc_label, threshold, global_min_mag, global_max_mag)
 
+    def plot_all_from_files(self, all_data, global_min_mag, global_max_mag, include_titles=True, animate=None):
+        # All thresholds at once: with --pdf, one figure per plot type is reused for every threshold (FigureReuseRenderer), writing the
+        # same per-threshold PDFs as plot_data_from_file. Without --pdf, every threshold is shown as before
+        if not all_data:
+            return
+        datasets = [(threshold, FigureReuseRenderer.columns(data)) for threshold, data in all_data]
+        widest = max(datasets, key=lambda item: len(item[1]['ra']))[1]
+        renderer = FigureReuseRenderer(self, include_titles, global_min_mag, global_max_mag, widest['ra'], widest['dec'])
+        if animate:
+            renderer.animate(animate, datasets, os.path.join(self.data_dir, f"{self.obj_name}_{animate}_thresholds.gif"))
+        if not self.pdf:
+            for threshold, data in all_data:
+                self.plot_data_from_file(data, threshold, global_min_mag, global_max_mag, include_titles)
+            return
+
+        title_suffix = '_notitles' if not include_titles else ""
+        with contextlib.ExitStack() as stack:
+            pdf_files = {threshold: os.path.join(self.data_dir, f"{self.obj_name}_{threshold}pc_plots_from_saved{title_suffix}.pdf") for threshold, _ in all_data}
+            pdf_pages = {threshold: stack.enter_context(PdfPages(pdf_file)) for threshold, pdf_file in pdf_files.items()}
+            renderer.render(datasets, lambda threshold, fig: pdf_pages[threshold].savefig(fig))
+        self.blue_cut, self.red_cut = datasets[-1][1]['blue'], datasets[-1][1]['red']
+        for pdf_file in pdf_files.values():
+            print(f"Successfully generated the PDF file: {pdf_file}!")
+
     # Called with --pdf command. e.g. --phot --pdf [file.pdf]. Saves all figures above to single .pdf
     def generate_and_save_plots(self, pdf_pages, x_cut, y_cut, blue_cut, blue_unc_cut, red_cut, red_unc_cut, color_filtered, ra_cut, dec_cut, blue_abs_cut, red_abs_cut, cmd_label, blue_label, red_label, blue_abs_cut_label, red_abs_cut_label, blue_unc_label, red_unc_label, threshold, include_titles, global_min_mag, global_max_mag):
         #print(f"Debug: Length of data tuple: {len(data)}, Data: {data}")  # Debug statement
@@ -1267,6 +2484,576 @@ class PlotManager:
         skycoord_size_fig = self.plot_skycoord_sizing(ra_cut, dec_cut, self.obj_name, f"{self.phot_file} {threshold}pc Mag-Sizing", blue_cut, red_cut, global_min_mag, global_max_mag)
         skycoord_size_fig.show()
 
+# Maps of where the field gets shallow or crowded, on a grid of bin_size x bin_size reference image pixels: star counts, and percentiles
+# of crowding, S/N and sharpness in each filter, plus the depth (median magnitude of the stars with S/N between 4 and 6, i.e. where S/N
+# falls to ~5). The .phot file is read once, in chunks. Every chunk adds to a histogram of each quantity per bin with one bincount,
+# and the percentiles come out of the cumulative histograms at the end, so memory depends on the grid and not on the catalog size.
+# Maps are written as image extensions of one FITS file with the binned reference WCS (CROWD_P50, SN_RED_P90, DEPTH_BLUE, ...)
+class QualityMaps:
+    # name: (.phot column, histogram range, number of histogram bins, log10 values, magnitude column that must be measured, S/N column for depth)
+    QUANTITIES = {
+        'crowd': (9, (0.0, 5.0), 500, False, None, None),
+        'sn_blue': (19, (0.0, 3.0), 300, True, 15, None),
+        'sn_red': (32, (0.0, 3.0), 300, True, 28, None),
+        'sharp_blue': (20, (-1.0, 1.0), 400, False, 15, None),
+        'sharp_red': (33, (-1.0, 1.0), 400, False, 28, None),
+        'depth_blue': (15, (15.0, 35.0), 1000, False, 15, 19),
+        'depth_red': (28, (15.0, 35.0), 1000, False, 28, 32),
+    }
+
+    def __init__(self, bin_size=64, percentiles=(50, 90), chunk_size=500000):
+        self.bin_size = bin_size
+        self.percentiles = percentiles
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_config(cls, config):
+        # Optional keys under [DOLPHOT_CONFIG]: quality_map_bin (pixels, default 64), quality_map_percentiles (default 50, 90)
+        settings = config['DOLPHOT_CONFIG']
+        percentiles = [float(p) for p in settings.get('quality_map_percentiles', '50, 90').split(',')]
+        return cls(int(settings.get('quality_map_bin', 64)), percentiles)
+
+    @staticmethod
+    def image_shape(ref_file):
+        # (ny, nx) of the first image HDU of the reference file
+        with fits.open(ref_file) as hdul:
+            for hdu in hdul:
+                if hdu.header.get('NAXIS') == 2:
+                    return hdu.header['NAXIS2'], hdu.header['NAXIS1']
+        raise ValueError(f"No image found in {ref_file}")
+
+    def binned_wcs(self, wcs):
+        # Celestial WCS of the bin grid. Distortion terms are dropped, as they are far below the bin size
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            binned = WCS(wcs.to_header())
+        binned.wcs.crpix = (binned.wcs.crpix - 0.5) / self.bin_size + 0.5
+        binned.wcs.cdelt = binned.wcs.cdelt * self.bin_size
+        return binned
+
+    def accumulate(self, phot_file, shape):
+        # Counts per bin and {quantity: histogram per bin}, shaped (ny, nx) and (ny, nx, n_bins)
+        ny, nx = -(-shape[0] // self.bin_size), -(-shape[1] // self.bin_size)
+        n_cells = ny * nx
+        columns = sorted({2, 3} | {c for quantity in self.QUANTITIES.values() for c in (quantity[0], quantity[4], quantity[5]) if c is not None})
+        index = {column: i for i, column in enumerate(columns)}
+        counts = np.zeros(n_cells, dtype=np.int64)
+        histograms = {name: np.zeros(n_cells * bins, dtype=np.int64) for name, (_, _, bins, _, _, _) in self.QUANTITIES.items()}
+
+        n_stars = 0
+        with open(phot_file) as f:
+            while True:
+                lines = list(itertools.islice(f, self.chunk_size))
+                if not lines:
+                    break
+                chunk = np.loadtxt(lines, usecols=columns, ndmin=2)
+                # .phot X/Y are FITS (1-based) pixel coordinates, as in compute_separation
+                ix = np.floor((chunk[:, index[2]] - 0.5) / self.bin_size).astype(np.int64)
+                iy = np.floor((chunk[:, index[3]] - 0.5) / self.bin_size).astype(np.int64)
+                inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+                cell = iy * nx + ix
+                counts += np.bincount(cell[inside], minlength=n_cells)
+                for name, (column, (low, high), bins, log, mag_column, sn_column) in self.QUANTITIES.items():
+                    keep = inside.copy()
+                    if mag_column is not None:
+                        keep &= chunk[:, index[mag_column]] < 90  # DOLPHOT writes 99.999 for undetected stars
+                    if sn_column is not None:
+                        keep &= (chunk[:, index[sn_column]] >= 4) & (chunk[:, index[sn_column]] <= 6)
+                    values = chunk[keep, index[column]]
+                    if log:
+                        values = np.log10(np.maximum(values, 1e-3))
+                    value_bin = np.clip(((values - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
+                    histograms[name] += np.bincount(cell[keep] * bins + value_bin, minlength=n_cells * bins)
+                n_stars += len(chunk)
+                print(f"Quality maps: {n_stars} stars read")
+        return counts.reshape(ny, nx), {name: histogram.reshape(ny, nx, -1) for name, histogram in histograms.items()}
+
+    def percentile_map(self, name, histogram, percentile):
+        # Value of the histogram bin where the cumulative count reaches the percentile, NaN in empty bins
+        _, (low, high), bins, log, _, _ = self.QUANTITIES[name]
+        cumulative = np.cumsum(histogram, axis=-1)
+        total = cumulative[..., -1]
+        value_bin = np.sum(cumulative < percentile / 100 * total[..., None], axis=-1)
+        values = low + (value_bin + 0.5) * (high - low) / bins
+        if log:
+            values = 10 ** values
+        values[total == 0] = np.nan
+        return values.astype(np.float32)
+
+    def run(self, phot_file, ref_file, wcs, output_file):
+        start_time = time.time()
+        counts, histograms = self.accumulate(phot_file, self.image_shape(ref_file))
+        header = self.binned_wcs(wcs).to_header()
+        header['BINSIZE'] = (self.bin_size, 'Reference image pixels per bin')
+        hdus = [fits.PrimaryHDU(counts.astype(np.int32), header=header)]
+        hdus[0].header['EXTNAME'] = 'COUNT'
+        for name, histogram in histograms.items():
+            # Depth is the median magnitude at S/N ~ 5
+            for percentile in ([50] if name.startswith('depth') else self.percentiles):
+                ext_name = name.upper() if name.startswith('depth') else f"{name.upper()}_P{percentile:g}"
+                hdus.append(fits.ImageHDU(self.percentile_map(name, histogram, percentile), header=header, name=ext_name))
+        fits.HDUList(hdus).writeto(output_file, overwrite=True)
+        print(f"Quality maps ({counts.shape[1]}x{counts.shape[0]} bins of {self.bin_size} pixels, {counts.sum()} stars) saved to {output_file} ({time.time() - start_time:.1f}s)")
+        return output_file
+
+
+# Renders the nine --phot plot types for many thresholds with one figure per plot type. Each figure is set up once by
+# PlotManager.setup_plot, the same setup the plot_* methods use, and only its data-dependent artists are updated for each threshold
+# before the figure is saved as a page. The pages are the same as those of generate_and_save_plots
+class FigureReuseRenderer:
+    PLOT_TYPES = ['cmd', 'cmd_density', 'color_abs_mag', 'mag_mag', 'mag_mag_density', 'blue_unc', 'red_unc', 'skycoord', 'skycoord_sizing']
+
+    def __init__(self, plotter, include_titles=True, global_min_mag=None, global_max_mag=None, background_ra=None, background_dec=None):
+        # background_ra/dec: positions the cutout background and quality map overlay of the sky plots must cover (the largest threshold)
+        self.plotter = plotter
+        self.include_titles = include_titles
+        self.global_min_mag = global_min_mag
+        self.global_max_mag = global_max_mag
+        self.background = (background_ra, background_dec) if background_ra is not None else None
+        self.figures = {}
+
+    @staticmethod
+    def columns(data):
+        # Columns of a saved _full.npy, see save_processed_data
+        names = ['x', 'y', 'blue', 'blue_unc', 'red', 'red_unc', 'color', 'ra', 'dec', 'blue_abs', 'red_abs']
+        return {name: data[:, index] for index, name in enumerate(names)}
+
+    def setup(self, plot_type):
+        fig, update = self.plotter.setup_plot(plot_type, self.include_titles, background=self.background,
+                                              global_min_mag=self.global_min_mag, global_max_mag=self.global_max_mag)
+        self.figures[plot_type] = (fig, update)
+        return fig, update
+
+    def update(self, plot_type, threshold, columns):
+        fig, update = self.figures.get(plot_type) or self.setup(plot_type)
+        update(columns, self.plotter.plot_title(plot_type, threshold))
+        return fig
+
+    def render(self, datasets, save_page, plot_types=None):
+        # datasets: list of (threshold, columns). save_page(threshold, fig) is called for every plot type and threshold, in the page
+        # order of generate_and_save_plots within each threshold
+        for plot_type in plot_types or self.PLOT_TYPES:
+            for threshold, columns in datasets:
+                save_page(threshold, self.update(plot_type, threshold, columns))
+            plt.close(self.figures.pop(plot_type)[0])
+
+    def animate(self, plot_type, datasets, output_file, fps=2):
+        # One frame per threshold, e.g. the CMD growing with radius
+        fig, _ = self.setup(plot_type)
+        animation = FuncAnimation(fig, lambda frame: self.update(plot_type, *datasets[frame]), frames=len(datasets), blit=False)
+        animation.save(output_file, writer=PillowWriter(fps=fps))
+        plt.close(self.figures.pop(plot_type)[0])
+        print(f"Animation saved to {output_file}")
+
+# Named CMD polygons (e.g. red supergiants, blue loop, MS turnoff) from [CMD_REGIONS] in config.ini, one per line as
+#   rsg = 1.6 -5.0, 3.2 -5.0, 3.2 -9.0, 1.6 -9.0
+# with (color, magnitude) vertices. The magnitude axis is set by cmd_region_magnitude under [DOLPHOT_CONFIG]: red_abs (default),
+# blue_abs, red or blue. Membership is one bit per region (bit i for the i-th region), so a star can sit in several regions.
+# The tests are vectorized: a bounding-box prefilter, then Path.contains_points in chunks of chunk_size stars
+class CMDRegions:
+    MAGNITUDES = ('red_abs', 'blue_abs', 'red', 'blue')
+
+    def __init__(self, regions, magnitude='red_abs', chunk_size=1000000):
+        # regions: {name: (n, 2) array of (color, magnitude) vertices}, in bit order
+        if len(regions) > 64:
+            raise ValueError("At most 64 CMD regions are supported")
+        if magnitude not in self.MAGNITUDES:
+            raise ValueError(f"cmd_region_magnitude must be one of {', '.join(self.MAGNITUDES)}")
+        self.regions = regions
+        self.magnitude = magnitude
+        self.chunk_size = chunk_size
+        self.dtype = next(dtype for dtype, bits in ((np.uint8, 8), (np.uint16, 16), (np.uint32, 32), (np.uint64, 64)) if len(regions) <= bits)
+
+    @classmethod
+    def from_config(cls, config):
+        if 'CMD_REGIONS' not in config or len(config['CMD_REGIONS']) == 0:
+            raise ValueError("Define at least one polygon under [CMD_REGIONS] in config.ini, as name = color mag, color mag, color mag, ...")
+        regions = {}
+        for name, value in config['CMD_REGIONS'].items():
+            vertices = np.array([[float(number) for number in vertex.split()] for vertex in value.split(',')])
+            if vertices.ndim != 2 or vertices.shape[1] != 2 or len(vertices) < 3:
+                raise ValueError(f"CMD region '{name}' needs at least three 'color magnitude' vertices")
+            regions[name] = vertices
+        return cls(regions, config['DOLPHOT_CONFIG'].get('cmd_region_magnitude', 'red_abs'))
+
+    def membership(self, color, mag):
+        # Bitmask of the regions containing every (color, mag) point; NaN points are in no region
+        bits = np.zeros(len(color), dtype=self.dtype)
+        finite = np.flatnonzero(np.isfinite(color) & np.isfinite(mag))
+        for bit, vertices in enumerate(self.regions.values()):
+            path = Path(vertices, closed=False)
+            (color_min, mag_min), (color_max, mag_max) = vertices.min(axis=0), vertices.max(axis=0)
+            candidates = finite[(color[finite] >= color_min) & (color[finite] <= color_max) & (mag[finite] >= mag_min) & (mag[finite] <= mag_max)]
+            for start in range(0, len(candidates), self.chunk_size):
+                chunk = candidates[start:start + self.chunk_size]
+                inside = path.contains_points(np.column_stack((color[chunk], mag[chunk])))
+                bits[chunk[inside]] |= self.dtype(1 << bit)
+        return bits
+
+    def counts(self, bits):
+        return {name: int(np.count_nonzero(bits & self.dtype(1 << bit))) for bit, name in enumerate(self.regions)}
+
+    def select(self, bits, name):
+        # Boolean mask of the stars in one region
+        return (bits & self.dtype(1 << list(self.regions).index(name))) != 0
+
+    def to_dict(self):
+        return {'magnitude': self.magnitude, 'regions': {name: {'bit': bit, 'vertices': vertices.tolist()} for bit, (name, vertices) in enumerate(self.regions.items())}}
+
+# Differential reddening correction from nearest-neighbor reference stars, settings under [REDDENING] in config.ini. The CMD (blue - red
+# vs red) is rotated so that the abscissa runs along the reddening vector, whose direction comes from the A_filter/A_V coefficients
+# in Gale's extdict for system_name (or reddening coefficients given as coefficients = blue, red). A fiducial line through the
+# reference stars (quality-cut stars of one [CMD_REGIONS] polygon given as reference_region, or all quality-cut stars) gives each of
+# them an offset along the vector, in A_V. The dA_V of every star is the median offset of its k nearest reference stars on the sky
+# (itself excluded), found with a KD-tree in pixel space, queried in chunks on all cores. A few iterations refine the fiducial line
+class DifferentialReddening:
+    def __init__(self, blue_coefficient, red_coefficient, k=30, iterations=2, fiducial_bin=0.25, chunk_size=200000, workers=-1):
+        self.blue_coefficient = blue_coefficient
+        self.red_coefficient = red_coefficient
+        self.k = k
+        self.iterations = iterations
+        self.fiducial_bin = fiducial_bin
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    @staticmethod
+    def extinction_coefficients(model, system_name, blue_label, red_label):
+        # A_filter/A_V of both filters from Gale's extdict. Gale needs the isochrone download dependencies, so it is only imported here
+        try:
+            from Gale import extdict
+        except ImportError as e:
+            raise ValueError(f"Could not import the extinction coefficients from Gale.py ({e}). Set coefficients = blue, red under [REDDENING]")
+        phot_system = extdict.get(model, {}).get(system_name, {})
+        blue_filter, red_filter = blue_label.split('_')[-1], red_label.split('_')[-1]
+        if blue_filter not in phot_system or red_filter not in phot_system:
+            raise ValueError(f"No {model} extinction coefficients for {blue_filter}/{red_filter} in {system_name}. Set coefficients = blue, red under [REDDENING]")
+        return phot_system[blue_filter], phot_system[red_filter]
+
+    @classmethod
+    def from_config(cls, config, blue_label, red_label):
+        settings = config['REDDENING'] if 'REDDENING' in config else {}
+        if settings.get('coefficients'):
+            blue_coefficient, red_coefficient = (float(v) for v in settings['coefficients'].split(','))
+        else:
+            blue_coefficient, red_coefficient = cls.extinction_coefficients(settings.get('model', 'Parsec'), config['DOLPHOT_CONFIG'].get('system_name', ''), blue_label, red_label)
+        if blue_coefficient == red_coefficient:
+            raise ValueError("The reddening vector has no color component; check the extinction coefficients")
+        return cls(blue_coefficient, red_coefficient, int(settings.get('k', 30)), int(settings.get('iterations', 2)), float(settings.get('fiducial_bin', 0.25)),
+                   workers=int(settings.get('workers', -1)))
+
+    def rotate(self, color, mag):
+        # (abscissa along the reddening vector, ordinate across it), both in magnitudes
+        vector = np.array([self.blue_coefficient - self.red_coefficient, self.red_coefficient])
+        direction = vector / np.linalg.norm(vector)
+        return color * direction[0] + mag * direction[1], -color * direction[1] + mag * direction[0]
+
+    def reference_offsets(self, color, mag):
+        # Offsets of the reference stars from the fiducial line (running median of the abscissa in bins of the ordinate), in A_V
+        abscissa, ordinate = self.rotate(color, mag)
+        edges = np.arange(np.min(ordinate), np.max(ordinate) + self.fiducial_bin, self.fiducial_bin)
+        bins = np.digitize(ordinate, edges) - 1
+        centers, medians = [], []
+        for index in np.unique(bins):
+            members = bins == index
+            if members.sum() >= 5:
+                centers.append(np.median(ordinate[members]))
+                medians.append(np.median(abscissa[members]))
+        if len(centers) < 2:
+            raise ValueError("Too few reference stars for a fiducial line; widen reference_region or fiducial_bin")
+        vector_length = np.hypot(self.blue_coefficient - self.red_coefficient, self.red_coefficient)
+        return (abscissa - np.interp(ordinate, centers, medians)) / vector_length
+
+    def neighbor_median(self, tree, x, y, offsets, reference_index):
+        # Median reference offset of the k nearest reference stars of every star; reference stars skip themselves. Returns (median, error)
+        k = min(self.k, tree.n - 1)
+        delta_av, error = np.empty(len(x)), np.empty(len(x))
+        for start in range(0, len(x), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            _, neighbors = tree.query(np.column_stack((x[chunk], y[chunk])), k + 1, workers=self.workers)
+            # Move the star itself (if it is a reference star) to the last column, then drop the last column
+            is_self = neighbors == reference_index[chunk, None]
+            neighbors = np.take_along_axis(neighbors, np.argsort(is_self, axis=1, kind='stable'), axis=1)[:, :k]
+            values = offsets[neighbors]
+            delta_av[chunk] = np.median(values, axis=1)
+            error[chunk] = 1.4826 * np.median(np.abs(values - delta_av[chunk, None]), axis=1) / np.sqrt(k)
+        return delta_av, error
+
+    def correct(self, x, y, blue, red, reference):
+        # reference: boolean mask of the reference stars. Returns dA_V, its error and the corrected blue and red magnitudes of every star
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        blue, red = np.asarray(blue, dtype=np.float64), np.asarray(red, dtype=np.float64)
+        reference = np.flatnonzero(reference)
+        if len(reference) <= self.k:
+            raise ValueError(f"Only {len(reference)} reference stars, need more than k = {self.k}")
+        tree = cKDTree(np.column_stack((x[reference], y[reference])))
+        reference_index = np.full(len(x), -1, dtype=np.int64)
+        reference_index[reference] = np.arange(len(reference))
+
+        delta_av, error = np.zeros(len(x)), np.zeros(len(x))
+        for iteration in range(self.iterations):
+            blue_corrected, red_corrected = blue - self.blue_coefficient * delta_av, red - self.red_coefficient * delta_av
+            offsets = self.reference_offsets((blue_corrected - red_corrected)[reference], red_corrected[reference])
+            step, error = self.neighbor_median(tree, x, y, offsets, reference_index)
+            delta_av += step
+            print(f"Differential reddening iteration {iteration + 1}: median |step| {np.median(np.abs(step)):.3f} mag A_V")
+        return delta_av, error, blue - self.blue_coefficient * delta_av, red - self.red_coefficient * delta_av
+
+
+# Statistical field-star decontamination of the CMD inside each proximity threshold, settings under [DECONTAMINATION] in config.ini.
+# The control field is an annulus around the SN of the same area as the threshold circle, from control_gap times the threshold
+# outwards. For every star inside the threshold, the distance to its k-th nearest neighbor in the CMD (color scaled by color_weight)
+# among the stars inside gives the local density there, and the number of control stars within the same distance gives the field
+# density; the membership probability is 1 - field / local density, clipped to [0, 1]. Both use KD-trees, the control counts in one
+# vectorized ball query, so large control fields stay fast. Areas are corrected for the parts of the circle and annulus that fall
+# outside the catalog footprint (estimated from random points on an occupancy grid of the catalog)
+class FieldDecontamination:
+    def __init__(self, k=10, control_gap=2.0, color_weight=1.0, samples=20000, footprint_bin=64):
+        self.k = k
+        self.control_gap = control_gap
+        self.color_weight = color_weight
+        self.samples = samples
+        self.footprint_bin = footprint_bin
+
+    @classmethod
+    def from_config(cls, config):
+        settings = config['DECONTAMINATION'] if 'DECONTAMINATION' in config else {}
+        control_gap = float(settings.get('control_gap', 2.0))
+        if control_gap < 1:
+            raise ValueError("control_gap under [DECONTAMINATION] must be at least 1 (the annulus starts outside the threshold)")
+        return cls(int(settings.get('k', 10)), control_gap, float(settings.get('color_weight', 1.0)), int(settings.get('samples', 20000)))
+
+    def annulus(self, radius):
+        # Inner and outer radius of the control annulus with the area of a circle of this radius
+        inner = self.control_gap * radius
+        return inner, np.sqrt(inner**2 + radius**2)
+
+    def coverage(self, x, y, wcs, sn_ra, sn_dec, distance, inner, outer, seed=0):
+        # Fraction of the ring between inner and outer (pc) covered by the catalog, from random points on an occupancy grid of the stars
+        ix, iy = (x // self.footprint_bin).astype(np.int64), (y // self.footprint_bin).astype(np.int64)
+        occupied = np.zeros((iy.max() + 1, ix.max() + 1), dtype=bool)
+        occupied[iy, ix] = True
+        rng = np.random.default_rng(seed)
+        radius = np.sqrt(rng.uniform(inner**2, outer**2, self.samples)) / distance
+        angle = rng.uniform(0, 2 * np.pi, self.samples)
+        dec = sn_dec + np.degrees(radius * np.sin(angle))
+        ra = sn_ra + np.degrees(radius * np.cos(angle)) / np.cos(np.radians(sn_dec))
+        px, py = wcs.all_world2pix(ra, dec, 1)
+        px, py = np.floor(px / self.footprint_bin).astype(np.int64), np.floor(py / self.footprint_bin).astype(np.int64)
+        inside = (px >= 0) & (px < occupied.shape[1]) & (py >= 0) & (py < occupied.shape[0])
+        return np.count_nonzero(occupied[py[inside], px[inside]]) / self.samples
+
+    def membership(self, color, mag, control_color, control_mag, area_ratio):
+        # area_ratio: area of the control field over the area inside the threshold (both as covered by the catalog)
+        points = np.column_stack((color * self.color_weight, mag))
+        k = min(self.k, len(points) - 1)
+        if k < 1 or len(control_color) == 0:
+            return np.ones(len(points))
+        distances, _ = cKDTree(points).query(points, k + 1, workers=-1)
+        kth_distance = distances[:, k]
+        control_counts = cKDTree(np.column_stack((control_color * self.color_weight, control_mag))).query_ball_point(
+            points, kth_distance, return_length=True, workers=-1)
+        return np.clip(1 - control_counts / area_ratio / k, 0, 1)
+
+
+# Binned CMDs (Hess diagrams) for every proximity threshold at once. Stars are sorted by distance from the SN once, each star is assigned to the
+# radial shell between consecutive thresholds, and a single bincount over (error class, shell, magnitude bin, color bin) followed by a
+# cumulative sum over the shells gives the Hess diagram inside every threshold. With error smoothing, the stars are split into classes of
+# similar color/magnitude uncertainty and each class is convolved with a Gaussian of that width before summing, which spreads every star by
+# (approximately) its own photometric error. Called with --hess
+class HessDiagram:
+    def __init__(self, color_range=(-1.0, 4.0), mag_range=(18.0, 28.0), color_bin=0.05, mag_bin=0.1, smooth_errors=True, error_classes=8):
+        self.color_edges = np.arange(color_range[0], color_range[1] + color_bin / 2, color_bin)
+        self.mag_edges = np.arange(mag_range[0], mag_range[1] + mag_bin / 2, mag_bin)
+        self.color_bin = color_bin
+        self.mag_bin = mag_bin
+        self.smooth_errors = smooth_errors
+        self.error_classes = error_classes
+
+    @classmethod
+    def from_config(cls, config):
+        # Optional keys under [DOLPHOT_CONFIG]: hess_color_range, hess_mag_range, hess_bin_size (color, mag), hess_error_smoothing
+        dolphot_config = config['DOLPHOT_CONFIG']
+        def pair(key, default):
+            value = dolphot_config.get(key)
+            return tuple(float(v) for v in value.split(',')) if value else default
+        color_bin, mag_bin = pair('hess_bin_size', (0.05, 0.1))
+        smooth = dolphot_config.get('hess_error_smoothing', 'yes').lower() not in ('no', 'n', 'false', '0')
+        return cls(pair('hess_color_range', (-1.0, 4.0)), pair('hess_mag_range', (18.0, 28.0)), color_bin, mag_bin, smooth)
+
+    def error_class(self, errors, bin_size):
+        # Quantize uncertainties (in units of bins) into log-spaced classes; returns the class of each star and the sigma of each class
+        sigma = np.clip(errors / bin_size, 1e-3, None)
+        edges = np.logspace(np.log10(sigma.min()), np.log10(sigma.max()) + 1e-9, self.error_classes + 1) if len(sigma) else np.array([0.0, 1.0])
+        classes = np.clip(np.searchsorted(edges, sigma, side='right') - 1, 0, self.error_classes - 1)
+        class_sigma = np.sqrt(edges[:-1] * edges[1:])
+        return classes, class_sigma
+
+    def build(self, color, mag, color_err, mag_err, radius, thresholds):
+        # Returns (hess, counts), both shaped (n_thresholds, n_mag_bins, n_color_bins). counts are raw star counts, hess is error-smoothed
+        thresholds = np.sort(np.asarray(thresholds, dtype=float))
+        n_thr, n_mag, n_color = len(thresholds), len(self.mag_edges) - 1, len(self.color_edges) - 1
+
+        # Sort by radius once; the shell of each star then follows from the positions of the thresholds in the sorted radii
+        order = np.argsort(radius, kind='stable')
+        ends = np.searchsorted(radius[order], thresholds, side='right')
+        shell = np.repeat(np.arange(n_thr), np.diff(np.concatenate(([0], ends))))
+        inside = order[:ends[-1]] if n_thr else order[:0]
+        color, mag, color_err, mag_err = color[inside], mag[inside], color_err[inside], mag_err[inside]
+
+        color_idx = np.floor((color - self.color_edges[0]) / self.color_bin).astype(np.int64)
+        mag_idx = np.floor((mag - self.mag_edges[0]) / self.mag_bin).astype(np.int64)
+        in_range = (color_idx >= 0) & (color_idx < n_color) & (mag_idx >= 0) & (mag_idx < n_mag)
+
+        if self.smooth_errors:
+            color_class, color_sigma = self.error_class(color_err[in_range], self.color_bin)
+            mag_class, mag_sigma = self.error_class(mag_err[in_range], self.mag_bin)
+            n_classes = self.error_classes
+        else:
+            color_class = mag_class = np.zeros(np.count_nonzero(in_range), dtype=np.int64)
+            color_sigma = mag_sigma = np.zeros(1)
+            n_classes = 1
+
+        flat = (((color_class * n_classes + mag_class) * n_thr + shell[in_range]) * n_mag + mag_idx[in_range]) * n_color + color_idx[in_range]
+        binned = np.bincount(flat, minlength=n_classes * n_classes * n_thr * n_mag * n_color)
+        binned = binned.reshape(n_classes, n_classes, n_thr, n_mag, n_color).cumsum(axis=2)
+
+        counts = binned.sum(axis=(0, 1)).astype(np.int32)
+        if not self.smooth_errors:
+            return counts.astype(np.float32), counts
+        hess = np.zeros((n_thr, n_mag, n_color), dtype=np.float64)
+        for ci in range(n_classes):
+            for mi in range(n_classes):
+                if binned[ci, mi, -1].any():
+                    hess += ndimage.gaussian_filter(binned[ci, mi].astype(np.float64), sigma=(0, mag_sigma[mi], color_sigma[ci]), mode='constant')
+        return hess.astype(np.float32), counts
+
+    def save(self, file_name, hess, counts, thresholds, color_label, mag_label):
+        np.savez_compressed(file_name, hess=hess, counts=counts, color_edges=self.color_edges, mag_edges=self.mag_edges,
+                            thresholds=np.sort(np.asarray(thresholds, dtype=float)), color_label=color_label, mag_label=mag_label,
+                            smoothed=self.smooth_errors)
+        print(f"Hess diagrams saved to {file_name}")
+
+    @staticmethod
+    def load(file_name):
+        with np.load(file_name) as hess_file:
+            return {key: hess_file[key] for key in hess_file.files}
+
+    @staticmethod
+    def plot(hess_data, index, title=None, include_title=True):
+        # Plot one threshold of a saved (or freshly built) Hess file, straight from the binned array
+        fig, ax = plt.subplots(figsize=(8, 8))
+        image = ax.pcolormesh(hess_data['color_edges'], hess_data['mag_edges'], hess_data['hess'][index], cmap='viridis', shading='flat')
+        fig.colorbar(image, ax=ax, label='Stars per bin (error smoothed)' if hess_data['smoothed'] else 'Stars per bin')
+        ax.invert_yaxis()
+        ax.set_xlabel(str(hess_data['color_label']), fontsize=12)
+        ax.set_ylabel(str(hess_data['mag_label']), fontsize=12)
+        ax.tick_params(axis='both', which='major', labelsize=12)
+        if include_title:
+            ax.set_title(title if title else f"Hess diagram {hess_data['thresholds'][index]:g}pc")
+        return fig
+
+# Completeness of the catalog as a function of magnitude, color and position, from artificial star tests (DOLPHOT .fake output).
+# Injected and recovered fake stars are binned into 4D grids (red magnitude, blue - red color, X, Y) with histogramdd and smoothed,
+# and their ratio is the completeness. The mean magnitude and color offsets of the recovered stars (output - input) are kept as bias grids.
+# Grids are saved compactly (.npz), and apply() interpolates all of them for any number of stars at once. Settings under [COMPLETENESS]
+class CompletenessGrid:
+    AXES = ('red', 'color', 'x', 'y')
+
+    def __init__(self, edges, injected, recovered, completeness, red_bias, color_bias):
+        self.edges = edges
+        self.injected = injected
+        self.recovered = recovered
+        self.completeness = completeness
+        self.red_bias = red_bias
+        self.color_bias = color_bias
+        self._interpolators = None
+
+    @staticmethod
+    def read_fake(fake_file, input_columns, output_offset):
+        # Input X, Y, blue and red magnitudes, and the recovered blue and red magnitudes (output in the .phot layout after output_offset)
+        x_column, y_column, blue_column, red_column = input_columns
+        data = np.genfromtxt(fake_file, usecols=[x_column, y_column, blue_column, red_column, output_offset + 15, output_offset + 28])
+        return data.T
+
+    @staticmethod
+    def fill_empty(values):
+        # Cells without fake stars take the value of the nearest cell with some
+        empty = ~np.isfinite(values)
+        if not empty.any() or empty.all():
+            return values
+        indices = ndimage.distance_transform_edt(empty, return_distances=False, return_indices=True)
+        return values[tuple(indices)]
+
+    @classmethod
+    def build(cls, fake_file, input_columns=(2, 3, 5, 7), output_offset=8, mag_bins=(18.0, 30.0, 0.25), color_bins=(-1.0, 4.0, 0.25),
+              position_bins=4, smoothing=1.0, max_delta=0.75):
+        # A fake star is recovered if it was measured in both filters within max_delta magnitudes of its input
+        x, y, blue_in, red_in, blue_out, red_out = cls.read_fake(fake_file, input_columns, output_offset)
+        recovered = (blue_out < 90) & (red_out < 90) & (np.abs(blue_out - blue_in) <= max_delta) & (np.abs(red_out - red_in) <= max_delta)
+        edges = [np.arange(mag_bins[0], mag_bins[1] + mag_bins[2] / 2, mag_bins[2]),
+                 np.arange(color_bins[0], color_bins[1] + color_bins[2] / 2, color_bins[2]),
+                 np.linspace(np.min(x), np.max(x) + 1e-6, position_bins + 1),
+                 np.linspace(np.min(y), np.max(y) + 1e-6, position_bins + 1)]
+        sample = np.column_stack((red_in, blue_in - red_in, x, y))
+        injected_counts, _ = np.histogramdd(sample, bins=edges)
+        recovered_counts, _ = np.histogramdd(sample[recovered], bins=edges)
+        red_delta, _ = np.histogramdd(sample[recovered], bins=edges, weights=(red_out - red_in)[recovered])
+        color_delta, _ = np.histogramdd(sample[recovered], bins=edges, weights=((blue_out - red_out) - (blue_in - red_in))[recovered])
+
+        # Smooth along magnitude and color only; the position bins are coarse already
+        sigma = (smoothing, smoothing, 0, 0)
+        smooth = lambda grid: ndimage.gaussian_filter(grid, sigma, mode='nearest') if smoothing > 0 else grid
+        smooth_injected, smooth_recovered = smooth(injected_counts), smooth(recovered_counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            completeness = np.where(smooth_injected > 1e-3, smooth_recovered / smooth_injected, np.nan)
+            red_bias = np.where(smooth_recovered > 1e-3, smooth(red_delta) / smooth_recovered, np.nan)
+            color_bias = np.where(smooth_recovered > 1e-3, smooth(color_delta) / smooth_recovered, np.nan)
+        print(f"Completeness grid from {len(x)} fake stars ({recovered.sum()} recovered), shape {completeness.shape}")
+        return cls(edges, injected_counts.astype(np.int32), recovered_counts.astype(np.int32), np.clip(cls.fill_empty(completeness), 0, 1).astype(np.float32),
+                   cls.fill_empty(red_bias).astype(np.float32), cls.fill_empty(color_bias).astype(np.float32))
+
+    def save(self, file_name):
+        np.savez_compressed(file_name, injected=self.injected, recovered=self.recovered, completeness=self.completeness, red_bias=self.red_bias,
+                            color_bias=self.color_bias, **{f"{axis}_edges": edges for axis, edges in zip(self.AXES, self.edges)})
+        print(f"Completeness grid saved to {file_name}")
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as grid_file:
+            return cls([grid_file[f"{axis}_edges"] for axis in cls.AXES],
+                       grid_file['injected'], grid_file['recovered'], grid_file['completeness'], grid_file['red_bias'], grid_file['color_bias'])
+
+    @classmethod
+    def from_config(cls, config, output_file):
+        # Loads output_file if it is newer than the fake star file, else builds the grid from the [COMPLETENESS] settings and saves it
+        settings = config['COMPLETENESS'] if 'COMPLETENESS' in config else {}
+        fake_file = settings.get('fake_file') or f"{config['DOLPHOT_CONFIG'].get('phot_file')}.fake"
+        if not os.path.isfile(fake_file):
+            raise ValueError(f"Fake star file '{fake_file}' not found. Set fake_file under [COMPLETENESS]")
+        if os.path.isfile(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(fake_file):
+            return cls.load(output_file)
+        numbers = lambda key, default: tuple(float(v) for v in settings.get(key, default).split(','))
+        position_bins = int(settings.get('position_bins', 4))
+        if position_bins < 2:
+            raise ValueError("position_bins under [COMPLETENESS] must be at least 2")
+        grid = cls.build(fake_file, tuple(int(c) for c in settings.get('input_columns', '2, 3, 5, 7').split(',')), int(settings.get('output_offset', 8)),
+                         numbers('mag_bins', '18, 30, 0.25'), numbers('color_bins', '-1, 4, 0.25'), position_bins,
+                         float(settings.get('smoothing', 1.0)), float(settings.get('max_delta', 0.75)))
+        grid.save(output_file)
+        return grid
+
+    def apply(self, red, color, x, y):
+        # (completeness, red magnitude bias, color bias) of every star, interpolated linearly between bin centers. Stars outside the
+        # grid take the values of its edge
+        centers = [(edges[:-1] + edges[1:]) / 2 for edges in self.edges]
+        if self._interpolators is None:
+            self._interpolators = [RegularGridInterpolator(centers, grid, bounds_error=False, fill_value=None)
+                                   for grid in (self.completeness, self.red_bias, self.color_bias)]
+        points = np.column_stack([np.clip(values, axis_centers[0], axis_centers[-1]) for values, axis_centers in zip((red, color, x, y), centers)])
+        completeness, red_bias, color_bias = (interpolator(points) for interpolator in self._interpolators)
+        return np.clip(completeness, 0, 1), red_bias, color_bias
+
+
 class StarDistanceHistogram:
     def __init__(self, phot_file, ref_file, obj_name, distance_pc):
         self.phot_file = phot_file
@@ -1361,8 +3148,10 @@ class StarDistanceHistogram:
             print(f"Error getting WCS information: {e}")
             return None
 
-    def get_object_coordinates(self):
-        """Get object coordinates from SIMBAD or manual input"""
+    def get_object_coordinates(self, sn_coords=None):
+        """Get object coordinates from SIMBAD or manual input, or from sn_coords ((RA, DEC) in degrees or 'simbad') without prompting"""
+        if sn_coords is not None:
+            return resolve_coordinates(self.obj_name, sn_coords)
         while True:
             choice = input("Enter 1 for SIMBAD query or 2 for manual RA/Dec input: ")
             
@@ -1494,57 +3283,1668 @@ class StarDistanceHistogram:
         plt.close()
         print(f"Histogram saved as {output_file}")
 
+# Run the --dolphot pipeline for many SN fields (one directory with its own config.ini each) at once. Fields are started as soon as
+# the global CPU and memory budget allows. Fields with a cached DOLPHOT build (DolphotBuildCache) run with their own install tree; fields
+# built in place are only run concurrently when they share the camera (system_name), switching the build with 'make' in between. Progress is kept in a status file, so --batch_resume only reruns
+# fields that did not finish. Called with --batch
+class BatchRunner:
+    VALID_SYSTEMS = ['WFPC2', 'ACS', 'WFC3', 'ROMAN', 'NIRCAM', 'NIRISS', 'MIRI']
+
+    def __init__(self, field_dirs, max_cpus=None, max_mem_gb=None, status_file='batch_status.json', resume=False, poll_interval=10):
+        self.field_dirs = [os.path.abspath(field_dir) for field_dir in field_dirs]
+        self.max_cpus = max_cpus if max_cpus else os.cpu_count()
+        self.max_mem_gb = max_mem_gb if max_mem_gb else self.available_memory_gb()
+        self.status_file = os.path.abspath(status_file)
+        self.resume = resume
+        self.poll_interval = poll_interval
+        self.running = {}
+        self.pending_fields = []
+        self.active_camera = None
+
+    @staticmethod
+    def available_memory_gb():
+        # Leave 20% of the physical memory to the system
+        try:
+            return 0.8 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1024**3
+        except (ValueError, OSError, AttributeError):
+            return 16.0
+
+    @staticmethod
+    def read_field_list(entries):
+        # Entries are field directories, or text files listing one field directory per line
+        field_dirs = []
+        for entry in entries:
+            if os.path.isfile(entry):
+                with open(entry, 'r') as f:
+                    field_dirs += [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+            else:
+                field_dirs.append(entry)
+        return field_dirs
+
+    def load_field(self, field_dir):
+        # Per-field resources: 'batch_cpus' and 'batch_mem_gb' under [DOLPHOT_CONFIG], otherwise one CPU (dolphot is single threaded)
+        # and three times the size of the images in the field directory
+        config = configparser.ConfigParser()
+        config.read(os.path.join(field_dir, 'config.ini'))
+        if 'DOLPHOT_CONFIG' not in config:
+            return {'state': 'failed', 'error': 'config.ini or [DOLPHOT_CONFIG] missing'}
+        dolphot_config = config['DOLPHOT_CONFIG']
+        system_name = dolphot_config.get('system_name', '')
+        image_bytes = sum(os.path.getsize(path) for path in glob.glob(os.path.join(field_dir, '*.fits')))
+        return {
+            'obj_name': dolphot_config.get('obj_name'),
+            'system_name': system_name,
+            'camera': system_name.split('_')[0],
+            'make_path': dolphot_config.get('make_path'),
+            'cached_build': DolphotBuildCache.from_config(config) is not None,
+            'cpus': int(dolphot_config.get('batch_cpus', 1)),
+            'mem_gb': float(dolphot_config.get('batch_mem_gb', max(1.0, 3 * image_bytes / 1024**3))),
+            'state': 'pending',
+        }
+
+    def load_status(self):
+        status = {}
+        if self.resume and os.path.exists(self.status_file):
+            with open(self.status_file, 'r') as f:
+                status = json.load(f)
+        for field_dir in self.field_dirs:
+            previous = status.get(field_dir, {})
+            # Finished fields are left untouched on resume, everything else is (re)started
+            if previous.get('state') == 'done':
+                continue
+            status[field_dir] = self.load_field(field_dir)
+            if status[field_dir]['state'] == 'pending' and status[field_dir]['camera'] not in self.VALID_SYSTEMS:
+                status[field_dir].update(state='failed', error=f"system_name '{status[field_dir]['system_name']}' is not recognized")
+        return status
+
+    def save_status(self, status):
+        tmp_file = self.status_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_file, self.status_file)
+
+    def field_progress(self, field_dir, field):
+        # Progress of a running field, as published by its DolphotProgressMonitor
+        status_file = os.path.join(field_dir, f"dolphot_{field['obj_name']}_{field['system_name']}.status.json")
+        try:
+            return DolphotProgressMonitor.read_status(status_file)
+        except (IOError, ValueError):
+            return {}
+
+    def print_table(self, status):
+        print(f"\n{'field':<40}{'system':<12}{'state':<10}{'stage':<16}{'progress':>9}{'ETA (h)':>9}")
+        for field_dir, field in status.items():
+            if field_dir not in self.field_dirs:
+                continue
+            progress = self.field_progress(field_dir, field) if field['state'] == 'running' else {}
+            percent = f"{100 * progress['progress']:.1f}%" if progress.get('progress') is not None else ''
+            eta = f"{progress['eta_s'] / 3600:.1f}" if progress.get('eta_s') is not None else ''
+            print(f"{os.path.basename(field_dir)[:39]:<40}{field.get('system_name', '')[:11]:<12}{field['state']:<10}"
+                  f"{(progress.get('stage') or '')[:15]:<16}{percent:>9}{eta:>9}")
+        counts = defaultdict(int)
+        for field_dir in self.field_dirs:
+            counts[status[field_dir]['state']] += 1
+        print(', '.join(f"{state}: {count}" for state, count in sorted(counts.items())))
+
+    def switch_camera(self, camera, field, field_dir):
+        # Fields using the build cache get their own install tree; build it here, so concurrent fields do not all build it at once
+        if field.get('cached_build'):
+            config = configparser.ConfigParser()
+            config.read(os.path.join(field_dir, 'config.ini'))
+            try:
+                DolphotBuildCache.from_config(config).ensure(field['system_name'])
+                return True
+            except (ValueError, RuntimeError, OSError) as e:
+                print(f"Cannot build DOLPHOT for {field['system_name']}: {e}")
+                return False
+
+        # Otherwise only one in-place DOLPHOT build exists, so rebuild it for the next camera once all in-place fields have finished
+        if self.active_camera == camera:
+            return True
+        if self.active_camera is None and len({field['camera'] for field in self.pending_fields if not field.get('cached_build')}) <= 1:
+            # Single-camera batch: trust the existing build, just like --dolphot does
+            self.active_camera = camera
+            return True
+        make_path = field.get('make_path')
+        if not make_path or not os.path.exists(make_path):
+            print(f"Cannot rebuild DOLPHOT for {camera}: 'make_path' is not defined or invalid in the field's config.ini.")
+            return False
+        print(f"\nSwitching the DOLPHOT build to {camera}...")
+        TerminalCommandExecutor.edit_makefile(make_path, camera)
+        if not TerminalCommandExecutor.build_dolphot(make_path, clean=True):
+            return False
+        self.active_camera = camera
+        return True
+
+    def start_field(self, field_dir, field):
+        log_path = os.path.join(field_dir, f"batch_{field['obj_name']}.log")
+        log_file = open(log_path, 'a')
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--dolphot', '--yes'], cwd=field_dir,
+                                   stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT)
+        self.running[field_dir] = (process, log_file)
+        field.update(state='running', started=time.strftime('%Y-%m-%dT%H:%M:%S'), log=log_path, pid=process.pid)
+        print(f"Started {field_dir} ({field['system_name']}), log: {log_path}")
+
+    def finish_field(self, field_dir, field, returncode):
+        process, log_file = self.running.pop(field_dir)
+        log_file.close()
+        # Karlach itself exits cleanly when dolphot fails, so also require the dolphot monitor to report a finished run
+        finished = self.field_progress(field_dir, field).get('state') == 'finished'
+        field.update(state='done' if returncode == 0 and finished else 'failed', returncode=returncode,
+                     finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def run(self, table_every=60):
+        status = self.load_status()
+        self.save_status(status)
+        polls = 0
+        try:
+            while True:
+                # Collect finished fields
+                for field_dir, (process, _) in list(self.running.items()):
+                    if process.poll() is not None:
+                        self.finish_field(field_dir, status[field_dir], process.returncode)
+                        self.save_status(status)
+                        self.print_table(status)
+
+                self.pending_fields = [status[field_dir] for field_dir in self.field_dirs if status[field_dir]['state'] == 'pending']
+                if not self.pending_fields and not self.running:
+                    break
+
+                used_cpus = sum(status[field_dir]['cpus'] for field_dir in self.running)
+                used_mem = sum(status[field_dir]['mem_gb'] for field_dir in self.running)
+                # Prefer fields for the camera that is currently built in place, switch only when no in-place field is running.
+                # Fields with a cached build have their own tree and can always run
+                candidates = [field_dir for field_dir in self.field_dirs if status[field_dir]['state'] == 'pending']
+                candidates.sort(key=lambda field_dir: not status[field_dir].get('cached_build') and status[field_dir]['camera'] != self.active_camera)
+                for field_dir in candidates:
+                    field = status[field_dir]
+                    running_in_place = [running_dir for running_dir in self.running if not status[running_dir].get('cached_build')]
+                    if not field.get('cached_build') and field['camera'] != self.active_camera and running_in_place:
+                        continue
+                    # A field larger than the whole budget may still run, alone
+                    fits_budget = used_cpus + field['cpus'] <= self.max_cpus and used_mem + field['mem_gb'] <= self.max_mem_gb
+                    if not fits_budget and self.running:
+                        continue
+                    if not self.switch_camera(field['camera'], field, field_dir):
+                        field.update(state='failed', error=f"could not build DOLPHOT for {field['camera']}")
+                        continue
+                    self.start_field(field_dir, field)
+                    used_cpus += field['cpus']
+                    used_mem += field['mem_gb']
+                    self.save_status(status)
+                    polls = 0
+
+                # Print the status table when fields start, and every table_every polls while waiting
+                if polls % table_every == 0:
+                    self.print_table(status)
+                polls += 1
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("\nBatch interrupted, stopping running fields...")
+            for field_dir, (process, log_file) in list(self.running.items()):
+                process.terminate()
+                process.wait()
+                log_file.close()
+                status[field_dir].update(state='failed', error='interrupted')
+            self.running.clear()
+
+        self.save_status(status)
+        self.print_table(status)
+        print(f"Batch status saved to {self.status_file}. Rerun with --batch_resume to retry failed fields.")
+        return status
+
+# Watch mode: polls field directories for a finished DOLPHOT catalog (the .phot file --phot would use, with its .columns file) and runs
+# the configured analysis on it in the field directory, so the plots and data files are ready soon after dolphot ends. A catalog counts
+# as finished once its dolphot status file no longer reports a running job and its size and modification time have not changed for
+# settle_seconds. At most max_workers analyses run at once. Catalogs already analyzed (same size and modification time) are recorded in
+# a status file and skipped, also after a restart; a rewritten catalog is analyzed again. The analysis is watch_args under
+# [DOLPHOT_CONFIG] of each field (default: --phot --save_data --pdf --sn_coords simbad). Called with --watch
+class PhotWatcher:
+    DEFAULT_ARGS = '--phot --save_data --pdf --sn_coords simbad'
+
+    def __init__(self, field_dirs, max_workers=2, settle_seconds=60, poll_interval=15, status_file='watch_status.json'):
+        self.field_dirs = [os.path.abspath(field_dir) for field_dir in field_dirs]
+        self.max_workers = max_workers
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.status_file = os.path.abspath(status_file)
+        self.observed = {}
+        self.queue = []
+        self.running = {}
+
+    @staticmethod
+    def field_catalog(field_dir):
+        # (obj_name, system_name, .phot path, analysis arguments) of a field, or None without a usable config.ini
+        config = configparser.ConfigParser()
+        config.read(os.path.join(field_dir, 'config.ini'))
+        if 'DOLPHOT_CONFIG' not in config:
+            return None
+        settings = config['DOLPHOT_CONFIG']
+        obj_name, system_name = settings.get('obj_name'), settings.get('system_name')
+        phot_file = settings.get('phot_file') or f"{obj_name}_{system_name}.phot"
+        return obj_name, system_name, os.path.join(field_dir, phot_file), settings.get('watch_args', PhotWatcher.DEFAULT_ARGS)
+
+    def load_status(self):
+        if os.path.exists(self.status_file):
+            with open(self.status_file, 'r') as f:
+                status = json.load(f)
+            # Analyses cut short by a previous stop are redone
+            return {phot: entry for phot, entry in status.items() if entry.get('state') in ('done', 'failed')}
+        return {}
+
+    def save_status(self, status):
+        tmp_file = self.status_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_file, self.status_file)
+
+    def settled(self, field_dir, obj_name, system_name, phot_file, now):
+        # True once the catalog is complete and unchanged for settle_seconds. Returns (settled, size, mtime)
+        if not (os.path.isfile(phot_file) and os.path.isfile(phot_file + '.columns')):
+            self.observed.pop(phot_file, None)
+            return False, None, None
+        try:
+            if DolphotProgressMonitor.read_status(os.path.join(field_dir, f"dolphot_{obj_name}_{system_name}.status.json")).get('state') == 'running':
+                return False, None, None
+        except (IOError, ValueError):
+            pass
+        stat = os.stat(phot_file)
+        signature = (stat.st_size, stat.st_mtime)
+        previous = self.observed.get(phot_file)
+        if previous is None or previous[0] != signature:
+            self.observed[phot_file] = (signature, now)
+            return False, *signature
+        return now - previous[1] >= self.settle_seconds, *signature
+
+    def scan(self, status, now):
+        for field_dir in self.field_dirs:
+            catalog = self.field_catalog(field_dir)
+            if catalog is None:
+                continue
+            obj_name, system_name, phot_file, watch_args = catalog
+            if phot_file in self.running or any(queued[1] == phot_file for queued in self.queue):
+                continue
+            settled, size, mtime = self.settled(field_dir, obj_name, system_name, phot_file, now)
+            if not settled:
+                continue
+            previous = status.get(phot_file, {})
+            if previous.get('size') == size and previous.get('mtime') == mtime:
+                continue
+            print(f"{phot_file} is complete, queued for analysis: {watch_args}")
+            status[phot_file] = {'field_dir': field_dir, 'size': size, 'mtime': mtime, 'state': 'queued', 'args': watch_args}
+            self.queue.append((field_dir, phot_file, obj_name, watch_args))
+
+    def start(self, status):
+        while self.queue and len(self.running) < self.max_workers:
+            field_dir, phot_file, obj_name, watch_args = self.queue.pop(0)
+            log_path = os.path.join(field_dir, f"watch_{obj_name}.log")
+            log_file = open(log_path, 'a')
+            # stdin is not a terminal, so nothing waits for input (e.g. coordinates when SIMBAD fails)
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), *shlex.split(watch_args)], cwd=field_dir,
+                                       stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT)
+            self.running[phot_file] = (process, log_file)
+            status[phot_file].update(state='running', started=time.strftime('%Y-%m-%dT%H:%M:%S'), log=log_path)
+            print(f"Analyzing {phot_file}, log: {log_path}")
+
+    def collect(self, status):
+        for phot_file, (process, log_file) in list(self.running.items()):
+            if process.poll() is None:
+                continue
+            log_file.close()
+            del self.running[phot_file]
+            status[phot_file].update(state='done' if process.returncode == 0 else 'failed', returncode=process.returncode,
+                                     finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+            print(f"Finished {phot_file} ({status[phot_file]['state']})")
+
+    def run(self):
+        status = self.load_status()
+        print(f"Watching {len(self.field_dirs)} field(s) for finished catalogs (Ctrl+C to stop)")
+        try:
+            while True:
+                self.collect(status)
+                self.scan(status, time.time())
+                self.start(status)
+                self.save_status(status)
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("\nWatch stopped, stopping running analyses...")
+            for phot_file, (process, log_file) in list(self.running.items()):
+                process.terminate()
+                process.wait()
+                log_file.close()
+                status.pop(phot_file, None)
+            self.running.clear()
+            self.save_status(status)
+
+# Keeps the catalogs, WCS transformations and SN separations of one or more fields in memory, and answers requests on a local Unix socket,
+# so new thresholds, cuts, saves and plots do not pay for the imports, the .phot parsing and the WCS transformation every time.
+# Protocol: one JSON object per line in, one JSON object per line out. Every request has a "cmd":
+#   load    {"field": dir, "sn_ra": deg, "sn_dec": deg, "compact": bool}   (without sn_ra/sn_dec, SIMBAD is queried for obj_name, see load_catalog)
+#   counts  {"field": dir, "thresholds": [pc, ...], "cuts": {"sn_min": 4.0, "sharp_max": 0.15, "crowd_max": 1.3}}
+#   save    same as counts, writes the --save_data outputs to the field's data directory
+#   plot    same as counts, saves and writes the --phot --pdf plots
+#   unload  {"field": dir}, status {}, shutdown {}
+# counts/save/plot load the field first if needed. Fields unused for idle_minutes, and the least recently used fields
+# beyond max_memory_mb, are evicted
+class KarlachDaemon:
+    def __init__(self, socket_path=None, idle_minutes=30, max_memory_mb=4096):
+        self.socket_path = os.path.expanduser(socket_path or '~/.karlach/karlach.sock')
+        self.idle_seconds = idle_minutes * 60
+        self.max_memory_bytes = max_memory_mb * 1024**2
+        self.fields = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    @classmethod
+    def from_config(cls, config):
+        # [DOLPHOT_CONFIG] daemon_socket, daemon_idle_minutes, daemon_max_memory_mb
+        settings = config['DOLPHOT_CONFIG'] if 'DOLPHOT_CONFIG' in config else {}
+        return cls(settings.get('daemon_socket'), float(settings.get('daemon_idle_minutes', 30)), float(settings.get('daemon_max_memory_mb', 4096)))
+
+    @staticmethod
+    def request(socket_path, payload, timeout=None):
+        # Client side: send one request and return the decoded reply
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(os.path.expanduser(socket_path))
+            client.sendall((json.dumps(payload) + '\n').encode())
+            with client.makefile('r') as reply:
+                return json.loads(reply.readline())
+
+    @staticmethod
+    def field_nbytes(state):
+        # Memory held by the arrays of a loaded field, counting the buffer behind views (e.g. the catalog columns) once
+        buffers = {}
+        for array in state['prepared'][:12] + (state['sep_pc'], state['ra'], state['dec']):
+            while isinstance(array, np.ndarray) and isinstance(array.base, np.ndarray):
+                array = array.base
+            if isinstance(array, np.ndarray):
+                buffers[id(array)] = array.nbytes
+        return sum(buffers.values())
+
+    def load_field(self, field_dir, sn_coords=None, compact=False):
+        catalog = load_catalog(field_dir, sn_coords or 'simbad', compact=compact)
+        plotter, prepared = catalog.plotter, catalog.prepared
+        # The WCS transformation and the separations are the expensive part, and do not depend on the cuts or thresholds
+        sep_pc, ra_all, dec_all = plotter.compute_separation(prepared)
+
+        state = {'plotter': plotter, 'prepared': prepared, 'sep_pc': sep_pc, 'ra': ra_all, 'dec': dec_all, 'last_used': time.time()}
+        state['nbytes'] = self.field_nbytes(state)
+        self.fields[field_dir] = state
+        self.enforce_memory_cap(keep=field_dir)
+        return state
+
+    def enforce_memory_cap(self, keep=None):
+        # Evict least recently used fields until the loaded fields fit in max_memory_mb (the field just used is always kept)
+        while sum(state['nbytes'] for state in self.fields.values()) > self.max_memory_bytes:
+            candidates = [field for field in self.fields if field != keep]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda field: self.fields[field]['last_used'])
+            print(f"Evicting {oldest} (memory cap of {self.max_memory_bytes / 1024**2:.0f} MB)")
+            del self.fields[oldest]
+
+    def evict_idle(self):
+        now = time.time()
+        with self.lock:
+            for field in [field for field, state in self.fields.items() if now - state['last_used'] > self.idle_seconds]:
+                print(f"Evicting {field} (idle for more than {self.idle_seconds / 60:g} minutes)")
+                del self.fields[field]
+
+    def get_field(self, request):
+        field_dir = os.path.abspath(os.path.expanduser(request['field']))
+        state = self.fields.get(field_dir)
+        if state is None or request.get('cmd') == 'load':
+            sn_coords = (request['sn_ra'], request['sn_dec']) if 'sn_ra' in request and 'sn_dec' in request else None
+            state = self.load_field(field_dir, sn_coords, request.get('compact', False))
+        state['last_used'] = time.time()
+        return state
+
+    def select(self, state, request):
+        # Quality mask for the requested cuts, reusing the cached separations, and the per-threshold results of process_data
+        plotter, prepared = state['plotter'], state['prepared']
+        quality_mask = PlotManager.quality_mask(prepared, **request.get('cuts', {}))
+        thresholds = [float(threshold) for threshold in request.get('thresholds', plotter.proximity_thresholds)]
+        results = plotter.process_data(prepared, quality=(quality_mask, state['sep_pc'], state['ra'], state['dec']), thresholds=thresholds)
+        return quality_mask, thresholds, results
+
+    def handle(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'status':
+            now = time.time()
+            return {'fields': {field: {'obj_name': state['plotter'].obj_name, 'stars': int(len(state['sep_pc'])), 'memory_mb': round(state['nbytes'] / 1024**2, 2),
+                                       'idle_seconds': round(now - state['last_used'], 1)} for field, state in self.fields.items()},
+                    'memory_mb': round(sum(state['nbytes'] for state in self.fields.values()) / 1024**2, 2)}
+        if cmd == 'unload':
+            return {'unloaded': self.fields.pop(os.path.abspath(os.path.expanduser(request['field'])), None) is not None}
+        if cmd == 'shutdown':
+            # shutdown() waits for serve_forever to return, so it cannot be called from the handler thread itself
+            threading.Thread(target=self.server.shutdown).start()
+            return {'shutdown': True}
+        if cmd not in ('load', 'counts', 'save', 'plot'):
+            raise ValueError(f"Unknown command '{cmd}'")
+
+        state = self.get_field(request)
+        if cmd == 'load':
+            return {'stars': int(len(state['sep_pc'])), 'memory_mb': round(state['nbytes'] / 1024**2, 2)}
+
+        plotter = state['plotter']
+        quality_mask, thresholds, results = self.select(state, request)
+        reply = {'stars': int(len(quality_mask)), 'quality': int(np.count_nonzero(quality_mask)),
+                 'counts': {f"{threshold:g}": int(len(result[0])) for threshold, result in zip(thresholds, results)}}
+        if cmd in ('save', 'plot'):
+            for threshold, result in zip(thresholds, results):
+                plotter.save_processed_data(result, plotter.obj_name, threshold, plotter.blue_label, plotter.red_label)
+            reply['data_dir'] = plotter.data_dir
+        if cmd == 'plot':
+            # Same global magnitude range for every threshold as --phot, plotted from the files just saved
+            saved = [(threshold, plotter.read_saved_data(os.path.join(plotter.data_dir, f"{plotter.obj_name}_{threshold}pc_{plotter.blue_label}_{plotter.red_label}_full.npy")))
+                     for threshold in thresholds]
+            saved = [(threshold, data) for threshold, data in saved if data is not None and len(data)]
+            if saved:
+                avg_mags = np.concatenate([(data[:, 2] + data[:, 4]) / 2 for _, data in saved])
+                plotter.plot_all_from_files(saved, np.min(avg_mags), np.max(avg_mags), request.get('titles', True))
+                plt.close('all')
+            reply['plots'] = [os.path.join(plotter.data_dir, f"{plotter.obj_name}_{threshold}pc_plots_from_saved{'' if request.get('titles', True) else '_notitles'}.pdf")
+                              for threshold, _ in saved]
+        return reply
+
+    def serve(self):
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    start_time = time.time()
+                    try:
+                        with daemon.lock:
+                            reply = daemon.handle(json.loads(line))
+                        reply['ok'] = True
+                    except Exception as e:
+                        reply = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+                    reply['elapsed'] = round(time.time() - start_time, 4)
+                    self.wfile.write((json.dumps(reply) + '\n').encode())
+                    self.wfile.flush()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+            # Called by serve_forever between requests
+            def service_actions(self):
+                daemon.evict_idle()
+
+        # Plots are only written to PDF
+        plt.switch_backend('Agg')
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            try:
+                self.request(self.socket_path, {'cmd': 'status'}, timeout=2)
+                print(f"A Karlach daemon is already listening on {self.socket_path}")
+                return
+            except OSError:
+                # Left over from a daemon that did not shut down cleanly
+                os.remove(self.socket_path)
+
+        self.server = Server(self.socket_path, RequestHandler)
+        print(f"Karlach daemon listening on {self.socket_path} (idle eviction after {self.idle_seconds / 60:g} min, memory cap {self.max_memory_bytes / 1024**2:.0f} MB)")
+        try:
+            self.server.serve_forever(poll_interval=5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            print("Karlach daemon stopped")
+
+# Joins the .phot catalogs of several epochs of the same field into per-star light curves, e.g. for progenitor disappearance checks.
+# Every epoch is converted to RA/Dec with its own reference WCS and projected onto a common tangent plane, centered on the first epoch.
+# Its detections are then matched to the known stars with a KD-tree within tolerance_arcsec. Detections without a match become new stars,
+# so objects that only appear in later epochs are kept. Each (star, epoch) pair gets flags:
+#   AMBIGUOUS: another known star lies within the tolerance
+#   DUPLICATE: a closer detection of the same epoch claimed the star, so this one was kept as a separate star
+class EpochCrossMatcher:
+    AMBIGUOUS = 1
+    DUPLICATE = 2
+    # Per-epoch light-curve columns, stored as (n_stars, n_epochs) float32 arrays with NaN where a star was not detected
+    LIGHTCURVE_COLUMNS = ['blue', 'blue_unc', 'red', 'red_unc', 'blue_sn', 'red_sn', 'crowd']
+
+    def __init__(self, epochs, system_name='default', tolerance_arcsec=0.1, quality_cut=False, workers=None):
+        # epochs: list of (label, phot_file, ref_file, mjd or None), the first one sets the tangent point and the initial star list
+        self.epochs = epochs
+        self.system_name = system_name
+        self.tolerance = tolerance_arcsec
+        self.quality_cut = quality_cut
+        self.workers = workers or min(len(epochs), os.cpu_count() or 1)
+
+    @classmethod
+    def from_config(cls, config):
+        # [CROSSMATCH] tolerance_arcsec, quality_cut, output. [CROSSMATCH_EPOCHS] label = phot_file, ref_file[, mjd], in time order
+        if 'CROSSMATCH_EPOCHS' not in config or len(config['CROSSMATCH_EPOCHS']) < 2:
+            raise ValueError("Define at least two epochs under [CROSSMATCH_EPOCHS] in config.ini, as label = phot_file, ref_file[, mjd]")
+        settings = config['CROSSMATCH'] if 'CROSSMATCH' in config else {}
+        epochs = []
+        for label, value in config['CROSSMATCH_EPOCHS'].items():
+            parts = [part.strip() for part in value.split(',')]
+            epochs.append((label, parts[0], parts[1], float(parts[2]) if len(parts) > 2 else None))
+        return cls(epochs, config['DOLPHOT_CONFIG'].get('system_name', 'default'), float(settings.get('tolerance_arcsec', 0.1)),
+                   str(settings.get('quality_cut', 'no')).lower() in ('yes', 'true', '1'))
+
+    @staticmethod
+    def tangent_plane(ra, dec, ra0, dec0):
+        # Gnomonic projection about (ra0, dec0), in arcsec
+        ra, dec, ra0, dec0 = np.radians(ra), np.radians(dec), np.radians(ra0), np.radians(dec0)
+        cos_c = np.sin(dec0) * np.sin(dec) + np.cos(dec0) * np.cos(dec) * np.cos(ra - ra0)
+        xi = np.cos(dec) * np.sin(ra - ra0) / cos_c
+        eta = (np.cos(dec0) * np.sin(dec) - np.sin(dec0) * np.cos(dec) * np.cos(ra - ra0)) / cos_c
+        return np.degrees(xi) * 3600, np.degrees(eta) * 3600
+
+    @staticmethod
+    def epoch_mjd(ref_file):
+        with fits.open(ref_file) as hdul:
+            header = hdul[0].header
+            return header.get('EXPSTART', header.get('MJD-OBS'))
+
+    @staticmethod
+    def load_epoch(task):
+        # Runs in a worker process: parse one .phot file into the compact catalog dtype and convert it to RA/Dec
+        phot_file, ref_file, system_name, quality_cut = task
+        columns = PlotManager.CATALOG_COLUMNS + PlotManager.COMPACT_EXTRA_COLUMNS
+        catalog = np.atleast_1d(np.loadtxt(phot_file, usecols=[column for _, column, _ in columns], dtype=[(name, dtype) for name, _, dtype in columns]))
+        if quality_cut:
+            catalog = catalog[PlotManager.quality_mask((None,) + tuple(catalog[name] for name, _, _ in PlotManager.CATALOG_COLUMNS))]
+        ra, dec = PlotManager.read_reference_wcs(ref_file, system_name).all_pix2world(catalog['x'], catalog['y'], 1)
+        return catalog, np.asarray(ra, dtype=np.float64), np.asarray(dec, dtype=np.float64)
+
+    def match(self, star_xi, star_eta, xi, eta):
+        # Index of the matched star for every detection (-1: no match), and the flags of every detection
+        tree = cKDTree(np.column_stack((star_xi, star_eta)))
+        dist, idx = tree.query(np.column_stack((xi, eta)), k=2, distance_upper_bound=self.tolerance, workers=-1)
+        matched = np.isfinite(dist[:, 0])
+        flags = np.where(np.isfinite(dist[:, 1]), self.AMBIGUOUS, 0).astype(np.uint8)
+
+        # Several detections can claim the same star: the closest one keeps it
+        candidates = np.flatnonzero(matched)
+        order = candidates[np.lexsort((dist[candidates, 0], idx[candidates, 0]))]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = idx[order[1:], 0] != idx[order[:-1], 0]
+        star_index = np.full(len(xi), -1, dtype=np.int64)
+        star_index[order[first]] = idx[order[first], 0]
+        flags[order[~first]] |= self.DUPLICATE
+        return star_index, flags
+
+    def run(self, output_dir):
+        start_time = time.time()
+        tasks = [(phot_file, ref_file, self.system_name, self.quality_cut) for _, phot_file, ref_file, _ in self.epochs]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+            loaded = list(pool.map(self.load_epoch, tasks))
+        print(f"Loaded {sum(len(catalog) for catalog, _, _ in loaded)} detections from {len(loaded)} epochs in {time.time() - start_time:.1f}s")
+
+        ra0, dec0 = np.median(loaded[0][1]), np.median(loaded[0][2])
+        star_xi, star_eta = self.tangent_plane(loaded[0][1], loaded[0][2], ra0, dec0)
+        star_ra, star_dec = loaded[0][1], loaded[0][2]
+        assignments = [(np.arange(len(star_xi)), np.zeros(len(star_xi), dtype=np.uint8))]
+
+        for (label, _, _, _), (catalog, ra, dec) in zip(self.epochs[1:], loaded[1:]):
+            xi, eta = self.tangent_plane(ra, dec, ra0, dec0)
+            star_index, flags = self.match(star_xi, star_eta, xi, eta)
+            new = star_index < 0
+            star_index[new] = len(star_xi) + np.arange(np.count_nonzero(new))
+            star_xi, star_eta = np.concatenate((star_xi, xi[new])), np.concatenate((star_eta, eta[new]))
+            star_ra, star_dec = np.concatenate((star_ra, ra[new])), np.concatenate((star_dec, dec[new]))
+            assignments.append((star_index, flags))
+            print(f"Epoch {label}: {np.count_nonzero(~new)} matched, {np.count_nonzero(new)} new, "
+                  f"{np.count_nonzero(flags & self.AMBIGUOUS)} ambiguous, {np.count_nonzero(flags & self.DUPLICATE)} duplicate")
+
+        # Columnar output: one .npy per column, written straight to disk and readable with mmap_mode='r'
+        os.makedirs(output_dir, exist_ok=True)
+        n_stars, n_epochs = len(star_xi), len(self.epochs)
+        np.save(os.path.join(output_dir, 'ra.npy'), star_ra)
+        np.save(os.path.join(output_dir, 'dec.npy'), star_dec)
+        detections = np.zeros(n_stars, dtype=np.int16)
+        flags_out = np.lib.format.open_memmap(os.path.join(output_dir, 'flags.npy'), mode='w+', dtype=np.uint8, shape=(n_stars, n_epochs))
+        for epoch, (star_index, flags) in enumerate(assignments):
+            flags_out[star_index, epoch] = flags
+            detections[star_index] += 1
+        flags_out.flush()
+        np.save(os.path.join(output_dir, 'n_detections.npy'), detections)
+        for name in self.LIGHTCURVE_COLUMNS:
+            column = np.lib.format.open_memmap(os.path.join(output_dir, f'{name}.npy'), mode='w+', dtype=np.float32, shape=(n_stars, n_epochs))
+            column[:] = np.nan
+            for epoch, ((catalog, _, _), (star_index, _)) in enumerate(zip(loaded, assignments)):
+                column[star_index, epoch] = catalog[name]
+            column.flush()
+            del column
+
+        metadata = {'epochs': [{'label': label, 'phot_file': phot_file, 'ref_file': ref_file,
+                                'mjd': mjd if mjd is not None else self.epoch_mjd(ref_file), 'detections': int(len(catalog))}
+                               for (label, phot_file, ref_file, mjd), (catalog, _, _) in zip(self.epochs, loaded)],
+                    'tangent_point': [float(ra0), float(dec0)], 'tolerance_arcsec': self.tolerance, 'quality_cut': self.quality_cut,
+                    'n_stars': int(n_stars), 'columns': self.LIGHTCURVE_COLUMNS, 'flags': {'AMBIGUOUS': self.AMBIGUOUS, 'DUPLICATE': self.DUPLICATE}}
+        with open(os.path.join(output_dir, 'epochs.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        print(f"Light curves of {n_stars} stars over {n_epochs} epochs saved to {output_dir} ({time.time() - start_time:.1f}s)")
+        return metadata
+
+    @staticmethod
+    def load_lightcurves(output_dir):
+        # Memory mapped light-curve columns and the epoch metadata of a cross-match
+        with open(os.path.join(output_dir, 'epochs.json')) as f:
+            metadata = json.load(f)
+        columns = {name: np.load(os.path.join(output_dir, f'{name}.npy'), mmap_mode='r')
+                   for name in ['ra', 'dec', 'n_detections', 'flags'] + metadata['columns']}
+        return columns, metadata
+
+# Merges the .phot catalogs of overlapping pointings into one deduplicated catalog that --phot/--save_data/--hess can use directly.
+# All fields are projected onto a common tangent plane with their own reference WCS. Two stars of different fields that are each other's
+# nearest neighbor within tolerance_arcsec are the same star, and only the best measurement is kept: highest S/N (the lower of the two
+# filters), then lowest crowding.
+# Duplicates are searched in strips of strip_arcsec along the tangent plane (padded by the tolerance), so each KD-tree only holds one
+# strip of the mosaic. Positions, S/N and crowding of all fields are held in memory, while the full rows are streamed from the original
+# .phot files, with X/Y moved onto the reference image of the first field, which is the ref_file to use with the merged catalog
+class MosaicMerger:
+    def __init__(self, fields, output_phot, system_name='default', tolerance_arcsec=0.1, strip_arcsec=60.0):
+        # fields: list of (label, phot_file, ref_file)
+        self.fields = fields
+        self.output_phot = output_phot
+        self.system_name = system_name
+        self.tolerance = tolerance_arcsec
+        self.strip = strip_arcsec
+
+    @classmethod
+    def from_config(cls, config):
+        # [MOSAIC] tolerance_arcsec, strip_arcsec, output. [MOSAIC_FIELDS] label = phot_file, ref_file
+        if 'MOSAIC_FIELDS' not in config or len(config['MOSAIC_FIELDS']) < 2:
+            raise ValueError("Define at least two fields under [MOSAIC_FIELDS] in config.ini, as label = phot_file, ref_file")
+        settings = config['MOSAIC'] if 'MOSAIC' in config else {}
+        fields = [(label, *[part.strip() for part in value.split(',')][:2]) for label, value in config['MOSAIC_FIELDS'].items()]
+        obj_name = config['DOLPHOT_CONFIG'].get('obj_name', 'field')
+        system_name = config['DOLPHOT_CONFIG'].get('system_name', 'default')
+        return cls(fields, settings.get('output') or f"{obj_name}_{system_name}_mosaic.phot", system_name,
+                   float(settings.get('tolerance_arcsec', 0.1)), float(settings.get('strip_arcsec', 60.0)))
+
+    def check_columns(self):
+        # The rows are copied as they are, so every field needs the same filters in the same order
+        column_files = []
+        for _, phot_file, _ in self.fields:
+            with open(phot_file + '.columns') as f:
+                column_files.append([line.split('. ', 1)[-1] for line in f])
+        for (label, _, _), columns in zip(self.fields[1:], column_files[1:]):
+            if columns != column_files[0]:
+                raise ValueError(f"The columns of field {label} differ from those of {self.fields[0][0]}. Merge fields with the same filters only")
+
+    def load_field(self, phot_file, ref_file):
+        # X, Y, crowding and the two S/N columns, see PlotManager.CATALOG_COLUMNS
+        x, y, crowd, blue_sn, red_sn = np.loadtxt(phot_file, usecols=(2, 3, 9, 19, 32), ndmin=2).T
+        ra, dec = PlotManager.read_reference_wcs(ref_file, self.system_name).all_pix2world(x, y, 1)
+        return np.asarray(ra), np.asarray(dec), np.minimum(blue_sn, red_sn), crowd
+
+    @staticmethod
+    def data_lines(f):
+        # The lines np.loadtxt reads as rows: blank lines and '#' comments are skipped
+        for line in f:
+            if line.split('#', 1)[0].strip():
+                yield line
+
+    def find_duplicates(self, xi, eta, field_id, rank):
+        # True for every star that has a better measurement of the same star in another field. Matches are one-to-one: for every pair of
+        # fields, two stars are the same star only if each is the other's nearest neighbor within the tolerance, so close but distinct
+        # stars in crowded overlaps are kept
+        drop = np.zeros(len(xi), dtype=bool)
+        order = np.argsort(eta)
+        eta_sorted = eta[order]
+        for low in np.arange(eta_sorted[0], eta_sorted[-1] + self.strip, self.strip):
+            # Padded by twice the tolerance, so the neighbors of the partners of the strip's stars are in it too
+            members = order[np.searchsorted(eta_sorted, low - 2 * self.tolerance):np.searchsorted(eta_sorted, low + self.strip + 2 * self.tolerance)]
+            for field_a, field_b in itertools.combinations(np.unique(field_id[members]), 2):
+                stars_a, stars_b = members[field_id[members] == field_a], members[field_id[members] == field_b]
+                points_a, points_b = np.column_stack((xi[stars_a], eta[stars_a])), np.column_stack((xi[stars_b], eta[stars_b]))
+                dist, nearest_b = cKDTree(points_b).query(points_a, k=1, distance_upper_bound=self.tolerance)
+                _, nearest_a = cKDTree(points_a).query(points_b, k=1, distance_upper_bound=self.tolerance)
+                matched = np.flatnonzero(np.isfinite(dist))
+                mutual = matched[nearest_a[nearest_b[matched]] == matched]
+                first, second = stars_a[mutual], stars_b[nearest_b[mutual]]
+                # Every pair is decided once, in the strip of its star from field_a
+                own = (eta[first] >= low) & (eta[first] < low + self.strip)
+                first, second = first[own], second[own]
+                drop[np.where(rank[first] > rank[second], first, second)] = True
+        return drop
+
+    def run(self):
+        start_time = time.time()
+        self.check_columns()
+        loaded = [self.load_field(phot_file, ref_file) for _, phot_file, ref_file in self.fields]
+        ra = np.concatenate([field[0] for field in loaded])
+        dec = np.concatenate([field[1] for field in loaded])
+        sn = np.concatenate([field[2] for field in loaded])
+        crowd = np.concatenate([field[3] for field in loaded])
+        field_id = np.concatenate([np.full(len(field[0]), index, dtype=np.int32) for index, field in enumerate(loaded)])
+        row = np.concatenate([np.arange(len(field[0])) for field in loaded])
+
+        # Common tangent point at the middle of the mosaic. rank 0 is the best measurement: highest S/N, then lowest crowding
+        xi, eta = EpochCrossMatcher.tangent_plane(ra, dec, np.median(ra), np.median(dec))
+        rank = np.empty(len(sn), dtype=np.int64)
+        rank[np.lexsort((crowd, -np.nan_to_num(sn, nan=-np.inf)))] = np.arange(len(sn))
+        drop = self.find_duplicates(xi, eta, field_id, rank)
+
+        # Copy the kept rows, with X/Y on the reference image of the first field
+        ref_wcs = PlotManager.read_reference_wcs(self.fields[0][2], self.system_name)
+        new_x, new_y = ref_wcs.all_world2pix(ra, dec, 1, quiet=True)
+        with open(self.output_phot, 'w') as out:
+            for index, (label, phot_file, _) in enumerate(self.fields):
+                in_field = np.flatnonzero(field_id == index)
+                keep = ~drop[in_field]
+                field_x, field_y = new_x[in_field], new_y[in_field]
+                rows = 0
+                with open(phot_file) as f:
+                    for rows, line in enumerate(self.data_lines(f), start=1):
+                        if rows > len(in_field):
+                            break
+                        if keep[rows - 1]:
+                            values = line.split('#', 1)[0].split()
+                            values[2], values[3] = f"{field_x[rows - 1]:.2f}", f"{field_y[rows - 1]:.2f}"
+                            out.write(' '.join(values) + '\n')
+                if rows != len(in_field):
+                    raise ValueError(f"{phot_file} changed while merging: {len(in_field)} rows were loaded, but it now has a different number of rows")
+                print(f"Field {label}: kept {np.count_nonzero(keep)} of {len(in_field)} stars")
+        shutil.copyfile(self.fields[0][1] + '.columns', self.output_phot + '.columns')
+        # Origin of every merged row, (field index, row in that field's .phot file)
+        np.save(self.output_phot + '.origin.npy', np.column_stack((field_id[~drop], row[~drop])))
+
+        print(f"Merged {len(self.fields)} fields into {self.output_phot}: {np.count_nonzero(~drop)} stars, {np.count_nonzero(drop)} duplicates removed ({time.time() - start_time:.1f}s)")
+        print(f"To analyze it, set phot_file = {self.output_phot} and ref_file = {self.fields[0][2]} under [DOLPHOT_CONFIG]")
+        return self.output_phot
+
+# Pre/post-explosion difference imaging, e.g. a pre-explosion drz against a late-time drc for a progenitor search.
+# The difference is computed on the pixel grid of the post image, one strip of tiles at a time, and streamed to disk, so only a strip
+# of the post image and the matching part of the (memory mapped) pre image are in memory at once. For every tile:
+#   1. Registration: the pre image is resampled onto the post pixels through both WCS (evaluated on a coarse grid and interpolated)
+#   2. PSF matching: a convolution kernel K with pre * K ~ post is solved in Fourier space (regularized least squares, multi-threaded
+#      scipy.fft), cropped to kernel_half_width, with the SN masked so its change does not enter the kernel
+#   3. Difference: post - pre * K, after removing the median sky of both tiles
+# Tiles overlap by a margin that absorbs the FFT wrap-around, and only their centers are written
+class DifferenceImager:
+    def __init__(self, pre_image, post_image, output, tile_size=1024, kernel_half_width=7, regularization=1e-3, cutout_pixels=201, grid_step=16):
+        self.pre_image = pre_image
+        self.post_image = post_image
+        self.output = output
+        self.tile_size = tile_size
+        self.kernel_half = kernel_half_width
+        self.margin = 4 * kernel_half_width
+        self.regularization = regularization
+        self.cutout_half = cutout_pixels // 2
+        self.grid_step = grid_step
+
+    @classmethod
+    def from_config(cls, config):
+        # [DIFFERENCE] pre_image, post_image, output, tile_size, kernel_half_width, regularization, cutout_pixels
+        if 'DIFFERENCE' not in config or not all(key in config['DIFFERENCE'] for key in ('pre_image', 'post_image')):
+            raise ValueError("Define pre_image and post_image under [DIFFERENCE] in config.ini")
+        settings = config['DIFFERENCE']
+        obj_name = config['DOLPHOT_CONFIG'].get('obj_name', 'field')
+        return cls(settings['pre_image'], settings['post_image'], settings.get('output', f"{obj_name}_diff.fits"),
+                   int(settings.get('tile_size', 1024)), int(settings.get('kernel_half_width', 7)),
+                   float(settings.get('regularization', 1e-3)), int(settings.get('cutout_pixels', 201)))
+
+    @staticmethod
+    def open_science(hdul):
+        hdu = hdul[RawSkyPlotter.find_science_extension(hdul)]
+        return hdu.data, WCS(hdu.header, hdul).celestial, hdu.header
+
+    def register(self, pre_data, pre_wcs, post_wcs, y0, y1, x0, x1):
+        # Pre image resampled (cubic spline) onto post pixels [y0:y1, x0:x1], and the mask of post pixels covered by the pre image
+        ny_coarse = max(2, int(np.ceil((y1 - y0) / self.grid_step)) + 1)
+        nx_coarse = max(2, int(np.ceil((x1 - x0) / self.grid_step)) + 1)
+        grid_y, grid_x = np.meshgrid(np.linspace(y0, y1 - 1, ny_coarse), np.linspace(x0, x1 - 1, nx_coarse), indexing='ij')
+        ra, dec = post_wcs.all_pix2world(grid_x, grid_y, 0)
+        coarse_x, coarse_y = pre_wcs.all_world2pix(ra, dec, 0, quiet=True)
+
+        # Bilinear interpolation of the coarse pixel mapping; the WCS varies smoothly over grid_step pixels
+        rows = np.linspace(0, ny_coarse - 1, y1 - y0)[:, None] * np.ones((1, x1 - x0))
+        cols = np.ones((y1 - y0, 1)) * np.linspace(0, nx_coarse - 1, x1 - x0)[None, :]
+        pre_x = ndimage.map_coordinates(coarse_x, [rows, cols], order=1)
+        pre_y = ndimage.map_coordinates(coarse_y, [rows, cols], order=1)
+
+        # Read only the part of the pre image that maps onto this tile
+        bx0, by0 = max(0, int(np.floor(pre_x.min())) - 3), max(0, int(np.floor(pre_y.min())) - 3)
+        bx1, by1 = min(pre_data.shape[1], int(np.ceil(pre_x.max())) + 4), min(pre_data.shape[0], int(np.ceil(pre_y.max())) + 4)
+        if bx1 - bx0 < 4 or by1 - by0 < 4:
+            return np.zeros((y1 - y0, x1 - x0)), np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        section = np.array(pre_data[by0:by1, bx0:bx1], dtype=np.float64)
+        finite = np.isfinite(section)
+        section[~finite] = 0.0
+        coords = [pre_y - by0, pre_x - bx0]
+        resampled = ndimage.map_coordinates(section, coords, order=3, mode='constant', cval=0.0)
+        coverage = ndimage.map_coordinates(finite.astype(np.float32), coords, order=1, mode='constant', cval=0.0) > 0.99
+        return resampled, coverage
+
+    def solve_kernel(self, pre, post):
+        # K = argmin |post - pre * K|^2 + lambda |K|^2 in Fourier space, cropped to (2h+1)^2 pixels around the origin
+        shape, h = pre.shape, self.kernel_half
+        pre_ft = scipy_fft.rfft2(pre, workers=-1)
+        post_ft = scipy_fft.rfft2(post, workers=-1)
+        power = np.abs(pre_ft)**2
+        full = scipy_fft.irfft2(post_ft * np.conj(pre_ft) / (power + self.regularization * np.median(power)), s=shape, workers=-1)
+        return np.roll(full, (h, h), axis=(0, 1))[:2 * h + 1, :2 * h + 1]
+
+    def convolve(self, image, kernel):
+        h = self.kernel_half
+        padded = np.zeros(image.shape)
+        padded[:2 * h + 1, :2 * h + 1] = kernel
+        padded = np.roll(padded, (-h, -h), axis=(0, 1))
+        return scipy_fft.irfft2(scipy_fft.rfft2(image, workers=-1) * scipy_fft.rfft2(padded, workers=-1), s=image.shape, workers=-1)
+
+    def difference_tile(self, pre_data, pre_wcs, post_data, post_wcs, y0, y1, x0, x1, sn_pixel=None):
+        ny, nx = post_data.shape
+        py0, py1, px0, px1 = max(0, y0 - self.margin), min(ny, y1 + self.margin), max(0, x0 - self.margin), min(nx, x1 + self.margin)
+        post = np.array(post_data[py0:py1, px0:px1], dtype=np.float64)
+        pre, coverage = self.register(pre_data, pre_wcs, post_wcs, py0, py1, px0, px1)
+        valid = coverage & np.isfinite(post)
+        difference = np.full(post.shape, np.nan)
+        if np.count_nonzero(valid) > 0.1 * valid.size:
+            pre = np.where(valid, pre - np.median(pre[valid]), 0.0)
+            post = np.where(valid, post - np.median(post[valid]), 0.0)
+            pre_fit, post_fit = pre, post
+            if sn_pixel is not None:
+                # Keep the transient out of the kernel solution
+                sx, sy = int(round(sn_pixel[0])) - px0, int(round(sn_pixel[1])) - py0
+                pre_fit, post_fit = pre.copy(), post.copy()
+                pre_fit[max(0, sy - self.margin):sy + self.margin + 1, max(0, sx - self.margin):sx + self.margin + 1] = 0.0
+                post_fit[max(0, sy - self.margin):sy + self.margin + 1, max(0, sx - self.margin):sx + self.margin + 1] = 0.0
+            kernel = self.solve_kernel(pre_fit, post_fit)
+            difference = np.where(valid, post - self.convolve(pre, kernel), np.nan)
+        return difference[y0 - py0:y1 - py0, x0 - px0:x1 - px0].astype(np.float32)
+
+    def run(self, sn_coords=None):
+        # sn_coords: (RA, DEC) in degrees of the SN, for the kernel mask and the residual map, or None
+        start_time = time.time()
+        with fits.open(self.pre_image, memmap=True) as pre_hdul, fits.open(self.post_image, memmap=True) as post_hdul:
+            pre_data, pre_wcs, _ = self.open_science(pre_hdul)
+            post_data, post_wcs, post_header = self.open_science(post_hdul)
+            ny, nx = post_data.shape
+            sn_pixel = None
+            if sn_coords is not None:
+                sn_pixel = [float(value) for value in post_wcs.all_world2pix(sn_coords[0], sn_coords[1], 0)]
+                if not (0 <= sn_pixel[0] < nx and 0 <= sn_pixel[1] < ny):
+                    print(f"Warning: the SN position falls outside {self.post_image}, no residual map will be made")
+                    sn_pixel = None
+
+            # Residual map bounds, filled while the strips stream past
+            if sn_pixel is not None:
+                cx, cy = int(round(sn_pixel[0])), int(round(sn_pixel[1]))
+                cut_x0, cut_x1 = max(0, cx - self.cutout_half), min(nx, cx + self.cutout_half + 1)
+                cut_y0, cut_y1 = max(0, cy - self.cutout_half), min(ny, cy + self.cutout_half + 1)
+                residual = np.full((cut_y1 - cut_y0, cut_x1 - cut_x0), np.nan, dtype=np.float32)
+
+            header = post_wcs.to_header(relax=True)
+            header.insert(0, ('SIMPLE', True))
+            header.insert(1, ('BITPIX', -32))
+            header.insert(2, ('NAXIS', 2))
+            header.insert(3, ('NAXIS1', nx))
+            header.insert(4, ('NAXIS2', ny))
+            header['PREIMG'] = (os.path.basename(self.pre_image), 'Pre-explosion image')
+            header['POSTIMG'] = (os.path.basename(self.post_image), 'Post-explosion image')
+            stream = fits.StreamingHDU(self.output, header)
+            for y0 in range(0, ny, self.tile_size):
+                y1 = min(ny, y0 + self.tile_size)
+                strip = np.empty((y1 - y0, nx), dtype=np.float32)
+                for x0 in range(0, nx, self.tile_size):
+                    x1 = min(nx, x0 + self.tile_size)
+                    tile_sn = sn_pixel if sn_pixel is not None and y0 - self.margin <= sn_pixel[1] < y1 + self.margin and x0 - self.margin <= sn_pixel[0] < x1 + self.margin else None
+                    strip[:, x0:x1] = self.difference_tile(pre_data, pre_wcs, post_data, post_wcs, y0, y1, x0, x1, tile_sn)
+                if sn_pixel is not None and y0 < cut_y1 and y1 > cut_y0:
+                    r0, r1 = max(y0, cut_y0), min(y1, cut_y1)
+                    residual[r0 - cut_y0:r1 - cut_y0] = strip[r0 - y0:r1 - y0, cut_x0:cut_x1]
+                stream.write(strip.astype('>f4'))
+                print(f"Difference image: rows {y1}/{ny} done ({time.time() - start_time:.1f}s)")
+            stream.close()
+            print(f"Difference image saved to {self.output}")
+
+            if sn_pixel is not None:
+                self.save_residual_map(residual, post_wcs.slice((slice(cut_y0, cut_y1), slice(cut_x0, cut_x1))),
+                                       (sn_pixel[0] - cut_x0, sn_pixel[1] - cut_y0),
+                                       np.array(post_data[cut_y0:cut_y1, cut_x0:cut_x1], dtype=np.float32),
+                                       self.register(pre_data, pre_wcs, post_wcs, cut_y0, cut_y1, cut_x0, cut_x1)[0].astype(np.float32))
+        return self.output
+
+    def save_residual_map(self, residual, wcs, sn_pixel, post, pre):
+        # FITS cutout of the difference with its offset WCS, and a pre / post / difference panel plot
+        base = os.path.splitext(self.output)[0]
+        fits.PrimaryHDU(residual, header=wcs.to_header(relax=True)).writeto(f"{base}_residual.fits", overwrite=True)
+        fig, axes = plt.subplots(1, 3, figsize=(15, 5), subplot_kw={'projection': wcs})
+        for ax, image, title in zip(axes, (pre, post, residual), ('Pre-explosion (registered)', 'Post-explosion', 'Difference')):
+            finite = image[np.isfinite(image)]
+            vmin, vmax = ZScaleInterval().get_limits(finite) if finite.size else (0, 1)
+            ax.imshow(image, origin='lower', cmap='gray', vmin=vmin, vmax=vmax)
+            ax.scatter(*sn_pixel, s=200, facecolors='none', edgecolors='red')
+            ax.set_title(title)
+            ax.set_xlabel('RA')
+            ax.set_ylabel('Dec')
+        fig.tight_layout()
+        fig.savefig(f"{base}_residual.png", dpi=150)
+        plt.close(fig)
+        print(f"Residual map around the SN saved to {base}_residual.fits and {base}_residual.png")
+
+# Interactive explorer of a full-field catalog in the browser, served locally with no external services. Star counts of the sky plane
+# (tangent-plane offsets from the SN, in arcsec) and of the CMD plane are precomputed as a pyramid of 256x256 PNG tiles, level z
+# covering each plane with 2^z x 2^z tiles, so zooming and panning always load about a screenful of tiles however many stars there are.
+# At the deepest level the individual stars of every tile are also written (as JSON) and drawn as points, with their values on hover.
+# Tiles are rebuilt only when the catalog or the settings change
+class TileExplorer:
+    TILE = 256
+
+    VIEWER = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Karlach explorer</title>
+<style>
+body { margin: 0; background: #111; color: #ddd; font: 13px sans-serif; overflow: hidden; }
+#bar { position: absolute; top: 0; left: 0; right: 0; padding: 6px 10px; background: rgba(0,0,0,0.7); z-index: 1; }
+#bar select, #bar button { margin-right: 10px; }
+#readout { float: right; }
+canvas { display: block; cursor: grab; }
+</style></head>
+<body>
+<div id="bar"><b id="title"></b> &nbsp; <select id="plane"></select><button id="reset">Reset view</button><span id="level"></span><span id="readout"></span></div>
+<canvas id="view"></canvas>
+<script>
+const canvas = document.getElementById('view'), ctx = canvas.getContext('2d');
+let meta, plane, zoom = 0, center = [0.5, 0.5], tiles = {}, points = {}, drag = null, mouse = null;
+fetch('meta.json').then(r => r.json()).then(m => {
+  meta = m;
+  document.getElementById('title').textContent = meta.obj_name + ' (' + meta.n_stars + ' stars)';
+  const select = document.getElementById('plane');
+  for (const name in meta.planes) select.add(new Option(meta.planes[name].title, name));
+  select.onchange = () => { plane = select.value; reset(); };
+  plane = select.value;
+  reset();
+});
+function reset() { zoom = Math.log2(Math.min(canvas.width, canvas.height) / meta.tile); center = [0.5, 0.5]; draw(); }
+function resize() { canvas.width = window.innerWidth; canvas.height = window.innerHeight; if (meta) draw(); }
+window.onresize = resize; resize();
+function scale() { return meta.tile * Math.pow(2, zoom); }
+function toScreen(u, v) { const s = scale(); return [(u - center[0]) * s + canvas.width / 2, (v - center[1]) * s + canvas.height / 2]; }
+function toUnit(x, y) { const s = scale(); return [(x - canvas.width / 2) / s + center[0], (y - canvas.height / 2) / s + center[1]]; }
+function toWorld(u, v) { const p = meta.planes[plane]; return [p.x_left + u * (p.x_right - p.x_left), p.y_top + v * (p.y_bottom - p.y_top)]; }
+function fromWorld(x, y) { const p = meta.planes[plane]; return [(x - p.x_left) / (p.x_right - p.x_left), (y - p.y_top) / (p.y_bottom - p.y_top)]; }
+function get(cache, key, url, json) {
+  if (!(key in cache)) {
+    cache[key] = null;
+    if (json) fetch(url).then(r => r.ok ? r.json() : 'missing').then(d => { cache[key] = d; draw(); }).catch(() => { cache[key] = 'missing'; });
+    else { const img = new Image(); img.onload = () => { cache[key] = img; draw(); }; img.onerror = () => { cache[key] = 'missing'; }; img.src = url; }
+  }
+  return cache[key];
+}
+function draw() {
+  ctx.fillStyle = '#111'; ctx.fillRect(0, 0, canvas.width, canvas.height);
+  const level = Math.max(0, Math.min(meta.levels, Math.round(zoom))), n = Math.pow(2, level), size = scale() / n;
+  const [u0, v0] = toUnit(0, 0), [u1, v1] = toUnit(canvas.width, canvas.height);
+  const deepest = level == meta.levels && zoom >= meta.levels - 0.5;
+  document.getElementById('level').textContent = 'level ' + level + '/' + meta.levels + (deepest ? ' (stars)' : '');
+  ctx.imageSmoothingEnabled = false;
+  for (let ty = Math.max(0, Math.floor(v0 * n)); ty < Math.min(n, Math.ceil(v1 * n)); ty++) {
+    for (let tx = Math.max(0, Math.floor(u0 * n)); tx < Math.min(n, Math.ceil(u1 * n)); tx++) {
+      const name = plane + '/' + level + '/' + tx + '_' + ty, [x, y] = toScreen(tx / n, ty / n);
+      const img = get(tiles, name, name + '.png', false);
+      if (img && img !== 'missing') ctx.drawImage(img, x, y, size + 0.5, size + 0.5);
+      if (deepest) {
+        const stars = get(points, name, name + '.json', true);
+        if (stars && stars !== 'missing') {
+          ctx.fillStyle = '#ffcc33';
+          for (let i = 0; i < stars.x.length; i++) {
+            const [px, py] = toScreen(...fromWorld(stars.x[i], stars.y[i]));
+            ctx.beginPath(); ctx.arc(px, py, 2.5, 0, 2 * Math.PI); ctx.fill();
+          }
+        }
+      }
+    }
+  }
+  const p = meta.planes[plane];
+  if (p.marker) {
+    const [mx, my] = toScreen(...fromWorld(p.marker[0], p.marker[1]));
+    ctx.strokeStyle = 'red'; ctx.lineWidth = 2; ctx.beginPath(); ctx.arc(mx, my, 8, 0, 2 * Math.PI); ctx.stroke();
+  }
+  readout();
+}
+function readout() {
+  if (!mouse) return;
+  const p = meta.planes[plane], [wx, wy] = toWorld(...toUnit(mouse[0], mouse[1]));
+  let text = p.xlabel + ' ' + wx.toFixed(3) + ', ' + p.ylabel + ' ' + wy.toFixed(3);
+  const level = Math.max(0, Math.min(meta.levels, Math.round(zoom))), n = Math.pow(2, level);
+  if (level == meta.levels) {
+    const [u, v] = toUnit(mouse[0], mouse[1]), stars = points[plane + '/' + level + '/' + Math.floor(u * n) + '_' + Math.floor(v * n)];
+    if (stars && stars !== 'missing') {
+      let best = -1, bestDistance = 36;
+      for (let i = 0; i < stars.x.length; i++) {
+        const [px, py] = toScreen(...fromWorld(stars.x[i], stars.y[i])), d = (px - mouse[0]) ** 2 + (py - mouse[1]) ** 2;
+        if (d < bestDistance) { best = i; bestDistance = d; }
+      }
+      if (best >= 0) text = meta.columns.map(c => c + ' ' + stars[c][best]).join(', ');
+    }
+  }
+  document.getElementById('readout').textContent = text;
+}
+canvas.onmousedown = e => { drag = [e.clientX, e.clientY, center[0], center[1]]; canvas.style.cursor = 'grabbing'; };
+window.onmouseup = () => { drag = null; canvas.style.cursor = 'grab'; };
+canvas.onmousemove = e => {
+  mouse = [e.clientX, e.clientY];
+  if (drag) { center = [drag[2] - (e.clientX - drag[0]) / scale(), drag[3] - (e.clientY - drag[1]) / scale()]; draw(); } else readout();
+};
+canvas.onwheel = e => {
+  e.preventDefault();
+  const before = toUnit(e.clientX, e.clientY);
+  zoom = Math.max(-1, Math.min(meta.levels + 3, zoom - Math.sign(e.deltaY) * 0.25));
+  const after = toUnit(e.clientX, e.clientY);
+  center = [center[0] + before[0] - after[0], center[1] + before[1] - after[1]];
+  draw();
+};
+document.getElementById('reset').onclick = reset;
+</script></body></html>
+"""
+
+    def __init__(self, catalog, output_dir, levels=6, max_points=20000, quality_cut=True):
+        # catalog: LoadedCatalog (see load_catalog)
+        self.catalog = catalog
+        self.output_dir = output_dir
+        self.levels = levels
+        self.max_points = max_points
+        self.quality_cut = quality_cut
+
+    def build_key(self):
+        phot_file = self.catalog.plotter.phot_file
+        stat = os.stat(phot_file)
+        return {'phot_file': os.path.abspath(phot_file), 'mtime': stat.st_mtime, 'size': stat.st_size, 'levels': self.levels,
+                'quality_cut': self.quality_cut, 'sn': [self.catalog.prepared.sn_ra, self.catalog.prepared.sn_dec]}
+
+    def planes(self):
+        # {name: (x, y, plane metadata)}, with x_left/x_right and y_top/y_bottom the world coordinates of the plane edges
+        plotter, prepared = self.catalog.plotter, self.catalog.prepared
+        quality_mask, _, ra, dec = plotter.compute_quality_and_separation(prepared)
+        keep = quality_mask if self.quality_cut else np.ones(len(ra), dtype=bool)
+        # DOLPHOT writes 99.999 for undetected stars
+        keep &= (prepared.blue < 90) & (prepared.red < 90)
+        self.keep = np.flatnonzero(keep)
+
+        xi, eta = EpochCrossMatcher.tangent_plane(ra[keep], dec[keep], prepared.sn_ra, prepared.sn_dec)
+        half = 1.02 * max(np.max(np.abs(xi)), np.max(np.abs(eta)))
+        color = np.asarray(prepared.blue[keep] - prepared.red[keep], dtype=np.float64)
+        mag = np.asarray(prepared.red[keep], dtype=np.float64)
+        color_range = np.percentile(color, [0.05, 99.95])
+        mag_range = np.percentile(mag, [0.05, 99.95])
+        return {
+            # East to the left, north up
+            'sky': (xi, eta, {'title': 'Sky (arcsec from SN)', 'xlabel': 'East', 'ylabel': 'North', 'x_left': half, 'x_right': -half,
+                              'y_top': half, 'y_bottom': -half, 'marker': [0.0, 0.0]}),
+            # Bright stars at the top
+            'cmd': (color, mag, {'title': f"CMD ({prepared.cmd_label} vs {prepared.red_label})", 'xlabel': prepared.cmd_label, 'ylabel': prepared.red_label,
+                                 'x_left': color_range[0] - 0.1, 'x_right': color_range[1] + 0.1, 'y_top': mag_range[0] - 0.2, 'y_bottom': mag_range[1] + 0.2}),
+        }
+
+    def write_plane(self, name, x, y, settings, star_columns):
+        u = (x - settings['x_left']) / (settings['x_right'] - settings['x_left'])
+        v = (y - settings['y_top']) / (settings['y_bottom'] - settings['y_top'])
+        inside = np.flatnonzero((u >= 0) & (u < 1) & (v >= 0) & (v < 1))
+        u, v = u[inside], v[inside]
+        colormap = plt.get_cmap('inferno')
+        for level in range(self.levels + 1):
+            level_dir = os.path.join(self.output_dir, name, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            pixels = self.TILE << level
+            ix, iy = (u * pixels).astype(np.int64), (v * pixels).astype(np.int64)
+            # One key per output pixel: tile index in the high bits, pixel within the tile in the low 16 bits. Sorting once groups
+            # the stars by tile and gives the densest pixel of the level, which sets a color scale shared by all its tiles
+            key = (((iy >> 8) << level) + (ix >> 8)) * 65536 + (iy & 255) * 256 + (ix & 255)
+            order = np.argsort(key, kind='stable')
+            key = key[order]
+            level_max = np.max(np.diff(np.flatnonzero(np.r_[True, key[1:] != key[:-1], True])))
+            tile_ids = key >> 16
+            starts = np.flatnonzero(np.r_[True, tile_ids[1:] != tile_ids[:-1]])
+            for start, end in zip(starts, np.r_[starts[1:], len(key)]):
+                tile_x, tile_y = int(tile_ids[start] % (1 << level)), int(tile_ids[start] >> level)
+                counts = np.bincount(key[start:end] & 65535, minlength=65536).reshape(self.TILE, self.TILE)
+                rgba = colormap(np.log1p(counts) / np.log1p(level_max))
+                rgba[..., 3] = counts > 0
+                plt.imsave(os.path.join(level_dir, f"{tile_x}_{tile_y}.png"), rgba)
+                if level == self.levels and end - start <= self.max_points:
+                    stars = inside[order[start:end]]
+                    with open(os.path.join(level_dir, f"{tile_x}_{tile_y}.json"), 'w') as f:
+                        json.dump(dict({'x': np.round(x[stars], 4).tolist(), 'y': np.round(y[stars], 4).tolist()},
+                                       **{column: np.round(values[stars], 4).tolist() for column, values in star_columns.items()}), f)
+            print(f"Explorer {name} plane: level {level}, {len(starts)} tiles")
+
+    def build(self):
+        key = self.build_key()
+        meta_file = os.path.join(self.output_dir, 'meta.json')
+        if os.path.isfile(meta_file):
+            with open(meta_file) as f:
+                if json.load(f).get('build') == key:
+                    print(f"Explorer tiles in {self.output_dir} are up to date")
+                    return
+        start_time = time.time()
+        plotter, prepared = self.catalog.plotter, self.catalog.prepared
+        planes = self.planes()
+        star_columns = {prepared.blue_label: np.asarray(prepared.blue[self.keep], dtype=np.float64), prepared.red_label: np.asarray(prepared.red[self.keep], dtype=np.float64),
+                        'X': np.asarray(prepared.x[self.keep], dtype=np.float64), 'Y': np.asarray(prepared.y[self.keep], dtype=np.float64)}
+        for name, (x, y, settings) in planes.items():
+            shutil.rmtree(os.path.join(self.output_dir, name), ignore_errors=True)
+            self.write_plane(name, x, y, settings, star_columns)
+        with open(os.path.join(self.output_dir, 'index.html'), 'w') as f:
+            f.write(self.VIEWER)
+        with open(meta_file, 'w') as f:
+            json.dump({'obj_name': plotter.obj_name, 'n_stars': int(len(self.keep)), 'tile': self.TILE, 'levels': self.levels,
+                       'columns': list(star_columns), 'planes': {name: settings for name, (_, _, settings) in planes.items()}, 'build': key}, f, indent=2)
+        print(f"Explorer tiles for {len(self.keep)} stars written to {self.output_dir} ({time.time() - start_time:.1f}s)")
+
+    def serve(self, port=8765):
+        class QuietHandler(http.server.SimpleHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        # Local only
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', port), functools.partial(QuietHandler, directory=self.output_dir))
+        print(f"Explorer running at http://127.0.0.1:{port}/ (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+# Benchmark harness for Karlach's own overhead. Real DOLPHOT runs take days on multi-GB images, so the harness writes small stand-in
+# executables for acsmask, splitgroups, calcsky and dolphot, synthesizes a field at several data scales, then runs the --dolphot -> --phot
+# flow end to end and reports the wall time of each stage. Called with --benchmark
+class DolphotBenchmark:
+    # name: (image size in pixels, number of flt images, number of stars written by the stub dolphot)
+    SCALES = {
+        'small': (1024, 2, 5000),
+        'medium': (2048, 4, 50000),
+        'large': (4096, 8, 500000),
+    }
+
+    # Shared preamble of the stand-in tools: sleep for the configured runtime, so the external stages take a realistic amount of time
+    STUB_HEADER = '''#!/usr/bin/env python3
+import os, sys, shutil, random
+import time
+tool = os.path.basename(sys.argv[0])
+runtime = float(os.environ.get('KARLACH_STUB_RUNTIME_' + tool.upper(), os.environ.get('KARLACH_STUB_RUNTIME', '0')))
+time.sleep(runtime)
+with open(os.environ['KARLACH_STUB_CALLS'], 'a') as calls:
+    calls.write(f"{tool} {runtime}\\n")
+'''
+    STUBS = {
+        'acsmask': '''
+for name in sys.argv[1:]:
+    print(f"Masking {name}")
+''',
+        'splitgroups': '''
+for name in sys.argv[1:]:
+    if not name.endswith('.fits') or '.chip' in name or '.sky' in name:
+        continue
+    for chip in (1, 2):
+        shutil.copy(name, name[:-5] + f'.chip{chip}.fits')
+        print(f"Writing {name[:-5]}.chip{chip}.fits")
+''',
+        'calcsky': '''
+base = sys.argv[1]
+if os.path.exists(base + '.fits'):
+    shutil.copy(base + '.fits', base + '.sky.fits')
+    print(f"Writing {base}.sky.fits")
+''',
+        'dolphot': '''
+output = sys.argv[1]
+nstars = int(os.environ.get('KARLACH_STUB_NSTARS', '5000'))
+npix = int(os.environ.get('KARLACH_STUB_NPIX', '1024'))
+for marker in ['Reading IMAGE files', 'Alignment of images', 'Finding stars', 'Iterating PSF photometry', 'Second pass finding stars',
+               'Computing aperture corrections', 'Writing output photometry']:
+    print(marker, flush=True)
+
+# Dolphot column layout: 11 global columns, then 13 columns per filter (mag = 16, unc = 18, S/N = 20, sharp = 21 for the first filter)
+blocks = [('ACS_F555W', 24.0), ('ACS_F814W', 23.0)]
+names = ['Extension (zero for base image)', 'Chip (for three-dimensional FITS image)', 'Object X position on reference image',
+         'Object Y position on reference image', 'Chi for fit', 'Signal-to-noise', 'Object sharpness', 'Object roundness',
+         'Direction of major axis', 'Crowding', 'Object type']
+per_filter = ['Total counts', 'Total sky level', 'Normalized count rate', 'Normalized count rate uncertainty',
+              'Instrumental VEGAMAG magnitude', 'Transformed UBVRI magnitude', 'Magnitude uncertainty', 'Chi',
+              'Signal-to-noise', 'Sharpness', 'Roundness', 'Crowding', 'Photometry quality flag']
+for band, _ in blocks:
+    names += [f'{name}, {band}' for name in per_filter]
+with open(output + '.columns', 'w') as f:
+    for i, name in enumerate(names):
+        f.write(f'{i + 1}. {name}\\n')
+
+rng = random.Random(1)
+with open(output, 'w') as f:
+    for _ in range(nstars):
+        row = [0, 1, rng.uniform(0, npix), rng.uniform(0, npix), rng.uniform(0.5, 2), rng.uniform(3, 100),
+               rng.gauss(0, 0.1), rng.gauss(0, 0.1), rng.uniform(0, 180), rng.uniform(0, 1.5), 1]
+        for _, depth in blocks:
+            mag = depth - rng.expovariate(0.8)
+            snr = max(10 ** (0.4 * (depth + 2.5 - mag)), 1.0)
+            row += [10 ** (0.4 * (30 - mag)), 50.0, 1.0, 0.01, mag, 99.999, 1.0857 / snr, 1.0, snr,
+                    rng.gauss(0, 0.1), rng.gauss(0, 0.1), rng.uniform(0, 1), 0]
+        f.write(' '.join(f'{value:.4f}' if isinstance(value, float) else str(value) for value in row) + '\\n')
+print(f"Wrote {nstars} stars to {output}")
+''',
+    }
+
+    def __init__(self, scales=None, stub_runtime=0.0, keep=False):
+        self.scales = scales if scales else ['small', 'medium']
+        self.stub_runtime = stub_runtime
+        self.keep = keep
+        self.obj_name = 'BENCH'
+        self.system_name = 'ACS_WFC'
+        # Arbitrary field position; the SN sits at the image center
+        self.sn_ra, self.sn_dec = 169.592, -32.837
+        self.distance = 7.0e6
+
+    def write_stubs(self, bin_dir):
+        os.makedirs(bin_dir, exist_ok=True)
+        for tool, body in self.STUBS.items():
+            stub_path = os.path.join(bin_dir, tool)
+            # Fail here, not as a confusing stage failure later, if a stub does not parse
+            compile(self.STUB_HEADER + body, stub_path, 'exec')
+            with open(stub_path, 'w') as f:
+                f.write(self.STUB_HEADER + body)
+            os.chmod(stub_path, 0o755)
+
+    def write_field(self, work_dir, npix, n_flt):
+        # Synthetic images with a simple TAN WCS centered on the SN, 0.05"/pixel. The drz image has the longest exposure,
+        # so it is selected as the reference image just like in a real field
+        rng = np.random.default_rng(0)
+        header = fits.Header()
+        header['CTYPE1'], header['CTYPE2'] = 'RA---TAN', 'DEC--TAN'
+        header['CRVAL1'], header['CRVAL2'] = self.sn_ra, self.sn_dec
+        header['CRPIX1'], header['CRPIX2'] = npix / 2, npix / 2
+        header['CDELT1'], header['CDELT2'] = -0.05 / 3600, 0.05 / 3600
+        header['FILTER1'], header['FILTER2'] = 'F555W', 'CLEAR2L'
+        header['DETECTOR'], header['TARGNAME'] = 'WFC', self.obj_name
+
+        images = [('bench_drz.fits', 2000.0)] + [(f'bench{i}_flt.fits', 500.0) for i in range(n_flt)]
+        for name, exptime in images:
+            header['EXPTIME'] = exptime
+            data = rng.normal(100.0, 10.0, (npix, npix)).astype(np.float32)
+            fits.PrimaryHDU(data, header=header).writeto(os.path.join(work_dir, name), overwrite=True)
+
+        config = configparser.ConfigParser()
+        config.optionxform = str
+        config['DOLPHOT_CONFIG'] = {
+            'system_name': self.system_name,
+            'obj_name': self.obj_name,
+            'distance': str(self.distance),
+            'proximity_threshold_pc': '50, 100, 150',
+            'stage_history': os.path.join(work_dir, 'stage_history.json'),
+            'monitor_interval': '0.5',
+        }
+        config[self.system_name] = {'img_RAper': '3.0', 'img_RPSF': '15', 'SigFind': '3.0', 'FitSky': '2', 'Force1': '1'}
+        with open(os.path.join(work_dir, 'config.ini'), 'w') as f:
+            config.write(f)
+
+    def run_scale(self, scale, root_dir):
+        npix, n_flt, nstars = self.SCALES[scale]
+        work_dir = os.path.join(root_dir, scale)
+        os.makedirs(work_dir, exist_ok=True)
+        self.write_field(work_dir, npix, n_flt)
+        os.environ['KARLACH_STUB_NSTARS'] = str(nstars)
+        os.environ['KARLACH_STUB_NPIX'] = str(npix)
+        calls_file = os.path.join(work_dir, 'stub_calls.log')
+        os.environ['KARLACH_STUB_CALLS'] = calls_file
+
+        timings = {}
+        def timed(stage, func, *args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            timings[stage] = time.perf_counter() - start
+            return result
+
+        def check(stage, ok):
+            # A failed stage stops this scale here, instead of failing later on its missing outputs
+            if not ok:
+                raise RuntimeError(f"Benchmark stage '{stage}' failed at scale {scale} (rerun with --bench_keep to inspect the logs in {work_dir})")
+
+        # Karlach works relative to the current directory (config.ini, logs, data/), so run each scale inside its own field directory
+        original_directory = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            executor = TerminalCommandExecutor()
+            config = configparser.ConfigParser()
+            config.read('config.ini')
+
+            # --dolphot flow
+            timed('mask', executor.execute_mask_command, 'acsmask *.fits', f'acsmask_{self.obj_name}.log')
+            timed('splitgroups', executor.execute_splitgroups_command, f'splitgroups *.fits >> splitgroups_{self.obj_name}.log', f'splitgroups_{self.obj_name}.log')
+            timed('calcsky', executor.execute_calcsky_commands, work_dir, self.obj_name, self.system_name)
+
+            def headerkeys():
+                organizer = DataFilterOrganizer(f'headerkey_{self.obj_name}.info')
+                organizer.organize_by_filter([f for f in os.listdir(work_dir) if re.match(r'.*\.chip[12]\.fits$', f)])
+                organizer.print_organized_list()
+            timed('headerkeys', headerkeys)
+
+            def param():
+                selected_files = executor.find_chip_files(work_dir, self.system_name)
+                return executor.write_parameter_file(selected_files, {}, 'config.ini', overwrite=True)
+            # write_parameter_file returns (created, existed), or None if writing failed
+            result = timed('param', param)
+            check('param', result and result[0])
+            param_file = f"{self.obj_name}_{self.system_name}_phot.param"
+            check('dolphot', timed('dolphot', executor.execute_dolphot, self.obj_name, param_file, work_dir, config, prompt=False))
+
+            # --phot --save_data --pdf flow
+            data_dir = os.path.join(work_dir, 'data')
+            os.makedirs(data_dir, exist_ok=True)
+            phot_config = configparser.ConfigParser()
+            phot_config.optionxform = str
+            phot_config.read('config.ini')
+            thresholds = [float(x) for x in phot_config['DOLPHOT_CONFIG']['proximity_threshold_pc'].split(',')]
+            plotter = timed('phot_setup', PlotManager, phot_config, self.obj_name, self.distance, thresholds, pdf=True, data_dir=data_dir)
+            prepared_data = timed('phot_prepare', plotter.prepare_data, sn_coords=(self.sn_ra, self.sn_dec))
+            check('phot_prepare', prepared_data is not None)
+            processed_data = timed('phot_process', plotter.process_data, prepared_data)
+
+            def save():
+                for data, threshold in zip(processed_data, thresholds):
+                    plotter.save_processed_data(data, self.obj_name, threshold, plotter.blue_label, plotter.red_label)
+            timed('phot_save', save)
+
+            def plot():
+                all_data = []
+                for threshold in thresholds:
+                    data = plotter.read_saved_data(os.path.join(data_dir, f"{self.obj_name}_{threshold}pc_{plotter.blue_label}_{plotter.red_label}_full.npy"))
+                    if data is not None and len(data) > 2:
+                        all_data.append((threshold, data))
+                if not all_data:
+                    return
+                avg_mags = np.concatenate([(data[:, 2] + data[:, 4]) / 2 for _, data in all_data])
+                plotter.plot_all_from_files(all_data, np.min(avg_mags), np.max(avg_mags))
+            timed('phot_plot', plot)
+        finally:
+            os.chdir(original_directory)
+
+        # Time spent sleeping inside the stand-in tools is not Karlach's overhead
+        with open(calls_file, 'r') as f:
+            stub_time = sum(float(line.split()[1]) for line in f if line.strip())
+        overhead = sum(timings.values()) - stub_time
+        return {'scale': scale, 'npix': npix, 'n_images': n_flt + 1, 'nstars': nstars, 'timings': timings, 'overhead': overhead}
+
+    def run(self, output_file='benchmark_results.json'):
+        # The stand-in tools shadow any real DOLPHOT installation for the duration of the benchmark
+        plt.switch_backend('Agg')
+        root_dir = tempfile.mkdtemp(prefix='karlach_bench_')
+        bin_dir = os.path.join(root_dir, 'bin')
+        self.write_stubs(bin_dir)
+        saved_environ = dict(os.environ)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+        os.environ['KARLACH_STUB_RUNTIME'] = str(self.stub_runtime)
+
+        results = []
+        try:
+            for scale in self.scales:
+                if scale not in self.SCALES:
+                    print(f"Unknown benchmark scale '{scale}'. Valid options are: {list(self.SCALES)}")
+                    continue
+                print(f"\n===== Benchmark scale: {scale} =====")
+                try:
+                    results.append(self.run_scale(scale, root_dir))
+                except RuntimeError as e:
+                    print(f"Error: {e}. Skipping scale {scale}.")
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_environ)
+            if self.keep:
+                print(f"Benchmark working directories kept in {root_dir}")
+            else:
+                shutil.rmtree(root_dir, ignore_errors=True)
+
+        self.print_report(results)
+        with open(output_file, 'w') as f:
+            json.dump({'stub_runtime_s': self.stub_runtime, 'results': results}, f, indent=2)
+        print(f"Benchmark results saved to {output_file}")
+        return results
+
+    def print_report(self, results):
+        # Overhead is the total wall time minus the configured runtime of the stand-in tools
+        if not results:
+            return
+        stages = list(results[0]['timings'])
+        print("\nStage timings (seconds):")
+        print(f"{'stage':<14}" + ''.join(f"{result['scale']:>12}" for result in results))
+        for stage in stages:
+            print(f"{stage:<14}" + ''.join(f"{result['timings'].get(stage, float('nan')):>12.3f}" for result in results))
+        print(f"{'overhead':<14}" + ''.join(f"{result['overhead']:>12.3f}" for result in results))
+
+# Headless API: the steps of the CLI as functions that take explicit arguments and return results instead of prompting, for scripts,
+# notebooks and job schedulers. Each function works on a field directory with its own config.ini, like --batch. For example:
+#   import Karlach
+#   Karlach.mask_images('SN2004dj')
+#   Karlach.split_groups('SN2004dj')
+#   Karlach.calc_sky('SN2004dj')
+#   Karlach.write_param_file('SN2004dj', customizations={1: ('0 0', '1 0 0')}, overwrite=True)
+#   Karlach.run_dolphot('SN2004dj')
+#   catalog = Karlach.load_catalog('SN2004dj', sn_coords=(118.41733, 65.59800))
+#   per_threshold = catalog.plotter.process_data(catalog.prepared)
+ParamFileResult = namedtuple('ParamFileResult', ['param_file', 'created', 'is_new', 'images'])
+DolphotResult = namedtuple('DolphotResult', ['success', 'phot_file', 'log_file', 'status_file'])
+LoadedCatalog = namedtuple('LoadedCatalog', ['plotter', 'prepared', 'config'])
+
+# Held while a field directory is the working directory, see working_directory
+WORKING_DIRECTORY_LOCK = threading.RLock()
+
+@contextlib.contextmanager
+def working_directory(path):
+    # The pipeline reads config.ini and writes its outputs in the working directory. os.chdir changes it for the whole process, so this
+    # is not thread-safe: threads using this helper (e.g. KarlachDaemon requests) take turns through WORKING_DIRECTORY_LOCK, and other
+    # threads of the process must not rely on relative paths meanwhile
+    with WORKING_DIRECTORY_LOCK:
+        previous_dir = os.getcwd()
+        os.chdir(path)
+        try:
+            yield os.getcwd()
+        finally:
+            os.chdir(previous_dir)
+
+def parse_coordinates(text):
+    # --sn_coords: 'simbad', or 'RA,DEC' in degrees or sexagesimal (e.g. '07:53:40.1,+65:35:52.8')
+    if text.strip().lower() == 'simbad':
+        return 'simbad'
+    try:
+        ra, dec = [part.strip() for part in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected 'simbad' or 'RA,DEC', got '{text}'")
+    try:
+        return float(ra), float(dec)
+    except ValueError:
+        coords = SkyCoord(ra, dec, unit=(u.hourangle, u.deg), frame='icrs')
+        return coords.ra.deg, coords.dec.deg
+
+def resolve_coordinates(obj_name, sn_coords='simbad'):
+    # (RA, DEC) in degrees, from SIMBAD or as given. Raises ValueError instead of falling back to manual input
+    if sn_coords != 'simbad':
+        return float(sn_coords[0]), float(sn_coords[1])
+    try:
+        result_table = Simbad.query_object(obj_name)
+    except Exception as e:
+        raise ValueError(f"SIMBAD query for {obj_name} failed: {e}")
+    if result_table is None:
+        raise ValueError(f"Object {obj_name} not found in SIMBAD")
+    coords = SkyCoord(ra=result_table['RA'].data[0], dec=result_table['DEC'].data[0], unit=("hourangle", "deg"), frame='icrs')
+    return coords.ra.deg, coords.dec.deg
+
+def read_field_config():
+    # obj_name and system_name of the field in the working directory
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    return config['DOLPHOT_CONFIG']['obj_name'], config['DOLPHOT_CONFIG']['system_name']
+
+def mask_images(field_dir='.'):
+    # Step 1 of --dolphot: {system}mask on the .fits files of the field. Returns the log file
+    with working_directory(field_dir) as cwd:
+        obj_name, system_name = read_field_config()
+        system_choice = system_name.split('_')[0]
+        if system_choice not in ['WFPC2', 'ACS', 'WFC3', 'ROMAN', 'NIRCAM', 'NIRISS', 'MIRI']:
+            raise ValueError(f"System name '{system_name}' in {cwd}/config.ini is not recognized, (e.g. ACS_HRC)")
+        output_mask = f'{system_choice.lower()}mask_{obj_name}.log'
+        TerminalCommandExecutor().execute_mask_command(f"{system_choice.lower()}mask *.fits", output_mask)
+        return os.path.join(cwd, output_mask)
+
+def split_groups(field_dir='.'):
+    # Step 2 of --dolphot: splitgroups on the .fits files of the field. Returns the log file, or None for single chip systems
+    with working_directory(field_dir) as cwd:
+        obj_name, system_name = read_field_config()
+        if system_name in ['ACS_HRC', 'WFC3_IR', 'NIRCAM', 'NIRISS', 'MIRI', 'ROMAN']:
+            print(f"{system_name} only has 1 chip, skipping splitgroups.")
+            return None
+        output_splitgroups = f'splitgroups_{obj_name}.log'
+        TerminalCommandExecutor().execute_splitgroups_command(f'splitgroups *.fits >> {output_splitgroups}', output_splitgroups)
+        return os.path.join(cwd, output_splitgroups)
+
+def calc_sky(field_dir='.', calcsky_values=None):
+    # Step 3 of --dolphot: calcsky on the chip files of the field. calcsky_values: the 5 calcsky parameters, default per system_name
+    with working_directory(field_dir) as cwd:
+        obj_name, system_name = read_field_config()
+        if calcsky_values is not None and len(calcsky_values) != 5:
+            raise ValueError(f"Expected 5 calcsky values, got {len(calcsky_values)}")
+        TerminalCommandExecutor().execute_calcsky_commands(cwd, obj_name, system_name, calcsky_values)
+        return os.path.join(cwd, f'calcsky_{obj_name}.log')
+
+def write_param_file(field_dir='.', customizations=None, overwrite=False):
+    # customizations: {image index: (shift, xform)}, e.g. {1: ('0 0', '1 0 0')}. overwrite=None asks before replacing an existing file
+    with working_directory(field_dir) as cwd:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        obj_name, system_name = config['DOLPHOT_CONFIG']['obj_name'], config['DOLPHOT_CONFIG']['system_name']
+        executor = TerminalCommandExecutor()
+        selected_files = executor.find_chip_files(cwd, system_name)
+        customizations = executor.customize_image_parameters(selected_files, customizations or {})
+        # write_parameter_file returns None if writing failed
+        created, is_new = executor.write_parameter_file(selected_files, customizations, 'config.ini', overwrite=overwrite) or (False, False)
+        return ParamFileResult(os.path.join(cwd, f"{obj_name}_{system_name}_phot.param"), created, is_new, selected_files)
+
+def run_dolphot(field_dir='.', param_file=None):
+    # Runs dolphot on the parameter file of the field (default: the one written by write_param_file), through the build cache if enabled
+    with working_directory(field_dir) as cwd:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        obj_name, system_name = config['DOLPHOT_CONFIG']['obj_name'], config['DOLPHOT_CONFIG']['system_name']
+        param_file = param_file or f"{obj_name}_{system_name}_phot.param"
+        if not os.path.isfile(param_file):
+            raise FileNotFoundError(f"Parameter file '{param_file}' does not exist in {cwd}")
+        build_cache = DolphotBuildCache.from_config(config)
+        if build_cache:
+            build_cache.activate(system_name)
+        success = TerminalCommandExecutor().execute_dolphot(obj_name, param_file, cwd, config, prompt=False)
+        return DolphotResult(success, os.path.join(cwd, f"{obj_name}_{system_name}.phot"), os.path.join(cwd, f"dolphot_{obj_name}_{system_name}.log"),
+                             os.path.join(cwd, f"dolphot_{obj_name}_{system_name}.status.json"))
+
+def load_catalog(field_dir='.', sn_coords='simbad', proximity_thresholds=None, compact=False, pdf=True):
+    # Catalog, labels, WCS and SN position of a field, ready for process_data/save_processed_data/make_hess. Outputs go to the field's data directory
+    with working_directory(field_dir) as cwd:
+        config = configparser.ConfigParser()
+        config.optionxform = str  # Preserve case sensitivity
+        config.read('config.ini')
+        settings = config['DOLPHOT_CONFIG']
+        if proximity_thresholds is None:
+            proximity_thresholds = [float(x) for x in settings.get('proximity_threshold_pc', '50, 100, 150').split(',')]
+        data_dir = os.path.join(cwd, 'data')
+        os.makedirs(data_dir, exist_ok=True)
+        plotter = PlotManager(config, settings['obj_name'], float(settings['distance']), proximity_thresholds, pdf=pdf, data_dir=data_dir, compact=compact)
+        # 'simbad' is queried while the catalog loads
+        prepared = plotter.prepare_data(sn_coords=sn_coords, prompt=False)
+        if prepared is None:
+            raise ValueError(f"Could not load the catalog of {cwd}. Check phot_file and ref_file in config.ini, and pass sn_coords if SIMBAD does not know the object")
+        return LoadedCatalog(plotter, prepared, config)
+
 def main():
     parser = argparse.ArgumentParser(description="Dolphot Automation Tool")
     parser.add_argument('--rawskyplot', type=str, help='Plot raw sky image from FITS file')
+    parser.add_argument('--quicklook', action='store_true', help='With --rawskyplot, memory map and downsample the image to screen resolution for a fast preview')
+    parser.add_argument('--gallery', nargs='?', const='.', help='Render thumbnails of all science, sky and residual images in a directory (default: current) into an HTML contact sheet')
+    parser.add_argument('--gallery_workers', type=int, default=None, help='Number of worker processes for --gallery (default: number of CPUs)')
     parser.add_argument('--make', action='store_true', help='Run "make clean" and "make" in the dolphot makefile directory.')
     parser.add_argument('--param', action='store_true', help='Create the parameter file for dolphot')
     parser.add_argument('--customize-img', action='store_true', help='Customize individual image parameters interactively')
     parser.add_argument('--dolphot', action='store_true', help='Execute terminal commands for dolphot processing')
     parser.add_argument('--interactive', action='store_true', help='Enable interactive mode to confirm each dolphot step before proceeding')
+    parser.add_argument('--batch', nargs='+', help='Run the --dolphot pipeline for several field directories (or text files listing them) within a CPU/memory budget')
+    parser.add_argument('--batch_cpus', type=int, default=None, help='CPU budget for --batch (default: all CPUs)')
+    parser.add_argument('--batch_mem_gb', type=float, default=None, help='Memory budget in GB for --batch (default: 80%% of physical memory)')
+    parser.add_argument('--batch_resume', action='store_true', help='Resume a previous --batch run, skipping fields that already finished')
+    parser.add_argument('--watch', nargs='*', help='Watch field directories (or text files listing them, default: current directory) and run the watch_args analysis as soon as their dolphot catalog is complete')
+    parser.add_argument('--watch_workers', type=int, default=2, help='Analyses running at once for --watch (default: 2)')
+    parser.add_argument('--yes', action='store_true', help='Answer yes to every confirmation prompt of --dolphot / --dolphot_only (unattended and batch runs)')
     parser.add_argument('--dolphot_only', action='store_true', help='Assuming you have processed your images and made parameter file, execute dolphot separately')
+    parser.add_argument('--forced_phot', nargs='?', const='', help='Rerun dolphot on the images of the field at the star positions of an existing .phot catalog (default: phot_file of [FORCED_PHOT] or [DOLPHOT_CONFIG]), skipping star finding')
+    parser.add_argument('--sweep', action='store_true', help='Run dolphot once per combination of the parameter values under [SWEEP] in config.ini, concurrently, and compare the results in one table')
+    parser.add_argument('--dolphot_status', action='store_true', help='Print the progress and ETA of a running (or finished) dolphot job in the working directory')
     parser.add_argument('--calcsky_values', action='store_true', help='Provide custom calcsky values')
     parser.add_argument('--headerkeys', action='store_true', help='If you want to generate headerkey info without performing whole dolphot process')
     parser.add_argument('--phot', action='store_true', help='Make several plots from the output dolphot photometry')
     parser.add_argument('--disthist', action='store_true', help='Generate distance histogram plots')
+    parser.add_argument('--hess', action='store_true', help='Build binned, error-smoothed Hess diagrams for every proximity threshold and save them to the data directory')
+    parser.add_argument('--cmd_regions', action='store_true', help='Flag the stars inside the named CMD polygons under [CMD_REGIONS] in config.ini, and count them per proximity threshold')
     parser.add_argument('--save_data', action='store_true', help='Save quality and distance filtered datasets to .txt and .npy files')
+    parser.add_argument('--sn_coords', type=parse_coordinates, default=None, help="SN position for --phot/--save_data/--hess/--disthist without prompting: 'simbad', or 'RA,DEC' in degrees or sexagesimal")
+    parser.add_argument('--compact', action='store_true', help='Keep catalogs in float32 (photometry) in memory and in saved .npy outputs, positions stay float64')
+    parser.add_argument('--crossmatch', action='store_true', help='Cross-match the epoch catalogs listed under [CROSSMATCH_EPOCHS] in config.ini into per-star light curves')
+    parser.add_argument('--mosaic_merge', action='store_true', help='Merge the overlapping field catalogs listed under [MOSAIC_FIELDS] in config.ini into one deduplicated .phot catalog')
+    parser.add_argument('--diff_image', action='store_true', help='Register, PSF-match and subtract the pre/post-explosion images under [DIFFERENCE] in config.ini, with a residual map around the SN')
+    parser.add_argument('--cutout', nargs='+', help='Cut out the region around the SN (--sn_coords, or SIMBAD) from one or more images, reading only that section of each file')
+    parser.add_argument('--cutout_size', type=int, default=200, help='Size in pixels of the --cutout cutouts (default: 200)')
+    parser.add_argument('--decontaminate', action='store_true', help='Field-star membership probabilities of the stars inside every threshold, from an equal-area control annulus')
+    parser.add_argument('--dereddening', action='store_true', help='Correct every star for differential reddening from its nearest reference stars, writing dA_V and corrected magnitudes next to the saved catalogs')
+    parser.add_argument('--completeness', action='store_true', help='Build a completeness and bias grid (magnitude, color, position) from the artificial star .fake output and apply it to the saved catalogs')
+    parser.add_argument('--quality_maps', action='store_true', help='Write binned maps of star counts, crowding, S/N, sharpness and depth (S/N ~ 5 magnitude) of the whole catalog to a FITS file with the reference WCS')
+    parser.add_argument('--cutout_background', action='store_true', help='With --phot, draw the reference image around the SN behind the RA/Dec plots')
+    parser.add_argument('--explore', nargs='?', type=int, const=8765, help='Build zoomable tiles of the sky and CMD planes of the catalog and serve them in a local browser viewer on this port (default: 8765)')
+    parser.add_argument('--daemon', action='store_true', help='Start the Karlach daemon, which keeps loaded catalogs in memory and answers requests on a Unix socket')
+    parser.add_argument('--daemon_request', type=str, help='Send a JSON request to the running Karlach daemon and print the reply, e.g. \'{"cmd": "counts", "field": ".", "thresholds": [50, 100]}\'')
     parser.add_argument('--no_titles', action='store_true', help='Generate plots without titles for publication')
+    parser.add_argument('--animate', choices=FigureReuseRenderer.PLOT_TYPES, help='With --phot, also save a GIF of one plot type over the proximity thresholds to the data directory')
     parser.add_argument('--pdf', action='store_true', help='Output PDF files to save the plots')
     parser.add_argument('--use_brightest_star', action='store_true', help='Use brightest star instead of catalogue position for special marker')
+    parser.add_argument('--benchmark', nargs='?', const='small,medium', help='Benchmark the --dolphot -> --phot flow with stand-in DOLPHOT tools at the given comma separated scales (small, medium, large)')
+    parser.add_argument('--bench_stub_runtime', type=float, default=0.0, help='Seconds each stand-in DOLPHOT tool sleeps during --benchmark')
+    parser.add_argument('--bench_keep', action='store_true', help='Keep the synthetic --benchmark working directories')
     args = parser.parse_args()
 
     organizer = DataFilterOrganizer()
 
     if args.rawskyplot:
         executor = TerminalCommandExecutor()
-        executor.plot_raw_sky(args.rawskyplot)
+        executor.plot_raw_sky(args.rawskyplot, quicklook=args.quicklook)
+
+    # Quick look at every image in a directory at once, e.g. before running dolphot or after calcsky
+    if args.gallery:
+        gallery = ThumbnailGallery(args.gallery, workers=args.gallery_workers)
+        gallery.build()
 
     # Run 'make clean' and 'make' to initialize dolphot to use different photometric systems
     if args.make:
         # Read in config.ini to find {make_path}, used to find users path to dolphot makefile (typically found in ~/dolphot2.0/), code can potentially find the path without this being defined
         config = configparser.ConfigParser()
         config.read('config.ini')
-        make_path = TerminalCommandExecutor.run_make(config)
+        # With the build cache (default when make_path is defined), build or reuse the install tree for system_name instead of rebuilding in place
+        build_cache = DolphotBuildCache.from_config(config)
+        if build_cache:
+            tree = build_cache.ensure(config['DOLPHOT_CONFIG'].get('system_name'))
+            print(f"DOLPHOT build for {config['DOLPHOT_CONFIG'].get('system_name')} is ready: {tree}")
+        else:
+            make_path = TerminalCommandExecutor.run_make(config)
 
     # Create dolphot parameter file. I think this needs to be folded into args.dolphot
     if args.param:
         executor = TerminalCommandExecutor()
         config = configparser.ConfigParser()
         config.read('config.ini')
-        working_directory = os.getcwd()
         system_name = config['DOLPHOT_CONFIG']['system_name']
-        obj_name = config['DOLPHOT_CONFIG']['obj_name']
-        selected_files = executor.find_chip_files(working_directory, system_name)
-        Nimg = len(selected_files) - 1
-        print(f"Number of image files (Nimg): {Nimg}")
-        
+
         # Customization step (if the --customize-img flag is used)
         customizations = {}
         if args.customize_img:
-            customizations = executor.customize_image_parameters(selected_files)
+            customizations = executor.customize_image_parameters(executor.find_chip_files(os.getcwd(), system_name))
 
-        # Attempt to create or update the parameter file
-        file_created, is_new_file = executor.write_parameter_file(selected_files, customizations, 'config.ini')
+        # Attempt to create or update the parameter file, asking before replacing an existing one unless --yes
+        result = write_param_file('.', customizations, overwrite=True if args.yes else None)
+        print(f"Number of image files (Nimg): {len(result.images) - 1}")
         print("Parameter file handling completed")
 
     # Execute the bulk of dolphot as automatically as possible
@@ -1553,7 +4953,7 @@ def main():
         #Otherwise, will run automatically with printouts along the way, only breaking when pivotal
         
         config = configparser.ConfigParser()
-        working_directory = os.getcwd()
+        work_dir = os.getcwd()
         if os.path.isfile('config.ini'):
             config.read('config.ini')
             if 'DOLPHOT_CONFIG' in config and 'obj_name' in config['DOLPHOT_CONFIG']:
@@ -1565,10 +4965,17 @@ def main():
             print("Config file 'config.ini' is missing.")
             obj_name = input("Enter the object(SN) name to define output files: ")
 
+        # Select (and if needed build) the DOLPHOT tree for this system_name through PATH
+        build_cache = DolphotBuildCache.from_config(config)
+        if build_cache:
+            build_cache.activate(config['DOLPHOT_CONFIG'].get('system_name'))
+
         executor = TerminalCommandExecutor()
 
-        # Function to prompt continuation based on --interactive flag
+        # Function to prompt continuation based on --interactive flag. --yes answers every prompt with yes (batch runs)
         def continue_prompt(message, always_ask=False):
+            if args.yes:
+                return True
             if args.interactive or always_ask:
                 return input(message).lower() in ['y', 'yes']
             return True
@@ -1638,7 +5045,7 @@ def main():
                     print("Invalid input: Please enter numeric values.")
                     return  # Exit the function or ask for the input again as appropriate
 
-            executor.execute_calcsky_commands(working_directory, obj_name, system_name, calcsky_values)
+            executor.execute_calcsky_commands(work_dir, obj_name, system_name, calcsky_values)
 
         # Step 4: Read-in processed image files, generate header key info file
         if continue_prompt("Proceed to generate header key info file? (y/n): "):
@@ -1649,13 +5056,13 @@ def main():
            # Define patterns based on system_name
            if system_name in ['ACS_HRC', 'WFC3_IR', 'NIRCAM', 'NIRISS', 'MIRI', 'ROMAN']:
                # Include only .fits files that do not have extra identifiers like .sky.fits, .res.fits, etc.
-               chip_files = [f for f in os.listdir(working_directory) if f.endswith('.fits') and not re.search(r'\.(sky|res|psf|chip1|chip2)\.fits$', f)]
+               chip_files = [f for f in os.listdir(work_dir) if f.endswith('.fits') and not re.search(r'\.(sky|res|psf|chip1|chip2)\.fits$', f)]
            elif system_name == 'WFPC2':
                # Include files for chip1 through chip4
-               chip_files = [f for f in os.listdir(working_directory) if re.match(r'.*\.chip[1-4]\.fits$', f)]
+               chip_files = [f for f in os.listdir(work_dir) if re.match(r'.*\.chip[1-4]\.fits$', f)]
            else:
                # Find .chip1 and .chip2, default case for other systems
-               chip_files = [f for f in os.listdir(working_directory) if re.match(r'.*\.chip[12]\.fits$', f)]
+               chip_files = [f for f in os.listdir(work_dir) if re.match(r'.*\.chip[12]\.fits$', f)]
 
            # Exclude files with specific patterns
            chip_files = [f for f in chip_files if not re.search(r'\.(sky|res|psf)\.fits$', f)]
@@ -1672,14 +5079,14 @@ def main():
             print("Starting parameter file creation...")
             system_name = config['DOLPHOT_CONFIG'].get('system_name')
             obj_name = config['DOLPHOT_CONFIG'].get('obj_name')
-            selected_files = executor.find_chip_files(working_directory, system_name)
+            selected_files = executor.find_chip_files(work_dir, system_name)
             Nimg = len(selected_files) - 1
             print(f"Number of image files (Nimg): {Nimg}")
             customizations = {}
             #if you would like to change the shift or form for any individual file in parameter file, activate --customize_img
             if args.customize_img:
                 customizations = executor.customize_image_parameters(selected_files)
-            file_created, is_new_file = executor.write_parameter_file(selected_files, customizations, 'config.ini')
+            file_created, is_new_file = executor.write_parameter_file(selected_files, customizations, 'config.ini', overwrite=True if args.yes else None)
             if file_created:
                 print(f"Parameter file '{obj_name}_phot.param' created/updated successfully!")
             else:
@@ -1689,7 +5096,7 @@ def main():
         if continue_prompt("Proceed to execute dolphot? This can take a while and should not be interrupted. (y/n): ", always_ask=True):
             if file_created:  # Ensure parameter file was created/updated successfully
                 param_file = f"{obj_name}_{system_name}_phot.param" #If you ran into error, and attempted to make parameter file manually, make sure file name matches this syntax
-                executor.execute_dolphot(obj_name, param_file, working_directory, config)
+                executor.execute_dolphot(obj_name, param_file, work_dir, config, prompt=not args.yes)
             else:
                 print("Parameter file was not created successfully. Dolphot execution aborted.")
 
@@ -1698,7 +5105,7 @@ def main():
         executor = TerminalCommandExecutor()
         config = configparser.ConfigParser()
         config.read('config.ini')
-        working_directory = os.getcwd()
+        work_dir = os.getcwd()
         
         # Get both obj_name and system_name from config
         obj_name = config['DOLPHOT_CONFIG'].get('obj_name')
@@ -1717,18 +5124,66 @@ def main():
 
         # Check if the parameter file exists
         if os.path.isfile(param_file):
-            executor.execute_dolphot(obj_name, param_file, working_directory, config)  # Pass config as well
+            build_cache = DolphotBuildCache.from_config(config)
+            if build_cache:
+                build_cache.activate(system_name)
+            executor.execute_dolphot(obj_name, param_file, work_dir, config, prompt=not args.yes)  # Pass config as well
         else:
             print(f"Parameter file '{param_file}' does not exist. Please ensure the file is in the current directory and named correctly.")
             exit(1)  # Exit if the parameter file does not exist
 
+    # New epochs or filters of a field measured at the positions of an existing catalog
+    if args.forced_phot is not None:
+        config = configparser.ConfigParser()
+        config.optionxform = str  # Preserve case sensitivity of dolphot parameters
+        config.read('config.ini')
+        try:
+            ForcedPhotometry.from_config(config, args.forced_phot or None).run(os.getcwd(), config, prompt=not args.yes)
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit(1)
+
+    # Compare dolphot parameter choices on the same field
+    if args.sweep:
+        config = configparser.ConfigParser()
+        config.optionxform = str  # Preserve case sensitivity of dolphot parameters
+        config.read('config.ini')
+        try:
+            ParameterSweep.from_config(config).run(os.getcwd(), config, prompt=not args.yes)
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit(1)
+
+    # Check on a dolphot run started with --dolphot or --dolphot_only, e.g. from another terminal or a scheduler
+    if args.dolphot_status:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        obj_name = config['DOLPHOT_CONFIG'].get('obj_name')
+        system_name = config['DOLPHOT_CONFIG'].get('system_name')
+        status_file = f"dolphot_{obj_name}_{system_name}.status.json"
+        if os.path.isfile(status_file):
+            status = DolphotProgressMonitor.read_status(status_file)
+            for key, value in status.items():
+                print(f"{key}: {value}")
+        else:
+            print(f"No status file '{status_file}' found. Has dolphot been started in this directory?")
+
+    # Run many fields at once, each in its own directory with its own config.ini
+    if args.batch:
+        runner = BatchRunner(BatchRunner.read_field_list(args.batch), max_cpus=args.batch_cpus, max_mem_gb=args.batch_mem_gb, resume=args.batch_resume)
+        runner.run()
+
+    # Analyze catalogs as soon as dolphot finishes them
+    if args.watch is not None:
+        PhotWatcher(BatchRunner.read_field_list(args.watch or ['.']), max_workers=args.watch_workers).run()
+
     # Say you ran up to 'splitgroups', and want to know more about your image files before executing dolphot, call this argument.
     if args.headerkeys:
         print("Headerkey mode activated.")
 
         config = configparser.ConfigParser()
         config.read('config.ini')
-        working_directory = os.getcwd()
+        work_dir = os.getcwd()
         system_name = config['DOLPHOT_CONFIG'].get('system_name')
         obj_name = config['DOLPHOT_CONFIG'].get('obj_name')  # Assumes config.ini exists and 'obj_name' is defined
         output_file = f'headerkey_{obj_name}.info'
@@ -1737,13 +5192,13 @@ def main():
         # Define patterns based on system_name
         if system_name in ['ACS_HRC', 'WFC3_IR', 'NIRCAM', 'NIRISS', 'MIRI', 'ROMAN']:
             # Include only .fits files that do not have extra identifiers like .sky.fits, .res.fits, etc.
-            chip_files = [f for f in os.listdir(working_directory) if f.endswith('.fits') and not re.search(r'\.(sky|res|psf|chip1|chip2)\.fits$', f)]
+            chip_files = [f for f in os.listdir(work_dir) if f.endswith('.fits') and not re.search(r'\.(sky|res|psf|chip1|chip2)\.fits$', f)]
         elif system_name == 'WFPC2':
             # Include files for chip1 through chip4
-            chip_files = [f for f in os.listdir(working_directory) if re.match(r'.*\.chip[1-4]\.fits$', f)]
+            chip_files = [f for f in os.listdir(work_dir) if re.match(r'.*\.chip[1-4]\.fits$', f)]
         else:
             # Default case for other systems
-            chip_files = [f for f in os.listdir(working_directory) if re.match(r'.*\.chip[12]\.fits$', f)]
+            chip_files = [f for f in os.listdir(work_dir) if re.match(r'.*\.chip[12]\.fits$', f)]
 
         # Exclude files with specific patterns
         chip_files = [f for f in chip_files if not re.search(r'\.(sky|res|psf)\.fits$', f)]
@@ -1761,19 +5216,19 @@ def main():
 
     # Say you executed --dolphot, and now you want to work with the photometry output, call --phot for plotting, --save_data to generate data file
     # Use both --phot --save_data to do both simultaneously
-    if args.phot or args.save_data:
+    if args.phot or args.save_data or args.hess or args.cmd_regions or args.quality_maps or args.completeness or args.dereddening or args.decontaminate:
         # Takes in the photometry output of dolphot and performs various calculations and makes many plots
         # You should generate 'config.ini' file in the same directory as your script/photometry files
         # Under [DOLPHOT_CONFIG] define: obj_name, distance, and proximity_threshold_pc
         # If you have not run --dolphot before running this command, then also inlcude phot_file, ref_file in [DOLPHOT_CONFIG]
-        working_directory = os.getcwd()
+        work_dir = os.getcwd()
         executor = TerminalCommandExecutor() 
         config = configparser.ConfigParser()
         config.optionxform = str  # Preserve case sensitivity
         config.read('config.ini')
         
         # Update config with files if they exist in the working directory
-        executor.update_config_with_files(config, working_directory)
+        executor.update_config_with_files(config, work_dir)
 
         # Check if 'config.ini' is in the same directory as script
         # If missing, ask for the necessary information
@@ -1816,12 +5271,20 @@ def main():
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
         
-        plotter = PlotManager(config, obj_name, distance, pdf=args.pdf, proximity_thresholds=proximity_thresholds, data_dir=data_dir, use_brightest_star=args.use_brightest_star)
-        prepared_data = plotter.prepare_data()
-        
-        if prepared_data is None:
-            print("Error: Data preparation failed.")
-            exit(1)
+        plotter = PlotManager(config, obj_name, distance, pdf=args.pdf, proximity_thresholds=proximity_thresholds, data_dir=data_dir, use_brightest_star=args.use_brightest_star, compact=args.compact, cutout_background=args.cutout_background)
+
+        # Straight from the .phot file, before the plots that overlay them
+        if args.quality_maps:
+            try:
+                plotter.make_quality_maps()
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        if args.phot or args.save_data or args.hess or args.cmd_regions or args.completeness or args.dereddening or args.decontaminate:
+            prepared_data = plotter.prepare_data(sn_coords=args.sn_coords)
+            if prepared_data is None:
+                print("Error: Data preparation failed.")
+                exit(1)
 
         if args.save_data:
             processed_data = plotter.process_data(prepared_data)
@@ -1833,6 +5296,38 @@ def main():
             for data, threshold in zip(processed_data, plotter.proximity_thresholds):
                 plotter.save_processed_data(data, obj_name, threshold, blue_label, red_label)
 
+        # Region membership bits next to the saved catalogs
+        if args.cmd_regions:
+            try:
+                plotter.make_cmd_regions(prepared_data)
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        # Corrected magnitudes next to the saved catalogs
+        if args.dereddening:
+            try:
+                plotter.make_dereddening(prepared_data)
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        # Completeness of the saved catalogs from artificial star tests
+        if args.completeness:
+            try:
+                plotter.make_completeness()
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        # Membership probabilities next to the saved catalogs
+        if args.decontaminate:
+            try:
+                plotter.make_decontamination(prepared_data, not args.no_titles)
+            except ValueError as e:
+                print(f"Error: {e}")
+
+        # Binned CMDs for all thresholds in one pass
+        if args.hess:
+            plotter.make_hess(prepared_data, not args.no_titles)
+
         # Execute plotting if --phot is specified
         if args.phot:
             # Load all datasets and calculate global minimum and maximum magnitudes
@@ -1861,8 +5356,98 @@ def main():
                     print(f"Failed to load data for threshold {threshold} pc.")
 
             # Now plot with the global minimum and maximum magnitudes
-            for threshold, data in all_data:
-                plotter.plot_data_from_file(data, threshold, global_min_mag, global_max_mag, not args.no_titles)
+            plotter.plot_all_from_files(all_data, global_min_mag, global_max_mag, not args.no_titles, animate=args.animate)
+
+    # Join several epochs of the same field into light curves
+    if args.crossmatch:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        try:
+            matcher = EpochCrossMatcher.from_config(config)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        settings = config['CROSSMATCH'] if 'CROSSMATCH' in config else {}
+        matcher.run(settings.get('output') or os.path.join('data', f"{config['DOLPHOT_CONFIG'].get('obj_name', 'field')}_lightcurves"))
+
+    # One catalog from several overlapping pointings
+    if args.mosaic_merge:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        try:
+            MosaicMerger.from_config(config).run()
+        except (ValueError, IOError) as e:
+            print(f"Error: {e}")
+            exit(1)
+
+    # Quick look at the SN environment in many images at once
+    if args.cutout:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        obj_name = config['DOLPHOT_CONFIG'].get('obj_name') if 'DOLPHOT_CONFIG' in config else None
+        try:
+            sn_ra, sn_dec = resolve_coordinates(obj_name, args.sn_coords or 'simbad')
+        except ValueError as e:
+            print(f"Error: {e}. Pass --sn_coords RA,DEC")
+            exit(1)
+        service = CutoutService()
+        cutouts = service.cutouts([(image, sn_ra, sn_dec, args.cutout_size) for image in args.cutout])
+        os.makedirs('cutouts', exist_ok=True)
+        for image, cutout in zip(args.cutout, cutouts):
+            output_file = os.path.join('cutouts', f"{os.path.splitext(os.path.basename(image))[0]}_{args.cutout_size}px.fits")
+            fits.PrimaryHDU(cutout.data, header=cutout.wcs.to_header(relax=True)).writeto(output_file, overwrite=True)
+        service.save_panel(cutouts, sn_ra, sn_dec, os.path.join('cutouts', f"{obj_name or 'sn'}_cutouts.png"))
+
+    # Pre/post-explosion subtraction for progenitor searches
+    if args.diff_image:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        try:
+            imager = DifferenceImager.from_config(config)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        sn_coords = None
+        try:
+            sn_coords = resolve_coordinates(config['DOLPHOT_CONFIG'].get('obj_name'), args.sn_coords or 'simbad')
+        except ValueError as e:
+            print(f"Warning: {e}. Pass --sn_coords RA,DEC for the residual map")
+        imager.run(sn_coords)
+
+    # Zoom and pan through the whole catalog in the browser
+    if args.explore:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        settings = config['DOLPHOT_CONFIG']
+        try:
+            catalog = load_catalog('.', args.sn_coords or 'simbad', compact=args.compact)
+        except ValueError as e:
+            print(f"Error: {e}")
+            exit(1)
+        explorer = TileExplorer(catalog, os.path.join('data', f"{settings.get('obj_name')}_explorer"), int(settings.get('explore_levels', 6)),
+                                quality_cut=settings.get('explore_quality_cut', 'yes').lower() in ('yes', 'true', '1'))
+        explorer.build()
+        explorer.serve(args.explore)
+
+    # Keep catalogs loaded between requests. The socket, idle eviction and memory cap can be set in config.ini
+    if args.daemon or args.daemon_request:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        daemon = KarlachDaemon.from_config(config)
+        if args.daemon:
+            daemon.serve()
+        else:
+            try:
+                reply = KarlachDaemon.request(daemon.socket_path, json.loads(args.daemon_request))
+            except OSError as e:
+                print(f"Could not reach the Karlach daemon on {daemon.socket_path}: {e}. Start it with --daemon")
+                exit(1)
+            print(json.dumps(reply, indent=2))
+
+    # Measure Karlach's own overhead on synthetic data, without needing DOLPHOT installed
+    if args.benchmark:
+        benchmark = DolphotBenchmark([scale.strip() for scale in args.benchmark.split(',')], args.bench_stub_runtime, args.bench_keep)
+        benchmark.run()
 
     if args.disthist:
         # Create histogram object using config or manual input
@@ -1877,8 +5462,8 @@ def main():
         if wcs is None:
             return
         
-        # Get object coordinates (keeps original interactive prompt)
-        obj_ra, obj_dec = histogram.get_object_coordinates()
+        # Get object coordinates (keeps original interactive prompt, unless --sn_coords is given)
+        obj_ra, obj_dec = histogram.get_object_coordinates(args.sn_coords)
         
         # Calculate distances for all stars
         distances = histogram.calculate_distances(wcs, obj_ra, obj_dec)
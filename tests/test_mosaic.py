@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+for module in ('numpy', 'matplotlib', 'scipy', 'astropy', 'astroquery', 'stwcs'):
+    pytest.importorskip(module)
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Karlach
+
+
+def write_field(field_dir, name, x, y, sn):
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [150.0, 2.0]
+    wcs.wcs.crpix = [1000.5, 1000.5]
+    wcs.wcs.cdelt = [-0.04 / 3600, 0.04 / 3600]
+    ref_file = os.path.join(field_dir, f'{name}.fits')
+    fits.PrimaryHDU(np.zeros((10, 10), dtype=np.float32), header=wcs.to_header()).writeto(ref_file)
+    phot = np.zeros((len(x), 40))
+    phot[:, 2], phot[:, 3], phot[:, 9], phot[:, 19], phot[:, 32] = x, y, 0.1, sn, sn
+    phot_file = os.path.join(field_dir, f'{name}.phot')
+    np.savetxt(phot_file, phot, fmt='%.4f')
+    with open(phot_file + '.columns', 'w') as f:
+        f.writelines(f"{index + 1}. Column {index + 1}\n" for index in range(40))
+    return name, phot_file, ref_file
+
+
+def test_identical_crowded_catalogs_merge_one_to_one(tmp_path):
+    # 5000 stars in a crowded 2000x2000 pixel field, many closer to each other than the tolerance (0.1" = 2.5 pixels)
+    rng = np.random.default_rng(2)
+    x, y = rng.uniform(0, 2000, (2, 5000))
+    fields = [write_field(tmp_path, name, x, y, rng.uniform(5, 50, 5000)) for name in ('a', 'b')]
+    merger = Karlach.MosaicMerger(fields, str(tmp_path / 'mosaic.phot'), tolerance_arcsec=0.1, strip_arcsec=10.0)
+    merger.run()
+    origin = np.load(str(tmp_path / 'mosaic.phot.origin.npy'))
+    assert len(origin) == 5000
+    # Every star is kept exactly once, from one of the two fields
+    assert sorted(origin[:, 1]) == list(range(5000))
+    assert len(np.loadtxt(str(tmp_path / 'mosaic.phot'), ndmin=2)) == 5000
+
+
+def test_close_distinct_stars_are_not_merged():
+    merger = Karlach.MosaicMerger([], 'unused.phot', tolerance_arcsec=1.0, strip_arcsec=10.0)
+    # Two stars 0.5" apart in field 0, and the best measured star between them in field 1: only its nearest neighbor is the same star
+    xi = np.array([0.0, 0.5, 0.2])
+    eta = np.zeros(3)
+    field_id = np.array([0, 0, 1])
+    rank = np.array([1, 2, 0])
+    assert merger.find_duplicates(xi, eta, field_id, rank).tolist() == [True, False, False]
@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import time
+
+import pytest
+
+for module in ('numpy', 'matplotlib', 'scipy', 'astropy', 'astroquery', 'stwcs'):
+    pytest.importorskip(module)
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Karlach
+
+SN_RA, SN_DEC = 150.0, 2.0
+
+
+def make_field(field_dir, watch_args=None, n_stars=60):
+    # A small field: reference image with a TAN WCS around the SN, and a .phot/.columns pair of well measured stars near the SN
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = [SN_RA, SN_DEC]
+    wcs.wcs.crpix = [100.5, 100.5]
+    wcs.wcs.cdelt = [-0.04 / 3600, 0.04 / 3600]
+    fits.PrimaryHDU(np.zeros((200, 200), dtype=np.float32), header=wcs.to_header()).writeto(os.path.join(field_dir, 'ref.fits'))
+
+    rng = np.random.default_rng(1)
+    phot = np.zeros((n_stars, 40))
+    phot[:, 2:4] = 100.5 + rng.uniform(-80, 80, (n_stars, 2))
+    phot[:, 9] = 0.05
+    phot[:, 10] = 1
+    phot[:, 15], phot[:, 17], phot[:, 19], phot[:, 20] = rng.uniform(22, 25, n_stars), 0.05, 20.0, 0.01
+    phot[:, 28], phot[:, 30], phot[:, 32], phot[:, 33] = rng.uniform(21, 24, n_stars), 0.05, 20.0, 0.01
+    np.savetxt(os.path.join(field_dir, 'SNtest_WFC3_UVIS.phot'), phot, fmt='%.4f')
+    with open(os.path.join(field_dir, 'SNtest_WFC3_UVIS.phot.columns'), 'w') as f:
+        for index in range(40):
+            f.write(f"{index + 1}. Quantity {index + 1}, {'WFC3_F475W' if index < 24 else 'WFC3_F814W'}\n")
+
+    with open(os.path.join(field_dir, 'config.ini'), 'w') as f:
+        f.write("[DOLPHOT_CONFIG]\nobj_name = SNtest\nsystem_name = WFC3_UVIS\nphot_file = SNtest_WFC3_UVIS.phot\nref_file = ref.fits\n"
+                "distance = 1000000\nproximity_threshold_pc = 20, 50\n")
+        if watch_args:
+            f.write(f"watch_args = {watch_args}\n")
+
+
+class PhotWatcherUnderTest(Karlach.PhotWatcher):
+    def __init__(self, field_dirs, status_file):
+        super().__init__(field_dirs, max_workers=1, settle_seconds=0, poll_interval=0, status_file=status_file)
+
+    def run_until_finished(self, timeout=300):
+        # The polling loop of run(), stopped once every queued analysis has finished
+        status = self.load_status()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.collect(status)
+            self.scan(status, time.time())
+            self.start(status)
+            self.save_status(status)
+            if status and not self.queue and not self.running and all(entry['state'] in ('done', 'failed') for entry in status.values()):
+                return status
+            time.sleep(0.2)
+        raise TimeoutError(f"Analyses still running after {timeout}s: {status}")
+
+
+def test_watched_catalog_runs_to_done(tmp_path, monkeypatch):
+    monkeypatch.setenv('MPLBACKEND', 'Agg')
+    # Coordinates are given, so the analysis does not depend on SIMBAD being reachable
+    make_field(tmp_path, watch_args=f"--phot --save_data --pdf --sn_coords {SN_RA},{SN_DEC}")
+    watcher = PhotWatcherUnderTest([str(tmp_path)], status_file=str(tmp_path / 'watch_status.json'))
+    status = watcher.run_until_finished()
+    (entry,) = status.values()
+    with open(entry['log']) as f:
+        log = f.read()
+    assert entry['state'] == 'done', log
+    assert entry['returncode'] == 0
+    assert os.path.isfile(tmp_path / 'data' / 'SNtest_50.0pc_WFC3_F475W_WFC3_F814W_full.npy')
+
+
+def test_prepare_data_without_terminal_queries_simbad(tmp_path, monkeypatch):
+    # --watch runs the analysis with stdin closed: prepare_data must not stop at the SIMBAD/manual prompt
+    make_field(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'stdin', io.StringIO())
+    monkeypatch.setattr('builtins.input', lambda prompt='': pytest.fail(f"prompted: {prompt}"))
+    monkeypatch.setattr(Karlach.PlotManager, 'query_simbad', lambda self: (SN_RA, SN_DEC))
+    config = Karlach.configparser.ConfigParser()
+    config.optionxform = str
+    config.read('config.ini')
+    plotter = Karlach.PlotManager(config, 'SNtest', 1e6, [20.0, 50.0], data_dir=str(tmp_path))
+    prepared = plotter.prepare_data()
+    assert prepared is not None
+    assert (prepared.sn_ra, prepared.sn_dec) == (SN_RA, SN_DEC)
+
+
+def test_default_watch_args_do_not_prompt():
+    assert '--sn_coords' in Karlach.PhotWatcher.DEFAULT_ARGS